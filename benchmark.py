@@ -0,0 +1,461 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, datetime
+
+import numpy as np
+import pandas as pd
+
+try:
+    import resource
+    HAS_RESOURCE = True
+except ImportError:   # Windows
+    HAS_RESOURCE = False
+
+# Streamlit warns about a missing script context on every cached call outside `streamlit run`
+os.environ.setdefault("STREAMLIT_LOGGER_LEVEL", "error")
+
+import db_utils
+import data_cache
+import expense_store
+import ingest
+import logistics_pro
+import migrations
+import report_center
+import rollups
+import snapshots
+
+# --- BENCHMARK SUITE ---
+# Generates a synthetic register (manifests, CNs, branch and HO expenses, hub/spoke branch
+# mappings) at a chosen scale, loads it into PostgreSQL and times the app's core paths.
+# Everything lives in its own schema (default `benchmark`, dropped and re-created), so
+# point it at a local or scratch database:
+#
+#   DATABASE_URL=postgresql://localhost/logistics python benchmark.py --scale 100k
+#   python benchmark.py --scale 1m --reuse --compare benchmark-1m.json
+#
+# With DB_BACKEND=duckdb the tables are (re)created in DUCKDB_PATH instead, which should
+# be a scratch file: DB_BACKEND=duckdb DUCKDB_PATH=bench.duckdb python benchmark.py
+#
+# Results go to a JSON file (--out) that later runs can --compare against.
+
+SCALES = {"10k": 10_000, "100k": 100_000, "1m": 1_000_000, "5m": 5_000_000}
+CHUNK_ROWS = 200_000       # CNs generated and COPYed per batch
+CNS_PER_MANIFEST = 40
+GRID_PAGE = 1000
+REGRESSION_RATIO = 1.25    # --compare flags steps this much slower than the baseline
+
+HO_BRANCH = "PATNA (JAMAL ROAD)"
+BASE_BRANCHES = [
+    HO_BRANCH, "Madhubani", "Darbhanga", "Motihari", "Raxaul", "GAYA", "MUZAFFARPUR",
+    "SITAMARHI", "BHAGALPUR", "PURNIA", "SAMASTIPUR", "BEGUSARAI",
+]
+SALES_TYPES = ["TO PAY", "PAID", "TO BE BILLED", "BILLED", "FOC"]
+SALES_TYPE_WEIGHTS = [0.40, 0.35, 0.15, 0.07, 0.03]
+PKG_TYPES = ["CARTON", "BAG", "BUNDLE", "DRUM", "PKT"]
+BRANCH_EXPENSES = ["rent", "vehicle", "transfer_to_ho", "tea", "labour", "fuel", "loading",
+                   "unloading", "electricity", "stationery", "telephone", "repair"]
+HO_EXPENSES = ["salary", "electricity", "internet", "rent", "audit", "insurance", "stationery",
+               "telephone", "travel", "legal", "software", "repair"]
+
+# --- SYNTHETIC DATA ---
+
+def make_spec(cns, months=6, branches=24, expense_cols=24, ho_expense_cols=12, seed=42, import_rows=None, update_rows=None):
+    return {
+        "cns": cns, "months": months, "branches": branches, "hubs": max(1, branches // 6),
+        "expense_cols": expense_cols, "ho_expense_cols": ho_expense_cols, "seed": seed,
+        "import_rows": import_rows or max(1000, cns // 10),
+        "update_rows": update_rows or max(1000, cns // 10),
+    }
+
+def _names(base, count, prefix):
+    return (base + [f"{prefix}_{i:02d}" for i in range(1, count - len(base) + 1)])[:count]
+
+def branch_names(spec):
+    return _names(BASE_BRANCHES, spec["branches"], "BR")
+
+def branch_mappings(spec):
+    """
+    Hub/spoke layout: the first `hubs` branches are hubs, the rest report to one of them.
+    """
+    names = branch_names(spec)
+    hubs, spokes = names[:spec["hubs"]], names[spec["hubs"]:]
+    return pd.DataFrame({"child_branch": spokes, "parent_branch": [hubs[i % len(hubs)] for i in range(len(spokes))]})
+
+def period(spec, today=None):
+    """
+    (start, end): the last `months` calendar months up to today, so closed and open months both occur.
+    """
+    end = today or date.today()
+    m = end.year * 12 + end.month - 1 - (spec["months"] - 1)
+    return date(m // 12, m % 12 + 1, 1), end
+
+def _manifests(spec):
+    """
+    Per-manifest date / from / to, for every CN the run will create (seeded + imported).
+    """
+    rng = np.random.default_rng(spec["seed"])
+    start, end = period(spec)
+    count = -(-(spec["cns"] + spec["import_rows"]) // CNS_PER_MANIFEST)
+    days = (end - start).days + 1
+    names = np.array(branch_names(spec), dtype=object)
+    dates = pd.to_datetime(start) + pd.to_timedelta(rng.integers(0, days, count), unit="D")
+    from_ho = rng.random(count) < 0.7
+    return {
+        "manifest_no": np.array([f"MF{i:07d}" for i in range(count)], dtype=object),
+        "manifest_date": dates.date,
+        "dispatch_from": np.where(from_ho, HO_BRANCH, names[rng.integers(0, len(names), count)]),
+        "dispatch_to": names[rng.integers(0, len(names), count)],
+    }
+
+def generate_entries(spec, manifests, first, count, seed):
+    """
+    logistics_entries rows for CN numbers [first, first + count), as one DataFrame.
+    """
+    rng = np.random.default_rng(seed)
+    ids = np.arange(first, first + count)
+    m = ids // CNS_PER_MANIFEST
+    parties = max(50, spec["cns"] // 200)
+    # Few large parties, a long tail of small ones
+    consignor = (rng.pareto(1.2, count) * 10).astype(np.int64) % parties
+    amount = np.round(rng.lognormal(6, 0.8, count), 0)
+    outcome = rng.random(count)
+    manual = np.select(
+        [outcome < 0.60, outcome < 0.75, outcome < 0.90],
+        [amount, 0, np.round(amount * rng.uniform(0.5, 0.95, count), 0)],
+        np.round(amount * rng.uniform(1.05, 1.3, count), 0),
+    )
+    sales_type = np.array(SALES_TYPES, dtype=object)[rng.choice(len(SALES_TYPES), count, p=SALES_TYPE_WEIGHTS)]
+    manifest_date = pd.to_datetime(manifests["manifest_date"][m])
+    return pd.DataFrame({
+        "manifest_no": manifests["manifest_no"][m],
+        "manifest_date": manifest_date.date,
+        "cn_no": pd.Series(ids).astype(str).str.zfill(8).radd("CN").to_numpy(),
+        "cn_date": (manifest_date - pd.to_timedelta(rng.integers(0, 4, count), unit="D")).date,
+        "consignor": pd.Series(consignor).astype(str).radd("PARTY ").to_numpy(),
+        "consignee": pd.Series(rng.integers(0, parties, count)).astype(str).radd("PARTY ").to_numpy(),
+        "payment_liability": pd.Series(consignor).astype(str).radd("PARTY ").to_numpy(),
+        "no_of_pkgs": rng.integers(1, 21, count),
+        "pkg_type": np.array(PKG_TYPES, dtype=object)[rng.integers(0, len(PKG_TYPES), count)],
+        "actual_wt": rng.integers(1, 500, count).astype(str),
+        "consignor_invoice_no": pd.Series(ids).astype(str).radd("INV").to_numpy(),
+        "dispatch_from": manifests["dispatch_from"][m],
+        "dispatch_to": manifests["dispatch_to"][m],
+        "sales_type": sales_type,
+        "sales_amount": amount,
+        "manual_figures": manual,
+        "created_by": "benchmark",
+    })
+
+def branch_expense_columns(spec):
+    return _names(BRANCH_EXPENSES, spec["expense_cols"], "misc")
+
+def ho_expense_columns(spec):
+    return _names(HO_EXPENSES, spec["ho_expense_cols"], "ho_misc")
+
+def generate_branch_expenses(spec, manifests):
+    """
+    One branch_expenses row per seeded manifest, wide (one column per expense type, as the
+    editor shows it); most minor expense heads are zero.
+    """
+    rng = np.random.default_rng(spec["seed"] + 1)
+    count = -(-spec["cns"] // CNS_PER_MANIFEST)
+    df = pd.DataFrame({
+        "manifest_no": manifests["manifest_no"][:count],
+        "manifest_date": manifests["manifest_date"][:count],
+        "origin": manifests["dispatch_from"][:count],
+        "destination": manifests["dispatch_to"][:count],
+    })
+    for i, col in enumerate(branch_expense_columns(spec)):
+        scale = {"rent": 500, "vehicle": 3000, "transfer_to_ho": 20000}.get(col, 200)
+        used = rng.random(count) < (0.9 if i < 3 else 0.3)
+        df[col] = np.where(used, np.round(rng.uniform(0.2, 1.0, count) * scale, 0), 0)
+    return df
+
+def generate_ho_expenses(spec):
+    rng = np.random.default_rng(spec["seed"] + 2)
+    start, end = period(spec)
+    days = pd.date_range(start, end).date
+    df = pd.DataFrame({"entry_date": days})
+    for col in ho_expense_columns(spec):
+        df[col] = np.round(rng.uniform(0, 5000, len(days)), 0)
+    return df
+
+def expense_lines(df, key):
+    """
+    A wide expense frame as (key, expense_type, amount) lines, zeros left out.
+    """
+    lines = df.drop(columns=[c for c in df.columns if c in ("manifest_date", "origin", "destination")])
+    lines = lines.melt(id_vars=key, var_name="expense_type", value_name="amount")
+    return lines[lines["amount"] != 0]
+
+def _reset(cur, spec, schema):
+    if db_utils.is_postgres():
+        cur.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE")
+        cur.execute(f"CREATE SCHEMA {schema}")
+    else:
+        # Start from an empty file, as far as the app's tables go
+        cur.execute("DROP VIEW IF EXISTS master_data")
+        for table in ["logistics_entries", "branch_expenses", "ho_expenses", "branch_mappings", "benchmark_meta",
+                      "expense_types", "branch_expense_lines", "ho_expense_lines", "schema_version"]:
+            cur.execute(f"DROP TABLE IF EXISTS {table}")
+        cur.execute("DROP SEQUENCE IF EXISTS logistics_entries_id_seq")
+    cur.execute(db_utils.baseline_schema_sql())
+    cur.execute(db_utils.MASTER_DATA_VIEW)
+    expense_store.seed_types(cur, "branch_expenses", branch_expense_columns(spec))
+    expense_store.seed_types(cur, "ho_expenses", ho_expense_columns(spec))
+    cur.execute("CREATE TABLE benchmark_meta (spec text)")
+
+def seed_database(spec, schema):
+    """
+    Drops and re-creates `schema` and fills it with the synthetic data. Returns seconds taken.
+    """
+    started = time.perf_counter()
+    manifests = _manifests(spec)
+    with db_utils.connection() as conn:
+        with conn.cursor() as cur:
+            _reset(cur, spec, schema)
+            for first in range(0, spec["cns"], CHUNK_ROWS):
+                df = generate_entries(spec, manifests, first, min(CHUNK_ROWS, spec["cns"] - first), spec["seed"] + 10 + first)
+                db_utils.copy_dataframe(cur, "logistics_entries", df, list(df.columns))
+                print(f"  seeded {first + len(df):,} / {spec['cns']:,} CNs", file=sys.stderr)
+            branch, ho = generate_branch_expenses(spec, manifests), generate_ho_expenses(spec)
+            for table, df in [("branch_expenses", branch[expense_store.ENTITIES["branch_expenses"]["info"][:4]]),
+                              ("branch_expense_lines", expense_lines(branch, "manifest_no")),
+                              ("ho_expenses", ho[["entry_date"]]),
+                              ("ho_expense_lines", expense_lines(ho, "entry_date")),
+                              ("branch_mappings", branch_mappings(spec))]:
+                db_utils.copy_dataframe(cur, table, df, list(df.columns))
+            cur.execute("INSERT INTO benchmark_meta VALUES (%s)", (json.dumps(spec, sort_keys=True),))
+    # The rest of the schema (change tracking, rollups, indexes) as the app would add it;
+    # the reset dropped anything an earlier call in this process recorded
+    migrations.migrate.clear()
+    migrations.migrate()
+    with db_utils.connection() as conn:
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute("ANALYZE")
+        conn.autocommit = False
+    return time.perf_counter() - started
+
+def seeded_spec():
+    try:
+        df = db_utils.fetch_data("SELECT spec FROM benchmark_meta")
+    except Exception:   # not seeded yet
+        return None
+    return json.loads(df['spec'].iloc[0]) if not df.empty else None
+
+def write_import_csv(spec, path):
+    """
+    A manifest upload in the app's CSV layout: `import_rows` new CNs plus 5% that already exist.
+    """
+    manifests = _manifests(spec)
+    df = generate_entries(spec, manifests, spec["cns"], spec["import_rows"], spec["seed"] + 3)
+    dups = generate_entries(spec, manifests, 0, min(spec["cns"], spec["import_rows"] // 20), spec["seed"] + 4)
+    df = pd.concat([df, dups], ignore_index=True)
+    for col in ["manifest_date", "cn_date"]:
+        df[col] = pd.to_datetime(df[col]).dt.strftime("%d-%m-%Y")
+    headers = {v: k for k, v in logistics_pro.MANIFEST_COLUMN_MAP.items()}
+    df[list(headers)].rename(columns=headers).to_csv(path, index=False)
+    return len(df)
+
+def write_update_csv(spec, path):
+    """
+    A bulk-update upload: random existing CNs, some cells left blank, a few unknown CN Nos.
+    """
+    rng = np.random.default_rng(spec["seed"] + 5)
+    n = spec["update_rows"]
+    ids = rng.integers(0, spec["cns"] + n // 50, n)
+    df = pd.DataFrame({
+        "CN No": pd.Series(ids).astype(str).str.zfill(8).radd("CN"),
+        "Manual Recvd": np.where(rng.random(n) < 0.8, np.round(rng.lognormal(6, 0.8, n), 0), np.nan),
+        "Sales Amount": np.where(rng.random(n) < 0.2, np.round(rng.lognormal(6, 0.8, n), 0), np.nan),
+        "Remarks": np.where(rng.random(n) < 0.1, "checked", None),
+    })
+    df.to_csv(path, index=False)
+    return n
+
+# --- TIMED STEPS ---
+
+def peak_rss_mb():
+    if not HAS_RESOURCE: return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)   # bytes on macOS, KB on Linux
+
+def timed(results, name, fn, rows=None, repeat=1, detail=None):
+    """
+    Runs `fn` `repeat` times and appends the median / min seconds to `results`. Returns fn's last result.
+    """
+    runs = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        out = fn()
+        runs.append(time.perf_counter() - started)
+    seconds = float(np.median(runs))
+    entry = {"name": name, "seconds": round(seconds, 4), "min": round(min(runs), 4), "runs": [round(r, 4) for r in runs],
+             "rows": rows, "rows_per_s": round(rows / seconds) if rows and seconds else None, "peak_rss_mb": peak_rss_mb()}
+    if detail: entry["detail"] = detail
+    results.append(entry)
+    print(f"  {name:<22} {seconds:9.3f}s" + (f"  {entry['rows_per_s']:>12,} rows/s" if entry['rows_per_s'] else ""), file=sys.stderr)
+    return out
+
+def _quiet(report_fraction=None, text=None):
+    pass
+
+def run_suite(spec, repeat, workdir):
+    results = []
+    start, end = period(spec)
+
+    # Write paths, each through the same functions the pages call
+    path = os.path.join(workdir, "manifest.csv")
+    rows = write_import_csv(spec, path)
+    def manifest_import():
+        with open(path, "rb") as f:
+            chunks = ingest.stream(f, lambda df: logistics_pro.prepare_manifest(df, "benchmark"), "Importing", report=_quiet,
+                                   text_columns=logistics_pro.MANIFEST_TEXT_HEADERS)
+            return logistics_pro.import_manifest(chunks)
+    timed(results, "manifest_import", manifest_import, rows)
+    # Take the imported CNs out again so a --reuse run imports the same rows
+    with db_utils.connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("DELETE FROM logistics_entries WHERE cn_no >= %s RETURNING manifest_date", (f"CN{spec['cns']:08d}",))
+            rollups.refresh_sales_days([r[0] for r in cur.fetchall()], cur)
+
+    path = os.path.join(workdir, "update.csv")
+    rows = write_update_csv(spec, path)
+    def bulk_update():
+        with open(path, "rb") as f:
+            chunks = ingest.stream(f, logistics_pro.prepare_bulk_update, "Applying", report=_quiet,
+                                   text_columns=logistics_pro.UPDATE_TEXT_HEADERS)
+            return logistics_pro.apply_bulk_update(chunks)
+    timed(results, "bulk_update", bulk_update, rows)
+
+    page = db_utils.fetch_data(
+        f"SELECT {', '.join(logistics_pro.REGISTER_COLS)} FROM logistics_entries ORDER BY manifest_date DESC, cn_no DESC LIMIT %s",
+        (GRID_PAGE,))
+    def grid_save():
+        edited = page.assign(manual_figures=pd.to_numeric(page['manual_figures']) + 1)
+        dirty = db_utils.changed_rows(page, edited, logistics_pro.GRID_EDITABLE_COLS)
+        saved = db_utils.bulk_update("logistics_entries", "cn_no", dirty, logistics_pro.GRID_EDITABLE_COLS)
+        rollups.refresh_sales_days(dirty['manifest_date'])
+        return saved
+    timed(results, "grid_save", grid_save, len(page), repeat)
+
+    # Report Center loads: no snapshots yet, from snapshots, from the in-process cache
+    snapshots.SNAPSHOT_DIR = os.path.join(workdir, "snapshots")
+    def load(clear_snapshots):
+        def run():
+            data_cache.invalidate(*report_center.REPORT_TABLES)
+            if clear_snapshots: shutil.rmtree(snapshots.SNAPSHOT_DIR, ignore_errors=True)
+            return report_center.load_frames(start, end, timings)
+        return run
+    timings = {}
+    frames = timed(results, "load_data_cold", load(True), spec["cns"], repeat, detail=timings)
+    timings = {}
+    frames = timed(results, "load_data_snapshots", load(False), spec["cns"], repeat, detail=timings)
+    timed(results, "load_data_cached", lambda: report_center.load_frames(start, end), spec["cns"], repeat)
+    df_log, df_branch, df_ho = frames
+
+    timed(results, "generate_report_1", lambda: report_center.generate_report_1(df_log, df_branch, df_ho), len(df_log), repeat)
+    timed(results, "generate_report_2", lambda: report_center.generate_report_2(df_log), len(df_log), repeat)
+    timed(results, "generate_report_3", lambda: report_center.generate_report_3(df_log), len(df_log), repeat)
+    timed(results, "generate_report_5", lambda: report_center.generate_report_5(df_log, df_branch, df_ho), len(df_log), repeat)
+    def build_reports():
+        data_cache.invalidate(*report_center.REPORT_TABLES)
+        return report_center.build_reports(start, end)
+    r1, r2, r3, _ = timed(results, "build_reports_sql", build_reports, len(df_log), repeat)
+
+    path = os.path.join(workdir, "report.xlsx")
+    timed(results, "excel_export", lambda: report_center.write_excel_master(
+        path, r1, r2, r3, report_center.stream_master_data(start, end), start, end), len(df_log))
+    return results
+
+# --- RESULTS ---
+
+def environment():
+    info = {"python": platform.python_version(), "platform": platform.platform(), "pandas": pd.__version__,
+            "numpy": np.__version__, "cpus": os.cpu_count(), "backend": db_utils.DB_BACKEND}
+    try:
+        info["postgres"] = db_utils.fetch_data("SHOW server_version")['server_version'].iloc[0]
+    except Exception:
+        pass
+    try:
+        info["commit"] = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True,
+                                                 cwd=os.path.dirname(os.path.abspath(__file__))).strip()
+    except (OSError, subprocess.CalledProcessError):
+        pass
+    return info
+
+def compare(results, baseline_path, ratio=REGRESSION_RATIO):
+    """
+    Prints each step against the baseline file; returns the names of steps slower by more than `ratio`.
+    """
+    with open(baseline_path) as f:
+        baseline = {r["name"]: r for r in json.load(f)["results"]}
+    slower = []
+    print(f"\n{'step':<22} {'baseline':>10} {'now':>10} {'ratio':>7}")
+    for r in results:
+        old = baseline.get(r["name"])
+        if not old or not old["seconds"]: continue
+        change = r["seconds"] / old["seconds"]
+        flag = "  SLOWER" if change > ratio else ""
+        if flag: slower.append(r["name"])
+        print(f"{r['name']:<22} {old['seconds']:>9.3f}s {r['seconds']:>9.3f}s {change:>6.2f}x{flag}")
+    return slower
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the Logistics app's core paths on synthetic data.")
+    parser.add_argument("--scale", default="10k", help=f"CNs to generate: {', '.join(SCALES)} or a number")
+    parser.add_argument("--months", type=int, default=6)
+    parser.add_argument("--branches", type=int, default=24)
+    parser.add_argument("--expense-cols", type=int, default=24, help="branch expense columns")
+    parser.add_argument("--ho-expense-cols", type=int, default=12)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--repeat", type=int, default=3, help="runs per read-only step (median reported)")
+    parser.add_argument("--schema", default="benchmark", help="schema the data is created in (dropped first)")
+    parser.add_argument("--reuse", action="store_true", help="keep the schema if it already holds this scale")
+    parser.add_argument("--out", help="results file (default benchmark-<scale>.json)")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    args = parser.parse_args(argv)
+
+    if db_utils.is_postgres() and not os.environ.get("DATABASE_URL"):
+        parser.error("set DATABASE_URL to a local or scratch database")
+    if not db_utils.is_postgres() and not os.environ.get("DUCKDB_PATH"):
+        parser.error("set DUCKDB_PATH to a scratch DuckDB file")
+    if args.schema == "public":
+        parser.error("refusing to drop the public schema; pick a dedicated --schema")
+    cns = SCALES.get(args.scale.lower()) or int(args.scale)
+    spec = make_spec(cns, args.months, args.branches, args.expense_cols, args.ho_expense_cols, args.seed)
+
+    # Every connection (the pool, the app's helpers) resolves tables in the benchmark schema
+    os.environ["PGOPTIONS"] = f"{os.environ.get('PGOPTIONS', '')} -c search_path={args.schema}".strip()
+    seed_s = None
+    if args.reuse and seeded_spec() == spec:
+        print(f"Reusing schema {args.schema}", file=sys.stderr)
+    else:
+        print(f"Seeding {cns:,} CNs into schema {args.schema}", file=sys.stderr)
+        seed_s = seed_database(spec, args.schema)
+
+    workdir = tempfile.mkdtemp(prefix="logistics_bench_")
+    try:
+        results = run_suite(spec, args.repeat, workdir)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    out = args.out or f"benchmark-{args.scale.lower()}.json"
+    report = {"created": datetime.now().isoformat(timespec="seconds"), "spec": spec, "seed_s": seed_s,
+              "environment": environment(), "results": results}
+    slower = compare(results, args.compare) if args.compare else []
+    with open(out, "w") as f:
+        json.dump(report, f, indent=2, default=str)
+    print(f"Results written to {out}", file=sys.stderr)
+    return 1 if slower else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,14 +1,108 @@
 import streamlit as st
 import pandas as pd
 import db_utils  # <--- Cloud Manager
+import data_cache
+import rollups
+import expense_store
+import migrations
+import ingest
+import metrics
 from datetime import datetime
 import io
+import time
+
+# --- MANIFEST IMPORT (Bulk COPY) ---
+
+IMPORT_STANDARD_MAP = {
+    "Manifest No": "manifest_no", "Manifest Date": "manifest_date",
+    "From": "origin", "To": "destination", "Remarks": "remarks"
+}
+IMPORT_TEXT_HEADERS = ["Manifest No", "From", "To", "Remarks"]
+
+def prepare_import(df, db_cols):
+    """
+    Maps the upload to the wide branch_expenses columns (see expense_store.columns) in one pass. Standard columns are taken only when
+    their header is present (so missing ones keep the stored value); every expense column is sent,
+    matched to a header case-insensitively, with blanks and non-numbers as 0. Rows without a
+    Manifest No are dropped.
+    """
+    if "Manifest No" not in df.columns:
+        raise ValueError("The file has no 'Manifest No' column.")
+
+    out = df[[h for h in IMPORT_STANDARD_MAP if h in df.columns]].rename(columns=IMPORT_STANDARD_MAP)
+    if 'manifest_date' in out.columns:
+        out['manifest_date'] = pd.to_datetime(out['manifest_date'], dayfirst=True, errors='coerce').dt.date
+
+    headers = {}
+    for h in df.columns:
+        headers.setdefault(str(h).strip().lower(), h)
+    for col in db_cols:
+        if col in IMPORT_STANDARD_MAP.values(): continue
+        h = headers.get(col.lower())
+        if h is None:
+            out[col] = 0
+        else:
+            values = df[h] if pd.api.types.is_numeric_dtype(df[h]) else df[h].astype(str).str.strip()
+            out[col] = pd.to_numeric(values, errors='coerce').fillna(0)
+
+    return out[out['manifest_no'].notna()]
+
+@metrics.stage("branch.import")
+def import_expenses(chunks):
+    """
+    COPYs the prepared rows (a DataFrame or an iterable of chunks) into a staging table, upserts
+    the header columns into branch_expenses with one INSERT ... ON CONFLICT (manifest_no) DO UPDATE
+    and replaces the manifests' expense lines. A manifest repeated in the file keeps its last row.
+    Returns (inserted, updated, seconds).
+    """
+    started = time.perf_counter()
+    chunks = iter(ingest.as_chunks(chunks))
+    first = next(chunks, None)
+    if first is None: return 0, 0, 0.0
+    cols = list(first.columns)
+    info_cols = [c for c in cols if c in expense_store.ENTITIES["branch_expenses"]["info"]]
+    types = [c for c in cols if c not in info_cols]
+    col_list = ", ".join(f'"{c}"' for c in info_cols)
+    # manifest_no = itself: a file with expense columns only still marks its manifests as changed
+    update_clause = ", ".join(f'"{c}" = EXCLUDED."{c}"' for c in info_cols)
+
+    with db_utils.connection() as conn:
+        with conn.cursor() as cur:
+            stage = db_utils.create_staging_table(cur, "branch_expenses", cols, seq=True,
+                                                  source=expense_store.relation("branch_expenses"))
+            db_utils.copy_dataframe(cur, stage, first, cols)
+            for chunk in chunks:
+                db_utils.copy_dataframe(cur, stage, chunk, cols)
+            cur.execute(f"DELETE FROM {stage} s WHERE EXISTS (SELECT 1 FROM {stage} t WHERE t.manifest_no = s.manifest_no AND t._seq > s._seq)")
+
+            # Days to re-roll: the file's dates plus the current dates of manifests it overwrites
+            date_sql = f"UNION SELECT manifest_date FROM {stage}" if 'manifest_date' in cols else ""
+            cur.execute(f"""
+                SELECT b.manifest_date FROM branch_expenses b JOIN {stage} s USING (manifest_no)
+                {date_sql}
+            """)
+            touched_days = [r[0] for r in cur.fetchall()]
+
+            # Counted before the upsert (portable, unlike RETURNING xmax)
+            cur.execute(f"""
+                SELECT COUNT(*),
+                       COUNT(*) FILTER (WHERE EXISTS (SELECT 1 FROM branch_expenses b WHERE b.manifest_no = s.manifest_no))
+                FROM {stage} s
+            """)
+            total, updated = cur.fetchone()
+
+            cur.execute(f"""
+                INSERT INTO branch_expenses ({col_list})
+                SELECT {col_list} FROM {stage}
+                ON CONFLICT (manifest_no) DO UPDATE SET {update_clause}
+            """)
+            expense_store.replace_lines(cur, "branch_expenses", stage, types)
+            rollups.refresh_branch_days(touched_days, cur)
+
+    return total - updated, updated, time.perf_counter() - started
 
 # --- MAIN APP LOGIC ---
 def app():
-    # Ensure tables exist
-    db_utils.init_all_tables()
-
     st.title("💰 Branch Expense Manager (Cloud ☁️)")
 
     # --- SIDEBAR: TOOLS ---
@@ -17,15 +111,8 @@ def app():
         st.info("Note: This will UPDATE/OVERWRITE existing records if the Manifest No matches.")
         
         # --- TEMPLATE DOWNLOAD ---
-        # Get current columns from Cloud DB
-        conn = db_utils.get_db_connection()
-        if conn:
-            cur = conn.cursor()
-            cur.execute("SELECT * FROM branch_expenses LIMIT 0")
-            db_cols = [desc[0] for desc in cur.description]
-            conn.close()
-        else:
-            db_cols = []
+        # Header columns plus one per expense type in the catalog
+        db_cols = expense_store.columns("branch_expenses")
 
         col_mapping = {
             "manifest_no": "Manifest No",
@@ -54,71 +141,15 @@ def app():
         if uploaded_file:
             if st.button("🚀 Import & Update"):
                 try:
-                    df = pd.read_csv(uploaded_file)
-                    
-                    standard_map = {
-                        "Manifest No": "manifest_no", "Manifest Date": "manifest_date",
-                        "From": "origin", "To": "destination", "Remarks": "remarks"
-                    }
-                    
-                    conn = db_utils.get_db_connection()
-                    cur = conn.cursor()
-                    rows_processed = 0
-                    
-                    # Get valid DB columns again to be safe
-                    cur.execute("SELECT * FROM branch_expenses LIMIT 0")
-                    valid_db_cols = [desc[0] for desc in cur.description]
-                    
-                    for _, row in df.iterrows():
-                        row_data = {}
-                        
-                        # 1. Process Standard Columns
-                        for csv_header, db_col in standard_map.items():
-                            if csv_header in df.columns:
-                                val = row[csv_header]
-                                if db_col == 'manifest_date':
-                                    val = pd.to_datetime(val, dayfirst=True, errors='coerce')
-                                    val = val.strftime('%Y-%m-%d') if pd.notna(val) else None
-                                row_data[db_col] = val
-                        
-                        # 2. Process Expense Columns
-                        for col in valid_db_cols:
-                            if col not in standard_map.values():
-                                csv_match = next((h for h in df.columns if h.strip().lower() == col.lower()), None)
-                                if csv_match:
-                                    val = row[csv_match]
-                                    try:
-                                        val = float(val) if pd.notna(val) else 0
-                                    except:
-                                        val = 0
-                                    row_data[col] = val
-                                else:
-                                    row_data[col] = 0
-
-                        # 3. Construct SQL (Postgres Syntax)
-                        cols = list(row_data.keys())
-                        vals = list(row_data.values())
-                        
-                        col_names = ", ".join([f'"{c}"' for c in cols])
-                        placeholders = ", ".join(["%s"] * len(cols))
-                        
-                        # Construct UPDATE clause for conflict
-                        update_clause = ", ".join([f'"{c}" = EXCLUDED."{c}"' for c in cols if c != 'manifest_no'])
-                        
-                        sql = f"""
-                            INSERT INTO branch_expenses ({col_names})
-                            VALUES ({placeholders})
-                            ON CONFLICT (manifest_no) 
-                            DO UPDATE SET {update_clause};
-                        """
-                        
-                        cur.execute(sql, vals)
-                        rows_processed += 1
-                    
-                    conn.commit()
-                    cur.close()
-                    conn.close()
-                    st.success(f"Success! Processed {rows_processed} records.")
+                    chunks = ingest.stream(uploaded_file, lambda df: prepare_import(df, db_cols), "Importing",
+                                           text_columns=IMPORT_TEXT_HEADERS)
+                    inserted, updated, _ = import_expenses(chunks)
+                    data_cache.invalidate("branch_expenses")
+
+                    skipped = chunks.rows_read - chunks.rows
+                    st.success(f"Success! Processed {inserted + updated} records ({inserted} new, {updated} updated"
+                               + (f", {skipped} without Manifest No skipped" if skipped else "") + ").")
+                    st.caption(chunks.summary())
                 
                 except Exception as e:
                     st.error(f"Import Error: {e}")
@@ -131,7 +162,7 @@ def app():
         if st.button("➕ Add Column"):
             if new_col:
                 clean_name = new_col.strip().replace(" ", "_").lower()
-                db_utils.add_column_if_not_exists("branch_expenses", clean_name)
+                expense_store.add_expense_type("branch_expenses", clean_name)
                 st.success(f"Added '{clean_name}'")
                 st.rerun()
 
@@ -139,20 +170,16 @@ def app():
     st.header("Expense Entry Register")
 
     # 1. Load Data
-    conn = db_utils.get_db_connection()
-    if not conn: st.stop()
-    
     col1, col2 = st.columns(2)
     start_date = col1.date_input("From Date", datetime(2025, 1, 1), key="exp_start")
     end_date = col2.date_input("To Date", datetime.now(), key="exp_end")
 
-    query = f"SELECT * FROM branch_expenses WHERE manifest_date >= '{start_date}' AND manifest_date <= '{end_date}'"
-    df_expenses = pd.read_sql(query, conn)
-    conn.close()
+    query = f"SELECT * FROM {expense_store.relation('branch_expenses')} WHERE manifest_date >= '{start_date}' AND manifest_date <= '{end_date}'"
+    df_expenses = db_utils.fetch_data(query)
 
     if not df_expenses.empty:
         # 2. Identify Expense Columns
-        info_cols = ['manifest_no', 'manifest_date', 'origin', 'destination', 'remarks']
+        info_cols = ['manifest_no', 'manifest_date', 'origin', 'destination', 'remarks', 'updated_at']
         expense_cols = [c for c in df_expenses.columns if c not in info_cols]
         
         # 3. Calculate TOTAL
@@ -177,26 +204,11 @@ def app():
         
         # 5. Save Changes
         if st.button("💾 Save Expenses"):
-            conn = db_utils.get_db_connection()
-            cur = conn.cursor()
-            
             save_cols = expense_cols + ['remarks']
-            
-            for index, row in edited_df.iterrows():
-                set_clauses = [f'"{col}" = %s' for col in save_cols]
-                sql = f"""
-                    UPDATE branch_expenses 
-                    SET {", ".join(set_clauses)}
-                    WHERE manifest_no = %s
-                """
-                values = [row[col] for col in save_cols]
-                values.append(row['manifest_no'])
-                
-                cur.execute(sql, values)
-                
-            conn.commit()
-            cur.close()
-            conn.close()
+            dirty = db_utils.changed_rows(df_expenses, edited_df, save_cols)
+            with metrics.stage("branch.save"):
+                expense_store.save("branch_expenses", dirty, expense_cols, ['remarks'])
+            data_cache.invalidate("branch_expenses")
             st.success("Updated Successfully!")
             st.rerun()
             
@@ -212,4 +224,5 @@ def app():
         st.warning("No records found in Cloud DB.")
 
 if __name__ == "__main__":
+    migrations.migrate()
     app()
\ No newline at end of file
@@ -0,0 +1,149 @@
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+import pandas as pd
+
+# --- PROCESS-WIDE RESULT CACHE ---
+# Loaded frames and generated reports are cached per (key, data version). Every write
+# path calls `invalidate(<table>)`, which bumps that table's version and drops the
+# entries built from it, so unchanged data is served from memory and changed data
+# is never served stale. TTL and a memory cap bound how long / how much is kept.
+
+DEFAULT_TTL = 10 * 60          # seconds
+MAX_CACHE_MB = 512
+
+def _size_of(value):
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(deep=True))
+    if isinstance(value, (tuple, list)):
+        return sum(_size_of(v) for v in value)
+    if isinstance(value, dict):
+        return sum(_size_of(v) for v in value.values())
+    return sys.getsizeof(value)
+
+class TTLCache:
+    """
+    LRU cache with a per-entry TTL and a total memory budget. Each entry records the
+    tables it was built from so writes to a table can drop exactly those entries.
+    """
+
+    def __init__(self, max_bytes, ttl):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (value, size, expires_at, tables)
+        self._bytes = 0
+        self._lock = threading.RLock()
+        self._key_locks = {}
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "expired": 0, "invalidated": 0}
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[2] < time.monotonic():
+                self._drop(key)
+                self._stats["expired"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return entry
+
+    def put(self, key, value, tables=(), ttl=None):
+        size = _size_of(value)
+        with self._lock:
+            if key in self._entries: self._drop(key)
+            if size > self.max_bytes:
+                return
+            self._entries[key] = (value, size, time.monotonic() + (ttl or self.ttl), frozenset(tables))
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._drop(oldest)
+                self._stats["evictions"] += 1
+
+    def get_or_compute(self, key, compute, tables=(), ttl=None):
+        entry = self.get(key)
+        if entry is not None:
+            return entry[0]
+        # One computation per key: concurrent reruns for the same period wait instead of duplicating work
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            entry = self.get(key)
+            if entry is not None:
+                return entry[0]
+            with self._lock:
+                self._stats["misses"] += 1
+            value = compute()
+            self.put(key, value, tables, ttl)
+        with self._lock:
+            self._key_locks.pop(key, None)
+        return value
+
+    def drop_tables(self, tables):
+        tables = set(tables)
+        with self._lock:
+            for key in [k for k, e in self._entries.items() if e[3] & tables]:
+                self._drop(key)
+                self._stats["invalidated"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+            stats["size_mb"] = round(self._bytes / 1024 / 1024, 2)
+        return stats
+
+    def _drop(self, key):
+        value, size, _, _ = self._entries.pop(key)
+        self._bytes -= size
+
+_cache = TTLCache(MAX_CACHE_MB * 1024 * 1024, DEFAULT_TTL)
+_versions = {}
+_versions_lock = threading.Lock()
+
+def data_version(*tables):
+    with _versions_lock:
+        return tuple(_versions.get(t, 0) for t in tables)
+
+def invalidate(*tables):
+    """
+    Marks `tables` as changed: later lookups use a new version and cached entries built from them are dropped.
+    """
+    with _versions_lock:
+        for t in tables:
+            _versions[t] = _versions.get(t, 0) + 1
+    _cache.drop_tables(tables)
+
+def get_or_compute(key, compute, tables=(), ttl=None):
+    """
+    Returns the cached value for `key` at the current version of `tables`, computing it on a miss.
+    """
+    full_key = (key, data_version(*tables))
+    return _cache.get_or_compute(full_key, compute, tables, ttl)
+
+def peek(key, tables=()):
+    """
+    The cached value for `key` at the current version of `tables`, or None. Never computes.
+    """
+    entry = _cache.get((key, data_version(*tables)))
+    return entry[0] if entry is not None else None
+
+def put(key, value, tables=(), ttl=None):
+    """
+    Stores `value` for `key` at the current version of `tables` (e.g. a frame patched in place).
+    """
+    _cache.put((key, data_version(*tables)), value, tables, ttl)
+
+def stats():
+    return _cache.stats()
@@ -1,41 +1,451 @@
 import streamlit as st
 import psycopg2
 import pandas as pd
+import threading
+import io
+import os
+import time
+import metrics
+from collections import deque
+from contextlib import contextmanager
+
+try:
+    import duckdb_backend
+    HAS_DUCKDB = True
+except ImportError:
+    HAS_DUCKDB = False
+
+# --- BACKENDS ---
+# "postgres" (default): Supabase, or DATABASE_URL when set. "duckdb": an embedded database
+# file (DUCKDB_PATH) with the same tables, so the app runs offline / in CI and reports scan
+# rows locally; see duckdb_backend.py.
+DB_BACKEND = os.environ.get("DB_BACKEND", "postgres").lower()
+DUCKDB_PATH = os.environ.get("DUCKDB_PATH", "logistics.duckdb")
+
+def is_postgres():
+    return DB_BACKEND != "duckdb"
 
 def get_db_connection():
     """
-    Establishes a connection to the Supabase PostgreSQL database.
+    Establishes a connection to the Supabase PostgreSQL database, or to DATABASE_URL when
+    that is set (scripts such as benchmark.py, run outside Streamlit without secrets), or
+    to the local DuckDB file with DB_BACKEND=duckdb.
+    Prefer `connection()`, which hands out pooled connections.
     """
+    if not is_postgres():
+        if not HAS_DUCKDB:
+            raise RuntimeError("DB_BACKEND=duckdb needs the duckdb package (pip install duckdb)")
+        return duckdb_backend.connect(DUCKDB_PATH)
+    if os.environ.get("DATABASE_URL"):
+        return psycopg2.connect(os.environ["DATABASE_URL"], cursor_factory=TimedCursor)
     return psycopg2.connect(
         host=st.secrets["connections"]["supabase"]["host"],
         port=st.secrets["connections"]["supabase"]["port"],
         database=st.secrets["connections"]["supabase"]["database"],
         user=st.secrets["connections"]["supabase"]["username"],
-        password=st.secrets["connections"]["supabase"]["password"]
+        password=st.secrets["connections"]["supabase"]["password"],
+        cursor_factory=TimedCursor
     )
 
+class TimedCursor(psycopg2.extensions.cursor):
+    """
+    Cursor that reports every statement to metrics (fingerprint, rows, latency). Named
+    cursors are reported by iter_row_batches once drained, since their rows arrive later.
+    """
+
+    def execute(self, query, vars=None):
+        if self.name is not None:
+            return super().execute(query, vars)
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            metrics.record_query(query, time.perf_counter() - started, self.rowcount)
+
+    def copy_expert(self, sql, file, size=8192):
+        started = time.perf_counter()
+        try:
+            return super().copy_expert(sql, file, size)
+        finally:
+            metrics.record_query(sql, time.perf_counter() - started, self.rowcount)
+
+# --- CONNECTION POOL ---
+
+class PoolTimeout(Exception):
+    """Raised when no pooled connection frees up within the checkout timeout."""
+
+class ConnectionPool:
+    """
+    Thread-safe, bounded pool of psycopg2 connections shared by the whole process.
+
+    - Never opens more than `maxconn` connections; extra callers wait up to `timeout` seconds.
+    - Connections idle for longer than `health_check_after` seconds are pinged before reuse.
+    - Connections idle for longer than `max_idle` seconds are closed, down to `minconn`.
+    """
+
+    def __init__(self, connect, minconn=1, maxconn=10, timeout=30, max_idle=300, health_check_after=30):
+        self._connect = connect
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.health_check_after = health_check_after
+
+        self._idle = deque()  # (conn, last_used) pairs, most recently used on the right
+        self._size = 0        # open connections, idle + checked out
+        self._cond = threading.Condition()
+        self._stats = {
+            "checkouts": 0, "waits": 0, "wait_time": 0.0, "max_wait": 0.0,
+            "created": 0, "closed": 0, "reaped": 0, "health_failures": 0, "timeouts": 0,
+        }
+
+    def getconn(self):
+        started = time.monotonic()
+        deadline = started + self.timeout
+        waited = False
+
+        with self._cond:
+            while True:
+                self._reap_idle()
+                if self._idle:
+                    conn, last_used = self._idle.pop()
+                    break
+                if self._size < self.maxconn:
+                    self._size += 1
+                    conn, last_used = None, None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._stats["timeouts"] += 1
+                    raise PoolTimeout(f"No database connection available after {self.timeout}s")
+                waited = True
+                self._cond.wait(remaining)
+
+        unhealthy = conn is not None and not self._is_healthy(conn, last_used)
+        if unhealthy:
+            self._close(conn)
+            conn = None
+
+        created = conn is None
+        if created:
+            try:
+                conn = self._connect()
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                    self._cond.notify()
+                raise
+
+        wait = time.monotonic() - started
+        metrics.record_wait(wait)
+        # Counters are only updated under the lock, or concurrent checkouts lose increments
+        with self._cond:
+            if unhealthy: self._stats["health_failures"] += 1
+            if created: self._stats["created"] += 1
+            self._stats["checkouts"] += 1
+            self._stats["wait_time"] += wait
+            self._stats["max_wait"] = max(self._stats["max_wait"], wait)
+            if waited: self._stats["waits"] += 1
+        return conn
+
+    def putconn(self, conn, discard=False):
+        if not discard and not conn.closed:
+            try:
+                if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except psycopg2.Error:
+                discard = True
+
+        with self._cond:
+            if discard or conn.closed:
+                self._size -= 1
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+        if discard and not conn.closed:
+            self._close(conn)
+
+    @contextmanager
+    def connection(self):
+        """
+        Checks out a connection; commits on success, rolls back on error, then returns it to the pool.
+        """
+        conn = self.getconn()
+        broken = False
+        try:
+            yield conn
+            conn.commit()
+        except Exception as e:
+            broken = isinstance(e, (psycopg2.OperationalError, psycopg2.InterfaceError))
+            if not conn.closed:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    broken = True
+            raise
+        finally:
+            self.putconn(conn, discard=broken)
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._stats)
+            stats["size"] = self._size
+            stats["idle"] = len(self._idle)
+            stats["in_use"] = self._size - len(self._idle)
+        stats["avg_wait_ms"] = (stats["wait_time"] / stats["checkouts"] * 1000) if stats["checkouts"] else 0.0
+        return stats
+
+    def closeall(self):
+        with self._cond:
+            while self._idle:
+                conn, _ = self._idle.pop()
+                self._size -= 1
+                self._close(conn)
+
+    def _is_healthy(self, conn, last_used):
+        if conn.closed:
+            return False
+        if time.monotonic() - last_used < self.health_check_after:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _reap_idle(self):
+        # Called with the lock held. Oldest connections sit on the left.
+        now = time.monotonic()
+        while self._idle and self._size > self.minconn and now - self._idle[0][1] > self.max_idle:
+            conn, _ = self._idle.popleft()
+            self._size -= 1
+            self._stats["reaped"] += 1
+            self._close(conn)
+
+    def _close(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+        # The condition's lock is re-entrant, so callers may already hold it
+        with self._cond:
+            self._stats["closed"] += 1
+
+@st.cache_resource
+def get_pool():
+    """
+    Process-wide pool, created once per Streamlit server. Limits can be tuned under
+    [connections.supabase] in secrets.toml (pool_min, pool_max, pool_timeout, pool_max_idle).
+    """
+    cfg = {} if os.environ.get("DATABASE_URL") or not is_postgres() else st.secrets["connections"]["supabase"]
+    return ConnectionPool(
+        get_db_connection,
+        minconn=int(cfg.get("pool_min", 1)),
+        maxconn=int(cfg.get("pool_max", 10)),
+        timeout=float(cfg.get("pool_timeout", 30)),
+        max_idle=float(cfg.get("pool_max_idle", 300)),
+    )
+
+def connection():
+    """
+    Context manager yielding a pooled connection:
+
+        with db_utils.connection() as conn:
+            df = pd.read_sql(query, conn)
+    """
+    return get_pool().connection()
+
+def pool_stats():
+    """
+    Checkout/wait counters of the shared pool, for sizing pool_max under load.
+    """
+    return get_pool().stats()
+
+# --- SCHEMA (Baseline) ---
+# The base tables as the pages expect them, created by the first migration (see
+# migrations.py). Production already has them; an empty DuckDB file and benchmark.py's
+# scratch schema get them from here. Expense amounts live in lines tables with an
+# expense-type catalog (see expense_store). Plain SQL that both backends accept (a sequence
+# instead of SERIAL).
+
+MASTER_DATA_VIEW = """
+    CREATE OR REPLACE VIEW master_data AS
+        SELECT *, dispatch_from AS origin, dispatch_to AS destination FROM logistics_entries
+"""
+
+EXPENSE_STORE_DDL = """
+    CREATE TABLE IF NOT EXISTS expense_types (
+        entity text NOT NULL,           -- header table: branch_expenses / ho_expenses
+        name text NOT NULL,
+        position integer NOT NULL,      -- column order in the editors and templates
+        PRIMARY KEY (entity, name)
+    );
+    CREATE TABLE IF NOT EXISTS branch_expense_lines (
+        manifest_no text NOT NULL,
+        expense_type text NOT NULL,
+        amount numeric NOT NULL,
+        PRIMARY KEY (manifest_no, expense_type)
+    );
+    CREATE TABLE IF NOT EXISTS ho_expense_lines (
+        entry_date date NOT NULL,
+        expense_type text NOT NULL,
+        amount numeric NOT NULL,
+        PRIMARY KEY (entry_date, expense_type)
+    );
+"""
+
+def baseline_schema_sql():
+    return f"""
+        CREATE SEQUENCE IF NOT EXISTS logistics_entries_id_seq;
+        CREATE TABLE IF NOT EXISTS logistics_entries (
+            id bigint DEFAULT nextval('logistics_entries_id_seq'), manifest_no text, manifest_date date,
+            cn_no text PRIMARY KEY, cn_date date, consignor text, consignee text, payment_liability text,
+            no_of_pkgs integer, pkg_type text, actual_wt text, consignor_invoice_no text,
+            dispatch_from text, dispatch_to text, sales_type text, sales_amount numeric,
+            manual_figures numeric DEFAULT 0, remarks text, created_by text
+        );
+        CREATE TABLE IF NOT EXISTS branch_expenses (
+            manifest_no text PRIMARY KEY, manifest_date date, origin text, destination text, remarks text
+        );
+        CREATE TABLE IF NOT EXISTS ho_expenses (entry_date date PRIMARY KEY, remarks text);
+        CREATE TABLE IF NOT EXISTS branch_mappings (child_branch text PRIMARY KEY, parent_branch text);
+        {EXPENSE_STORE_DDL}
+    """
+
+# --- QUERY HELPERS ---
+
 def run_query(query, params=None):
     """
     Executes a query (INSERT, UPDATE, DELETE) that changes data.
     """
-    conn = get_db_connection()
-    cur = conn.cursor()
-    try:
-        cur.execute(query, params)
-        conn.commit()
-    except Exception as e:
-        conn.rollback()
-        raise e
-    finally:
-        cur.close()
-        conn.close()
+    with connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(query, params)
 
-def fetch_data(query, params=None):
+def fetch_data(query, params=None, chunksize=None):
     """
     Executes a SELECT query and returns a Pandas DataFrame.
+    With `chunksize`, returns an iterator of DataFrames instead (see fetch_chunks).
     """
-    conn = get_db_connection()
-    try:
+    if chunksize:
+        return fetch_chunks(query, params, chunksize)
+    with connection() as conn:
+        if not is_postgres():
+            return conn.read_frame(query, params)
         return pd.read_sql(query, conn, params=params)
-    finally:
-        conn.close()
+
+# --- STREAMING FETCH (Server-side cursors) ---
+# For results too large to hold at once: rows come from a named cursor `itersize` at a
+# time, so client memory is bounded by one batch however long the period is.
+
+ITERSIZE = 5000
+
+def iter_row_batches(query, params=None, itersize=ITERSIZE, conn=None):
+    """
+    Runs a SELECT on a server-side (named) cursor and yields (columns, rows) batches of up to
+    `itersize` rows. Always yields at least one batch (empty when there are no rows), so the
+    columns are known. Uses `conn` if given, else a pooled connection that stays checked out
+    until the generator is exhausted or closed.
+    """
+    if conn is None:
+        with connection() as conn:
+            yield from iter_row_batches(query, params, itersize, conn)
+        return
+    # Database time excludes the consumer's work between batches
+    db_s, total = 0.0, 0
+    with conn.cursor(name=f"stream_{threading.get_ident()}_{time.monotonic_ns()}") as cur:
+        try:
+            cur.itersize = itersize
+            started = time.perf_counter()
+            cur.execute(query, params)
+            first = True
+            while True:
+                rows = cur.fetchmany(itersize)
+                db_s += time.perf_counter() - started
+                total += len(rows)
+                if not rows and not first: break
+                yield [desc[0] for desc in cur.description], rows
+                if not rows: break
+                first = False
+                started = time.perf_counter()
+        finally:
+            metrics.record_query(query, db_s, total)
+
+def fetch_chunks(query, params=None, chunksize=ITERSIZE, conn=None):
+    """
+    Like fetch_data, but yields DataFrames of up to `chunksize` rows from a server-side cursor.
+    The first chunk is an empty frame with the result's columns when there are no rows.
+    """
+    for columns, rows in iter_row_batches(query, params, chunksize, conn):
+        yield pd.DataFrame.from_records(rows, columns=columns, coerce_float=True).infer_objects()
+
+# --- BULK HELPERS ---
+
+COPY_BATCH_ROWS = 50000
+
+def create_staging_table(cur, table, columns, seq=False, source=None):
+    """
+    Creates a temp table with the same column types as `table` (no constraints),
+    dropped automatically when the transaction commits. With `seq=True` a `_seq`
+    column numbers the rows in load order. `source` (a table or FROM-clause item)
+    supplies the column types instead of `table` when given.
+    """
+    name = f"_stage_{table}"
+    col_list = ", ".join(f'"{c}"' for c in columns)
+    cur.execute(f"DROP TABLE IF EXISTS {name}")
+    cur.execute(f"CREATE TEMP TABLE {name} ON COMMIT DROP AS SELECT {col_list} FROM {source or table} LIMIT 0")
+    if seq and not is_postgres():
+        # No SERIAL in DuckDB (nor ON COMMIT DROP: the DROP above clears the last run's table)
+        cur.execute(f"DROP SEQUENCE IF EXISTS {name}_seq")
+        cur.execute(f"CREATE TEMP SEQUENCE {name}_seq")
+        cur.execute(f"ALTER TABLE {name} ADD COLUMN _seq BIGINT DEFAULT nextval('{name}_seq')")
+    elif seq:
+        cur.execute(f"ALTER TABLE {name} ADD COLUMN _seq BIGSERIAL")
+    return name
+
+def copy_dataframe(cur, table, df, columns):
+    """
+    Streams `df[columns]` into `table` with COPY ... FROM STDIN (CSV). Missing
+    values are sent as NULL. Large frames go in batches to bound the CSV buffer.
+    """
+    if not is_postgres():
+        cur.insert_frame(table, df, columns)
+        return
+    col_list = ", ".join(f'"{c}"' for c in columns)
+    sql = f"COPY {table} ({col_list}) FROM STDIN WITH (FORMAT csv)"
+    for i in range(0, len(df), COPY_BATCH_ROWS):
+        buf = io.StringIO()
+        df[columns].iloc[i:i + COPY_BATCH_ROWS].to_csv(buf, index=False, header=False)
+        buf.seek(0)
+        cur.copy_expert(sql, buf)
+
+def changed_rows(original, edited, columns):
+    """
+    Rows of `edited` whose `columns` differ from `original` (matched on the index).
+    Two missing values count as unchanged.
+    """
+    before = original[columns].reindex(edited.index)
+    after = edited[columns]
+    same = (before == after) | (before.isna() & after.isna())
+    return edited[~same.all(axis=1)]
+
+def bulk_update(table, key, df, columns, cur=None):
+    """
+    Writes `columns` of every row in `df` to `table`, matched on `key`, with one
+    staged UPDATE ... FROM in a single transaction (the caller's, when `cur` is given).
+    Returns the number of rows updated.
+    """
+    if df.empty: return 0
+    if cur is None:
+        with connection() as conn:
+            with conn.cursor() as own_cur:
+                return bulk_update(table, key, df, columns, own_cur)
+    stage_cols = [key] + list(columns)
+    set_clause = ", ".join(f'"{c}" = u."{c}"' for c in columns)
+    stage = create_staging_table(cur, table, stage_cols)
+    copy_dataframe(cur, stage, df, stage_cols)
+    cur.execute(f'UPDATE {table} t SET {set_clause} FROM {stage} u WHERE t."{key}" = u."{key}"')
+    return cur.rowcount
@@ -0,0 +1,226 @@
+import re
+import sys
+import threading
+import time
+
+import duckdb
+import metrics
+
+# --- DUCKDB BACKEND ---
+# An embedded, columnar stand-in for PostgreSQL, selected with DB_BACKEND=duckdb (see
+# db_utils). The app's tables live in one local file (DUCKDB_PATH), so it starts and runs
+# fully offline, e.g. in CI, and reports scan months of rows in-process.
+#
+# Connection / Cursor below mimic the slice of psycopg2 that db_utils and the pages use:
+# psycopg2-style placeholders, implicit transactions committed by the pool, rowcount for
+# INSERT/UPDATE/DELETE. The SQL itself is shared; the few Postgres-only features (COPY,
+# BIGSERIAL, triggers, advisory locks, trigram indexes) are handled in db_utils and
+# migrations.py, or skipped.
+#
+#   python duckdb_backend.py pull logistics.duckdb    # copy the Postgres tables into a local file
+
+# psycopg2 transaction status values, returned by get_transaction_status() for the pool
+TRANSACTION_STATUS_IDLE = 0
+TRANSACTION_STATUS_INTRANS = 2
+
+_PLACEHOLDER_RE = re.compile(r"%\((\w+)\)s|%s|%%")
+_DML_RE = re.compile(r"\s*(INSERT|UPDATE|DELETE)\b", re.IGNORECASE)
+
+def translate(sql, params):
+    """
+    psycopg2 placeholders to DuckDB's: %s -> ?, %(name)s -> $name, %% -> %.
+    Without params psycopg2 leaves the text alone, and so does this.
+    """
+    if params is None:
+        return sql, None
+    sql = _PLACEHOLDER_RE.sub(lambda m: "%" if m.group(0) == "%%" else f"${m.group(1)}" if m.group(1) else "?", sql)
+    return sql, params if isinstance(params, dict) else list(params)
+
+class Cursor:
+    """
+    psycopg2-like cursor over the connection's DuckDB handle. Statements are reported to
+    metrics like db_utils.TimedCursor; named cursors are reported by db_utils.iter_row_batches.
+    """
+
+    def __init__(self, conn, name=None):
+        self._conn = conn
+        self._con = conn._con
+        self.name = name
+        self.description = None
+        self.rowcount = -1
+        self.itersize = 2000
+
+    def execute(self, query, vars=None):
+        self._conn._begin()
+        sql, params = translate(query, vars)
+        started = time.perf_counter()
+        try:
+            self._con.execute(sql, params)
+            self.description = self._con.description
+            self.rowcount = -1
+            # INSERT/UPDATE/DELETE without RETURNING answer with a single "Count" row
+            if _DML_RE.match(sql) and self.description and [d[0] for d in self.description] == ["Count"]:
+                self.rowcount = self._con.fetchone()[0]
+                self.description = None
+        finally:
+            if self.name is None:
+                metrics.record_query(query, time.perf_counter() - started, self.rowcount)
+
+    def fetchone(self):
+        return self._con.fetchone()
+
+    def fetchall(self):
+        return self._con.fetchall()
+
+    def fetchmany(self, size=None):
+        return self._con.fetchmany(size or self.itersize)
+
+    def insert_frame(self, table, df, columns):
+        """
+        Stands in for COPY ... FROM STDIN: inserts `df[columns]` straight from the DataFrame.
+        Missing values become NULL.
+        """
+        self._conn._begin()
+        col_list = ", ".join(f'"{c}"' for c in columns)
+        started = time.perf_counter()
+        self._con.register("_insert_frame", df[columns])
+        try:
+            self._con.execute(f"INSERT INTO {table} ({col_list}) SELECT {col_list} FROM _insert_frame")
+            self.rowcount = self._con.fetchone()[0]
+        finally:
+            self._con.unregister("_insert_frame")
+            metrics.record_query(f"COPY {table} ({col_list}) FROM DataFrame", time.perf_counter() - started, self.rowcount)
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class Connection:
+    """
+    psycopg2-like connection: the first statement opens a transaction, commit()/rollback() end it.
+    """
+
+    def __init__(self, con):
+        self._con = con
+        self._in_transaction = False
+        self.autocommit = False
+        self.closed = 0
+
+    def _begin(self):
+        if not self._in_transaction and not self.autocommit:
+            self._con.execute("BEGIN TRANSACTION")
+            self._in_transaction = True
+
+    def cursor(self, name=None, **kwargs):
+        return Cursor(self, name)
+
+    def read_frame(self, query, params=None):
+        """
+        Runs a SELECT and returns a DataFrame, converted column by column from DuckDB's result.
+        """
+        self._begin()
+        sql, params = translate(query, params)
+        started = time.perf_counter()
+        df = self._con.execute(sql, params).df()
+        metrics.record_query(query, time.perf_counter() - started, len(df))
+        return df
+
+    def commit(self):
+        if self._in_transaction:
+            self._in_transaction = False
+            self._con.execute("COMMIT")
+
+    def rollback(self):
+        if self._in_transaction:
+            self._in_transaction = False
+            self._con.execute("ROLLBACK")
+
+    def get_transaction_status(self):
+        return TRANSACTION_STATUS_INTRANS if self._in_transaction else TRANSACTION_STATUS_IDLE
+
+    def close(self):
+        if not self.closed:
+            self._con.close()
+            self.closed = 1
+
+_databases = {}   # path -> DuckDB database handle; connections are cursors on it
+_databases_lock = threading.Lock()
+
+def connect(path):
+    """
+    A new connection to the database file at `path`. The file is opened once per process
+    (DuckDB allows one writer process); migrations.py creates its tables.
+    """
+    with _databases_lock:
+        db = _databases.get(path)
+        if db is None:
+            db = duckdb.connect(path)
+            _databases[path] = db
+    return Connection(db.cursor())
+
+# --- OFFLINE COPY ---
+
+PULL_TABLES = ["logistics_entries", "branch_expenses", "ho_expenses", "branch_mappings",
+               "expense_types", "branch_expense_lines", "ho_expense_lines"]
+
+def pull(path, tables=PULL_TABLES):
+    """
+    Copies `tables` from PostgreSQL (the app's usual connection, or DATABASE_URL) into the
+    DuckDB file at `path`, replacing them, and re-creates master_data on top. Primary keys
+    and serial columns come along, so upserts and inserts work on the copy.
+    """
+    import db_utils
+    import migrations
+    migrations.migrate()   # expense lines exist (and old expense columns are moved) before copying
+    db = duckdb.connect(path)
+    try:
+        db.execute("DROP VIEW IF EXISTS master_data")
+        for table in tables:
+            # Postgres type names mostly parse in DuckDB too; anything exotic is kept as text, and
+            # timestamptz (only updated_at, unused here) as a plain timestamp
+            cols = db_utils.fetch_data("""
+                SELECT column_name, CASE WHEN data_type IN ('ARRAY', 'USER-DEFINED', 'json', 'jsonb') THEN 'text'
+                                         WHEN data_type = 'timestamp with time zone' THEN 'timestamp'
+                                         ELSE data_type END AS data_type,
+                       column_default LIKE 'nextval(%%' AS serial
+                FROM information_schema.columns
+                WHERE table_name = %s AND table_schema = ANY(current_schemas(false))
+                ORDER BY ordinal_position
+            """, (table,))
+            key = db_utils.fetch_data("""
+                SELECT a.attname FROM pg_index i
+                JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = ANY(i.indkey)
+                WHERE i.indrelid = %s::regclass AND i.indisprimary
+            """, (table,))['attname'].tolist()
+
+            db.execute(f"DROP TABLE IF EXISTS {table}")
+            col_defs = []
+            for col, data_type, serial in cols.itertuples(index=False):
+                if serial:
+                    start = db_utils.fetch_data(f'SELECT COALESCE(MAX("{col}"), 0) + 1 AS n FROM {table}')['n'][0]
+                    db.execute(f"DROP SEQUENCE IF EXISTS {table}_{col}_seq")
+                    db.execute(f"CREATE SEQUENCE {table}_{col}_seq START {int(start)}")
+                    data_type += f" DEFAULT nextval('{table}_{col}_seq')"
+                col_defs.append(f'"{col}" {data_type}')
+            if key:
+                col_defs.append("PRIMARY KEY (" + ", ".join(f'"{c}"' for c in key) + ")")
+            db.execute(f"CREATE TABLE {table} ({', '.join(col_defs)})")
+
+            rows = 0
+            for chunk in db_utils.fetch_chunks(f"SELECT * FROM {table}", chunksize=50000):
+                db.execute(f"INSERT INTO {table} SELECT * FROM chunk")
+                rows += len(chunk)
+            print(f"{table}: {rows:,} rows", file=sys.stderr)
+        db.execute(db_utils.MASTER_DATA_VIEW)
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3 or sys.argv[1] != "pull":
+        sys.exit("usage: python duckdb_backend.py pull <file.duckdb>")
+    pull(sys.argv[2])
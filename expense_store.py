@@ -0,0 +1,242 @@
+import sys
+
+import db_utils
+import data_cache
+import report_sql
+import rollups
+import migrations
+
+# --- EXPENSE LINES ---
+# Expenses are stored long: one row per (entry, expense type, amount) in a lines table next
+# to each header table, with the expense types listed in the `expense_types` catalog. A new
+# expense type is one catalog row, so adding one needs no ALTER TABLE and the header tables
+# stay narrow. Only non-zero amounts are stored.
+#
+#   branch_expenses (manifest_no, manifest_date, origin, destination, remarks)
+#     + branch_expense_lines (manifest_no, expense_type, amount)
+#   ho_expenses (entry_date, remarks)
+#     + ho_expense_lines (entry_date, expense_type, amount)
+#
+# Reports aggregate the lines directly (report_sql, rollups). The editors, templates and the
+# Report Center frames keep their one-column-per-type shape through relation(), a pivot
+# over the catalog's current types.
+
+# header table -> its lines table, row key and the header's own (non-expense) columns
+ENTITIES = {
+    "branch_expenses": {
+        "lines": "branch_expense_lines", "key": "manifest_no",
+        "info": ["manifest_no", "manifest_date", "origin", "destination", "remarks"],
+        "rollup": ("rollup_branch_daily", "manifest_date"),
+    },
+    "ho_expenses": {
+        "lines": "ho_expense_lines", "key": "entry_date",
+        "info": ["entry_date", "remarks"],
+        "rollup": ("rollup_ho_daily", "entry_date"),
+    },
+}
+
+# Header columns that are never expense types, whatever they hold
+NON_EXPENSE_COLUMNS = {"id", "created_at", "created_by", "updated_at"}
+# Expense columns of the old layout are kept under this prefix until drop_legacy_columns()
+LEGACY_PREFIX = "legacy_"
+
+# Catalog of a new database (the pages' "Add Expense Type" forms extend it)
+DEFAULT_TYPES = {
+    "branch_expenses": ["rent", "vehicle", "transfer_to_ho"],
+    "ho_expenses": ["salary", "electricity"],
+}
+
+def _fetch_types(table):
+    df = db_utils.fetch_data(
+        "SELECT name FROM expense_types WHERE entity = %s ORDER BY position, name", (table,))
+    return df['name'].tolist()
+
+def expense_types(table):
+    """
+    Expense type names of `table` in column order, cached until a type is added, so page
+    loads don't query the catalog.
+    """
+    return data_cache.get_or_compute(("expense_types", table), lambda: _fetch_types(table), tables=("expense_types",))
+
+def columns(table):
+    """
+    Columns of the wide view of `table`: the header's own columns, then one per expense type.
+    """
+    return ENTITIES[table]["info"] + expense_types(table)
+
+def header_columns(table):
+    """
+    Columns relation() takes from the header row: its own, plus updated_at once change
+    tracking has added it. Anything else on the table (legacy_* columns) is left out.
+    """
+    info = ENTITIES[table]["info"]
+    return info + ["updated_at"] if migrations.applied("change_tracking") else info
+
+def relation(table):
+    """
+    FROM-clause item for `table` in its wide shape: the header row plus one column per
+    expense type (0 where there is no line), aliased as `table`. Filters on header columns
+    are applied before the pivot (the header's date is indexed, see migrations.DATE_INDEXES),
+    which then reads only those entries' lines (by key).
+    Tables without lines are returned as they are.
+    """
+    entity = ENTITIES.get(table)
+    if entity is None: return table
+    types = expense_types(table)
+    header = ", ".join(f"h.{c}" for c in header_columns(table))
+    if not types: return f"(SELECT {header} FROM {table} h) AS {table}"
+    key = entity["key"]
+    amounts = ", ".join(f"SUM(amount) FILTER (WHERE expense_type = {report_sql.lit(t)}) AS {report_sql.ident(t)}"
+                        for t in types)
+    cols = ", ".join(f"COALESCE(x.{report_sql.ident(t)}, 0) AS {report_sql.ident(t)}" for t in types)
+    return f"""(
+        SELECT {header}, {cols}
+        FROM {table} h
+        LEFT JOIN LATERAL (SELECT {amounts} FROM {entity['lines']} l WHERE l.{key} = h.{key}) x ON true
+    ) AS {table}"""
+
+# --- WRITING ---
+
+def add_expense_type(table, name):
+    """
+    Adds `name` to the catalog of `table` as its last column (no-op if it exists).
+    """
+    db_utils.run_query("""
+        INSERT INTO expense_types (entity, name, position)
+        SELECT %(entity)s, %(name)s, COALESCE(MAX(position), 0) + 1 FROM expense_types WHERE entity = %(entity)s
+        ON CONFLICT (entity, name) DO NOTHING
+    """, {"entity": table, "name": name})
+    data_cache.invalidate("expense_types", table)
+
+def replace_lines(cur, table, source, types):
+    """
+    Sets the `types` lines of every entry in `source` (a table or subquery with the key and
+    one numeric column per type, one row per entry) to its values; zeros and NULLs delete them.
+    Entries missing from the header table are skipped.
+    """
+    if not types: return
+    entity = ENTITIES[table]
+    key, lines = entity["key"], entity["lines"]
+    cur.execute(f"DELETE FROM {lines} WHERE {key} IN (SELECT {key} FROM {source}) AND expense_type = ANY(%s)",
+                (list(types),))
+    unpivot = " UNION ALL ".join(
+        f"SELECT {key}, {report_sql.lit(t)} AS expense_type, {report_sql.ident(t)} AS amount FROM {source}" for t in types)
+    cur.execute(f"""
+        INSERT INTO {lines} ({key}, expense_type, amount)
+        SELECT {key}, expense_type, amount FROM ({unpivot}) u
+        WHERE amount <> 0 AND {key} IN (SELECT {key} FROM {table})
+    """)
+
+def save(table, df, types, info_cols):
+    """
+    Writes edited wide rows back: `info_cols` to the header (which also marks the rows as
+    changed for Report Center's refresh) and `types` to the lines, and re-rolls their days,
+    in one transaction. Returns the number of entries written.
+    """
+    if df.empty: return 0
+    key = ENTITIES[table]["key"]
+    rollup, date_col = ENTITIES[table]["rollup"]
+    cols = [key] + list(types)
+    with db_utils.connection() as conn:
+        with conn.cursor() as cur:
+            db_utils.bulk_update(table, key, df, info_cols, cur=cur)
+            stage = db_utils.create_staging_table(cur, f"{table}_wide", cols, source=relation(table))
+            db_utils.copy_dataframe(cur, stage, df, cols)
+            replace_lines(cur, table, stage, types)
+            rollups.refresh_days(rollup, df[date_col], cur)
+    return len(df)
+
+# --- SCHEMA ---
+# Run once per database by migrations.py.
+
+def seed_types(cur, table, names):
+    """
+    Adds `names` to the catalog of `table` in that order, unless it already has types.
+    """
+    values = ", ".join(f"({report_sql.lit(table)}, {report_sql.lit(n)}, {i})" for i, n in enumerate(names, 1))
+    cur.execute(f"""
+        INSERT INTO expense_types (entity, name, position)
+        SELECT * FROM (VALUES {values}) AS v (entity, name, position)
+        WHERE NOT EXISTS (SELECT 1 FROM expense_types WHERE entity = {report_sql.lit(table)})
+    """)
+
+def _is_numeric(cur, table, col):
+    text = f"TRIM(({report_sql.ident(col)})::text)"
+    cur.execute(f"SELECT COUNT(*) FROM {table} WHERE {text} <> '' AND NOT ({text} ~ '{report_sql.NUMERIC_RE}')")
+    return cur.fetchone()[0] == 0
+
+def migrate_legacy_columns(cur):
+    """
+    Copies the expense columns still on the header tables (the old one-column-per-type
+    layout) into lines and the catalog, and renames them to legacy_<name>, so nothing is
+    lost until drop_legacy_columns() is run by hand. Only columns whose every non-blank
+    value is a number (and not NON_EXPENSE_COLUMNS) are taken; others are left untouched.
+    """
+    for table, entity in ENTITIES.items():
+        cur.execute(f"SELECT * FROM {table} LIMIT 0")
+        candidates = [d[0] for d in cur.description
+                      if d[0] not in entity["info"] and d[0] not in NON_EXPENSE_COLUMNS and not d[0].startswith(LEGACY_PREFIX)]
+        legacy = [c for c in candidates if _is_numeric(cur, table, c)]
+        if legacy: _migrate(cur, table, legacy)
+
+def _migrate(cur, table, legacy_cols):
+    key = ENTITIES[table]["key"]
+    for col in legacy_cols:
+        cur.execute("""
+            INSERT INTO expense_types (entity, name, position)
+            SELECT %(entity)s, %(name)s, COALESCE(MAX(position), 0) + 1 FROM expense_types WHERE entity = %(entity)s
+            ON CONFLICT (entity, name) DO NOTHING
+        """, {"entity": table, "name": col})
+    # Old columns may hold numbers as text; blanks count as 0, like the reports always did
+    source = f"(SELECT {key}, " + ", ".join(
+        f"{report_sql.num(report_sql.ident(c))} AS {report_sql.ident(c)}" for c in legacy_cols) + f" FROM {table}) AS legacy"
+    replace_lines(cur, table, source, legacy_cols)
+    for col in legacy_cols:
+        cur.execute(f"ALTER TABLE {table} RENAME COLUMN {report_sql.ident(col)} TO {report_sql.ident(LEGACY_PREFIX + col)}")
+
+def legacy_mismatches(cur, table, col):
+    """
+    Entries of `table` whose legacy_<col> value differs from their `col` line (0 if none).
+    """
+    entity = ENTITIES[table]
+    key = entity["key"]
+    cur.execute(f"""
+        SELECT COUNT(*) FROM {table} h
+        LEFT JOIN {entity['lines']} l ON l.{key} = h.{key} AND l.expense_type = %s
+        WHERE {report_sql.num('h.' + report_sql.ident(LEGACY_PREFIX + col))} <> COALESCE(l.amount, 0)
+    """, (col,))
+    return cur.fetchone()[0]
+
+def drop_legacy_columns(force=False):
+    """
+    Drops the legacy_* columns left by the expense_lines migration, in one transaction,
+    once every one of them still matches its lines entry by entry. Lines edited since the
+    migration make that check fail; pass `force` to drop anyway. Returns the dropped
+    columns as (table, column) pairs. Never run automatically:
+
+        python expense_store.py drop-legacy [--force]
+    """
+    dropped, mismatched = [], []
+    with db_utils.connection() as conn:
+        with conn.cursor() as cur:
+            for table in ENTITIES:
+                cur.execute(f"SELECT * FROM {table} LIMIT 0")
+                for col in [d[0] for d in cur.description if d[0].startswith(LEGACY_PREFIX)]:
+                    n = legacy_mismatches(cur, table, col[len(LEGACY_PREFIX):])
+                    if n: mismatched.append(f"{table}.{col}: {n} entries differ")
+                    dropped.append((table, col))
+            if mismatched and not force:
+                raise ValueError("Legacy columns don't match their lines:\n" + "\n".join(mismatched))
+            for table, col in dropped:
+                cur.execute(f"ALTER TABLE {table} DROP COLUMN {report_sql.ident(col)}")
+    return dropped
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] != "drop-legacy" or sys.argv[2:] not in ([], ["--force"]):
+        sys.exit("usage: python expense_store.py drop-legacy [--force]")
+    migrations.migrate()
+    try:
+        for table, col in drop_legacy_columns(force=sys.argv[2:] == ["--force"]):
+            print(f"dropped {table}.{col}")
+    except ValueError as e:
+        sys.exit(f"{e}\nNothing was dropped. Check the lines, or re-run with --force.")
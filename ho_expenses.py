@@ -1,13 +1,16 @@
 import streamlit as st
 import pandas as pd
 import db_utils
+import data_cache
+import rollups
+import expense_store
+import migrations
+import metrics
 from datetime import datetime, date
 import io
 
 # --- MAIN APP LOGIC ---
 def app():
-    db_utils.init_all_tables()
-
     st.title("🏢 Head Office (HO) Expense Register (Cloud ☁️)")
 
     # --- SIDEBAR: TOOLS ---
@@ -18,12 +21,11 @@ def app():
         if st.button("📝 Create/Edit Entry"):
             date_str = selected_date.strftime('%Y-%m-%d')
             # Create row if missing (Postgres)
-            conn = db_utils.get_db_connection()
-            cur = conn.cursor()
-            cur.execute("INSERT INTO ho_expenses (entry_date) VALUES (%s) ON CONFLICT DO NOTHING", (date_str,))
-            conn.commit()
-            cur.close()
-            conn.close()
+            with metrics.stage("ho.create_entry"), db_utils.connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute("INSERT INTO ho_expenses (entry_date) VALUES (%s) ON CONFLICT DO NOTHING", (date_str,))
+                    rollups.refresh_ho_days([selected_date], cur)
+            data_cache.invalidate("ho_expenses")
             st.success(f"Entry for {date_str} is ready.")
 
         st.divider()
@@ -32,26 +34,22 @@ def app():
         if st.button("➕ Add Column"):
             if new_col:
                 clean_name = new_col.strip().replace(" ", "_").lower()
-                db_utils.add_column_if_not_exists("ho_expenses", clean_name)
+                expense_store.add_expense_type("ho_expenses", clean_name)
                 st.success(f"Added '{clean_name}'")
                 st.rerun()
 
     # --- MAIN SCREEN ---
     st.header("Daily Expense Log")
 
-    conn = db_utils.get_db_connection()
-    if not conn: st.stop()
-
     col1, col2 = st.columns(2)
     start_date = col1.date_input("From Date", date(2025, 1, 1), key="ho_start")
     end_date = col2.date_input("To Date", date.today(), key="ho_end")
 
-    query = f"SELECT * FROM ho_expenses WHERE entry_date >= '{start_date}' AND entry_date <= '{end_date}'"
-    df_expenses = pd.read_sql(query, conn)
-    conn.close()
+    query = f"SELECT * FROM {expense_store.relation('ho_expenses')} WHERE entry_date >= '{start_date}' AND entry_date <= '{end_date}'"
+    df_expenses = db_utils.fetch_data(query)
 
     if not df_expenses.empty:
-        non_expense_cols = ['entry_date', 'remarks']
+        non_expense_cols = ['entry_date', 'remarks', 'updated_at']
         expense_cols = [c for c in df_expenses.columns if c not in non_expense_cols]
         
         df_expenses[expense_cols] = df_expenses[expense_cols].fillna(0)
@@ -72,27 +70,11 @@ def app():
         )
         
         if st.button("💾 Save Changes"):
-            conn = db_utils.get_db_connection()
-            cur = conn.cursor()
-            
             save_cols = expense_cols + ['remarks']
-            
-            for index, row in edited_df.iterrows():
-                d_str = row['entry_date'].strftime('%Y-%m-%d')
-                set_clauses = [f'"{col}" = %s' for col in save_cols]
-                sql = f"""
-                    UPDATE ho_expenses 
-                    SET {", ".join(set_clauses)}
-                    WHERE entry_date = %s
-                """
-                values = [row[col] for col in save_cols]
-                values.append(d_str)
-                
-                cur.execute(sql, values)
-                
-            conn.commit()
-            cur.close()
-            conn.close()
+            dirty = db_utils.changed_rows(df_expenses, edited_df, save_cols)
+            with metrics.stage("ho.save"):
+                expense_store.save("ho_expenses", dirty, expense_cols, ['remarks'])
+            data_cache.invalidate("ho_expenses")
             st.success("Updated Successfully!")
             st.rerun()
             
@@ -107,4 +89,5 @@ def app():
         st.warning("No entries found. Create one from the sidebar.")
 
 if __name__ == "__main__":
+    migrations.migrate()
     app()
\ No newline at end of file
@@ -0,0 +1,153 @@
+import os
+import queue
+import threading
+import time
+
+import streamlit as st
+import pandas as pd
+
+# --- STREAMING CSV INGESTION ---
+# Uploads are parsed in fixed-size chunks by a background thread, one chunk ahead of
+# the writer. So parsing the next chunk overlaps writing (COPY) the current one, and
+# at most a couple of chunks are held in memory at a time, whatever the file size.
+#
+#   chunks = ingest.stream(uploaded_file, prepare, "Importing", text_columns=["CN No", "Remarks"])
+#   result = import_something(chunks)     # loops the chunks, COPYing each one
+#   st.caption(chunks.summary())
+
+CHUNK_ROWS = 20000
+PREFETCH = 1   # chunks parsed ahead of the writer
+
+def read_chunks(file, prepare=None, chunksize=CHUNK_ROWS, text_columns=(), **read_csv_kwargs):
+    """
+    Yields the CSV in DataFrames of `chunksize` rows, each passed through `prepare`.
+    Each chunk carries attrs 'rows_read' (raw rows before prepare) and 'bytes_read'
+    (file position after the chunk) for progress reporting.
+    `text_columns` (headers; those missing from the file are ignored) are read as str:
+    dtypes are inferred per chunk, so a CN No column could be int in one chunk and str in the next.
+    """
+    read_csv_kwargs['dtype'] = {**{c: str for c in text_columns}, **read_csv_kwargs.get('dtype', {})}
+    with pd.read_csv(file, chunksize=chunksize, **read_csv_kwargs) as reader:
+        for raw in reader:
+            chunk = prepare(raw) if prepare else raw
+            chunk.attrs['rows_read'] = len(raw)
+            chunk.attrs['bytes_read'] = file.tell() if hasattr(file, 'tell') else None
+            yield chunk
+
+def prefetch(chunks, depth=PREFETCH):
+    """
+    Runs the `chunks` generator in a background thread, at most `depth` chunks ahead.
+    Exceptions raised while parsing are re-raised in the consumer.
+    """
+    buf = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+    done = object()
+
+    def produce():
+        try:
+            for chunk in chunks:
+                while not stop.is_set():
+                    try:
+                        buf.put(chunk, timeout=0.1)
+                        break
+                    except queue.Full:
+                        pass
+                if stop.is_set(): return
+            item = done
+        except Exception as e:
+            item = e
+        finally:
+            # Also on stop: closes the CSV reader now rather than whenever the generator is collected
+            if hasattr(chunks, 'close'): chunks.close()
+        while not stop.is_set():
+            try:
+                buf.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    worker = threading.Thread(target=produce, daemon=True)
+    worker.start()
+    try:
+        while True:
+            item = buf.get()
+            if item is done: return
+            if isinstance(item, Exception): raise item
+            yield item
+    finally:
+        # Consumer finished or failed: let the producer exit instead of blocking on a full queue
+        stop.set()
+        worker.join()
+
+class Progress:
+    """
+    Chunk iterator wrapper that shows a progress bar with rows/sec while the chunks are consumed,
+    or passes (fraction, text) to `report` instead (e.g. a background job's ctx.progress).
+    Totals are available afterwards as `rows_read`, `rows`, `chunks`, `seconds`.
+    """
+
+    def __init__(self, chunks, total_bytes=None, label="Processing", report=None):
+        self._chunks = chunks
+        self.total_bytes = total_bytes
+        self.label = label
+        self._report = report
+        self.rows_read = 0
+        self.rows = 0
+        self.chunks = 0
+        self.seconds = 0.0
+        self._bar = None
+
+    def __iter__(self):
+        started = time.perf_counter()
+        if self._report is None:
+            self._bar = st.progress(0.0, text=f"{self.label}...")
+        try:
+            for chunk in self._chunks:
+                yield chunk
+                # Counted once the consumer has written the chunk
+                self.chunks += 1
+                self.rows += len(chunk)
+                self.rows_read += chunk.attrs.get('rows_read', len(chunk))
+                self.seconds = time.perf_counter() - started
+                self._show(self._fraction(chunk), f"{self.label}: {self.rows_read:,} rows ({self.rows_per_s:,.0f} rows/s)")
+        finally:
+            # Also reached when the writer fails mid-file: stops the background parser
+            if hasattr(self._chunks, 'close'): self._chunks.close()
+            self.seconds = time.perf_counter() - started
+            if self._bar is not None: self._bar.empty()
+
+    def _show(self, fraction, text):
+        if self._report is not None:
+            self._report(fraction, text)
+        else:
+            self._bar.progress(fraction, text=text)
+
+    @property
+    def rows_per_s(self):
+        return self.rows_read / self.seconds if self.seconds else 0.0
+
+    def _fraction(self, chunk):
+        read = chunk.attrs.get('bytes_read')
+        if not read or not self.total_bytes: return 0.0
+        return min(read / self.total_bytes, 1.0)
+
+    def summary(self):
+        return f"{self.rows_read:,} rows in {self.seconds:.1f}s ({self.rows_per_s:,.0f} rows/s, {self.chunks} chunks)"
+
+def stream(file, prepare=None, label="Processing", report=None, chunksize=CHUNK_ROWS, text_columns=(), **read_csv_kwargs):
+    """
+    The whole pipeline for an uploaded (or opened) file: chunked parse + prepare in the
+    background, with progress shown in the page or sent to `report`. Iterate the returned
+    Progress to get the chunks.
+    """
+    total_bytes = getattr(file, 'size', None)
+    if total_bytes is None and hasattr(file, 'fileno'):
+        total_bytes = os.fstat(file.fileno()).st_size
+    chunks = prefetch(read_chunks(file, prepare, chunksize, text_columns, **read_csv_kwargs))
+    return Progress(chunks, total_bytes, label, report)
+
+def as_chunks(data):
+    """
+    Lets write functions accept either one DataFrame or an iterable of chunks.
+    """
+    return [data] if isinstance(data, pd.DataFrame) else data
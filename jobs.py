@@ -0,0 +1,243 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import streamlit as st
+import metrics
+
+# --- BACKGROUND JOBS ---
+# Long imports and exports run on a small worker pool instead of the script thread, so
+# the page stays usable and a browser refresh doesn't abort them. Job state lives in a
+# SQLite file next to the uploads/results it refers to (both are local to this server);
+# pages poll it with jobs_panel().
+#
+#   job_id = jobs.new_job_id()
+#   jobs.submit("import", "Manifest ABC.csv", run_import, jobs.save_upload(file, job_id),
+#               owner=username, job_id=job_id)
+#
+# `fn(ctx, *args)` reports with ctx.progress(...), which also raises Cancelled once the
+# user cancels, and returns the message shown when the job finishes.
+
+JOB_DIR = os.environ.get("JOB_DIR", os.path.join(tempfile.gettempdir(), "logistics_jobs"))
+MAX_WORKERS = int(os.environ.get("JOB_WORKERS", 2))
+KEEP_DAYS = 7        # finished jobs and their files are removed after this
+POLL_SECONDS = 2
+
+ACTIVE = ("queued", "running")
+
+class Cancelled(Exception):
+    """Raised inside a job when the user has cancelled it."""
+
+_db_lock = threading.Lock()
+
+def _db():
+    os.makedirs(JOB_DIR, exist_ok=True)
+    conn = sqlite3.connect(os.path.join(JOB_DIR, "jobs.db"), timeout=30)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+def _execute(sql, params=()):
+    with _db_lock:
+        conn = _db()
+        try:
+            with conn:
+                return conn.execute(sql, params).fetchall()
+        finally:
+            conn.close()
+
+@st.cache_resource
+def _executor():
+    """
+    Worker pool, created once per process. Jobs left queued/running by a previous process
+    can't resume, so they are marked failed here.
+    """
+    _execute("""
+        CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY, kind TEXT, label TEXT, owner TEXT,
+            status TEXT, progress REAL DEFAULT 0, message TEXT, result_path TEXT, result_name TEXT,
+            cancel_requested INTEGER DEFAULT 0,
+            created_at REAL, started_at REAL, finished_at REAL
+        )
+    """)
+    _execute("UPDATE jobs SET status = 'failed', message = 'Interrupted by a server restart', finished_at = ? "
+             "WHERE status IN ('queued', 'running')", (time.time(),))
+    _purge()
+    return ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="job")
+
+def _purge():
+    cutoff = time.time() - KEEP_DAYS * 86400
+    for row in _execute("SELECT id FROM jobs WHERE finished_at < ?", (cutoff,)):
+        shutil.rmtree(job_dir(row['id']), ignore_errors=True)
+    _execute("DELETE FROM jobs WHERE finished_at < ?", (cutoff,))
+    # Directories no job refers to: uploads whose job was never queued, older versions' uploads/
+    known = {row['id'] for row in _execute("SELECT id FROM jobs")}
+    for entry in os.scandir(JOB_DIR):
+        if entry.is_dir() and entry.name not in known and entry.stat().st_mtime < cutoff:
+            shutil.rmtree(entry.path, ignore_errors=True)
+
+def job_dir(job_id):
+    return os.path.join(JOB_DIR, job_id)
+
+class JobContext:
+    """
+    Handed to the job function: progress reporting, cancellation and a place for its files.
+    """
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.dir = job_dir(job_id)
+
+    def progress(self, fraction=None, message=None):
+        sets, params = [], []
+        if fraction is not None:
+            sets.append("progress = ?")
+            params.append(min(max(float(fraction), 0.0), 1.0))
+        if message is not None:
+            sets.append("message = ?")
+            params.append(message)
+        if sets:
+            _execute(f"UPDATE jobs SET {', '.join(sets)} WHERE id = ?", params + [self.job_id])
+        self.check()
+
+    def check(self):
+        if self.cancelled():
+            raise Cancelled()
+
+    def cancelled(self):
+        rows = _execute("SELECT cancel_requested FROM jobs WHERE id = ?", (self.job_id,))
+        return bool(rows and rows[0]['cancel_requested'])
+
+    def set_result(self, path, name=None):
+        _execute("UPDATE jobs SET result_path = ?, result_name = ? WHERE id = ?",
+                 (path, name or os.path.basename(path), self.job_id))
+
+def _run(job_id, kind, fn, args, kwargs):
+    metrics.start_run(f"job {kind} {job_id}")
+    ctx = JobContext(job_id)
+    if ctx.cancelled():
+        _execute("UPDATE jobs SET status = 'cancelled', finished_at = ? WHERE id = ?", (time.time(), job_id))
+        return
+    _execute("UPDATE jobs SET status = 'running', started_at = ? WHERE id = ?", (time.time(), job_id))
+    try:
+        with metrics.stage(f"job.{kind}"):
+            message = fn(ctx, *args, **kwargs)
+        status = "done"
+    except Cancelled:
+        status, message = "cancelled", "Cancelled, no changes were saved."
+    except Exception as e:
+        status, message = "failed", f"{type(e).__name__}: {e}"
+    _execute("UPDATE jobs SET status = ?, message = COALESCE(?, message), progress = CASE WHEN ? = 'done' THEN 1 ELSE progress END, "
+             "finished_at = ? WHERE id = ?", (status, message, status, time.time(), job_id))
+
+def new_job_id():
+    return uuid.uuid4().hex[:12]
+
+def submit(kind, label, fn, *args, owner=None, job_id=None, **kwargs):
+    """
+    Queues `fn(ctx, *args, **kwargs)` on the worker pool and returns the job id. Pass
+    `job_id` (from new_job_id) when files were already saved for the job, see save_upload.
+    """
+    executor = _executor()
+    job_id = job_id or new_job_id()
+    os.makedirs(job_dir(job_id), exist_ok=True)
+    _execute("INSERT INTO jobs (id, kind, label, owner, status, created_at) VALUES (?, ?, ?, ?, 'queued', ?)",
+             (job_id, kind, label, owner, time.time()))
+    executor.submit(_run, job_id, kind, fn, args, kwargs)
+    return job_id
+
+def save_upload(file, job_id, name=None):
+    """
+    Copies an uploaded file into the directory of job `job_id` so the job can read it after
+    the page reruns, and it is removed with the job's other files. Returns the path.
+    """
+    path = os.path.join(job_dir(job_id), "upload_" + os.path.basename(name or getattr(file, 'name', 'upload.csv')))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    file.seek(0)
+    with open(path, "wb") as out:
+        shutil.copyfileobj(file, out)
+    return path
+
+def cancel(job_id):
+    _execute("UPDATE jobs SET cancel_requested = 1 WHERE id = ? AND status IN ('queued', 'running')", (job_id,))
+
+def get(job_id):
+    _executor()
+    rows = _execute("SELECT * FROM jobs WHERE id = ?", (job_id,))
+    return dict(rows[0]) if rows else None
+
+def list_jobs(owner=None, kinds=None, limit=10):
+    _executor()
+    sql, params = "SELECT * FROM jobs WHERE 1=1", []
+    if owner is not None:
+        sql += " AND owner = ?"
+        params.append(owner)
+    if kinds:
+        sql += f" AND kind IN ({', '.join('?' * len(kinds))})"
+        params.extend(kinds)
+    sql += " ORDER BY created_at DESC LIMIT ?"
+    params.append(limit)
+    return [dict(r) for r in _execute(sql, params)]
+
+def eta_seconds(job):
+    """
+    Remaining time extrapolated from progress so far, or None before there is any.
+    """
+    if job['status'] != 'running' or not job['started_at'] or not job['progress']:
+        return None
+    elapsed = time.time() - job['started_at']
+    return elapsed * (1 - job['progress']) / job['progress']
+
+def file_bytes(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+def result_bytes(job):
+    return file_bytes(job['result_path'])
+
+# --- UI ---
+
+def jobs_panel(owner, kinds=None, title="⏳ Background Jobs"):
+    """
+    Shows the user's recent jobs with progress/ETA, Cancel and Download buttons, polling
+    only while one is queued or running. The whole page reruns once when one of them
+    finishes, so it shows the new data (and the panel stops polling after the last one).
+    """
+    polling = any(j['status'] in ACTIVE for j in list_jobs(owner, kinds))
+
+    @st.fragment(run_every=POLL_SECONDS if polling else None)
+    def panel():
+        job_list = list_jobs(owner, kinds)
+        active = {j['id'] for j in job_list if j['status'] in ACTIVE}
+        key = f"_jobs_active_{title}"
+        finished = st.session_state.get(key, set()) - active
+        st.session_state[key] = active
+        if finished:
+            st.rerun(scope="app")
+        if not job_list: return
+
+        st.subheader(title)
+        for job in job_list:
+            with st.container(border=True):
+                st.caption(f"{job['label']} · {job['status']}")
+                if job['status'] in ACTIVE:
+                    eta = eta_seconds(job)
+                    text = (job['message'] or "Waiting for a worker...") + (f" · ~{eta:.0f}s left" if eta is not None else "")
+                    st.progress(job['progress'] or 0.0, text=text)
+                    if st.button("✖ Cancel", key=f"cancel_{job['id']}", disabled=bool(job['cancel_requested'])):
+                        cancel(job['id'])
+                elif job['status'] == 'done':
+                    st.success(job['message'] or "Done.")
+                    if job['result_path'] and os.path.exists(job['result_path']):
+                        # Read on click only, not on every rerun
+                        st.download_button("📥 Download", partial(result_bytes, job), job['result_name'], key=f"dl_{job['id']}")
+                elif job['status'] == 'cancelled':
+                    st.info(job['message'])
+                else:
+                    st.error(job['message'])
+    panel()
@@ -1,8 +1,265 @@
 import streamlit as st
 import pandas as pd
 import db_utils
+import reconciliation
+import data_cache
+import rollups
+import ingest
+import jobs
+import metrics
+import migrations
+import os
 from datetime import datetime, timedelta
 
+# --- MANIFEST IMPORT (Bulk COPY) ---
+
+MANIFEST_COLUMN_MAP = {
+    "Manifest No": "manifest_no", "Manifest Date": "manifest_date",
+    "CN No": "cn_no", "CN Date": "cn_date",
+    "Consignor": "consignor", "Consignee": "consignee",
+    "Payment Liability": "payment_liability", "No. of PKGS": "no_of_pkgs",
+    "Type": "pkg_type", "Actual WT": "actual_wt",
+    "Consignor Invoice No": "consignor_invoice_no",
+    "From": "dispatch_from", "To": "dispatch_to",
+    "Sales Type": "sales_type", "Sales Amount (₹)": "sales_amount"
+}
+
+MANIFEST_DB_COLS = [
+    "manifest_no", "manifest_date", "cn_no", "cn_date", "consignor", "consignee", "payment_liability",
+    "no_of_pkgs", "pkg_type", "actual_wt", "consignor_invoice_no", "dispatch_from", "dispatch_to",
+    "sales_type", "sales_amount", "created_by"
+]
+# Blank cells in these are stored as '' (as the row-by-row import did), not NULL
+MANIFEST_TEXT_COLS = [c for c in MANIFEST_DB_COLS if c not in ("manifest_date", "cn_date", "no_of_pkgs", "sales_amount")]
+MANIFEST_TEXT_HEADERS = [h for h, c in MANIFEST_COLUMN_MAP.items() if c in MANIFEST_TEXT_COLS]
+
+def prepare_manifest(df, username):
+    """
+    Renames CSV headers to DB columns, parses dates and makes package counts whole numbers
+    (a blank cell would otherwise turn the column into floats like 3.0, which COPY rejects
+    for an integer column). Columns missing from the file are loaded as NULL.
+    """
+    df = df.rename(columns=MANIFEST_COLUMN_MAP)
+    for col in ['manifest_date', 'cn_date']:
+        if col in df.columns:
+            df[col] = pd.to_datetime(df[col], dayfirst=True).dt.date
+    if 'no_of_pkgs' in df.columns:
+        df['no_of_pkgs'] = pd.to_numeric(df['no_of_pkgs'], errors='coerce').astype('Int64')
+    df['created_by'] = username
+    return df.reindex(columns=MANIFEST_DB_COLS)
+
+@metrics.stage("entry.import_manifest")
+def import_manifest(chunks):
+    """
+    COPYs the prepared manifest (a DataFrame or an iterable of chunks) into a staging table,
+    then merges it into logistics_entries with ON CONFLICT DO NOTHING, all in one transaction.
+    Returns (inserted, skipped).
+    """
+    total = 0
+    with db_utils.connection() as conn:
+        with conn.cursor() as cur:
+            stage = db_utils.create_staging_table(cur, "logistics_entries", MANIFEST_DB_COLS, seq=True)
+            for chunk in ingest.as_chunks(chunks):
+                db_utils.copy_dataframe(cur, stage, chunk, MANIFEST_DB_COLS)
+                total += len(chunk)
+            if not total: return 0, 0
+
+            col_list = ", ".join(MANIFEST_DB_COLS)
+            # COPY reads blank CSV cells as NULL
+            values = ", ".join(f"COALESCE({c}, '')" if c in MANIFEST_TEXT_COLS else c for c in MANIFEST_DB_COLS)
+            # ORDER BY _seq keeps "first row wins" for CNs repeated inside the file
+            cur.execute(f"""
+                INSERT INTO logistics_entries ({col_list})
+                SELECT {values} FROM {stage} ORDER BY _seq
+                ON CONFLICT DO NOTHING
+            """)
+            inserted = cur.rowcount
+
+            cur.execute(f"SELECT DISTINCT manifest_date FROM {stage}")
+            rollups.refresh_sales_days([r[0] for r in cur.fetchall()], cur)
+    return inserted, total - inserted
+
+# --- BULK UPDATE (Set-based) ---
+
+UPDATE_COLUMN_MAP = {
+    "CN No": "cn_no", "Manual Recvd": "manual_figures",
+    "Sales Amount": "sales_amount", "Remarks": "remarks"
+}
+
+UPDATE_DB_COLS = ["cn_no", "manual_figures", "sales_amount", "remarks"]
+UPDATE_TEXT_HEADERS = ["CN No", "Remarks"]
+
+def prepare_bulk_update(df_u):
+    """
+    Maps the update CSV to DB columns. Empty cells stay NULL so they leave the stored value untouched;
+    rows with nothing to update are dropped.
+    """
+    df = df_u.rename(columns=UPDATE_COLUMN_MAP).reindex(columns=UPDATE_DB_COLS)
+    df['cn_no'] = df['cn_no'].astype(str).str.strip()
+    df['manual_figures'] = pd.to_numeric(df['manual_figures'])
+    df['sales_amount'] = pd.to_numeric(df['sales_amount'])
+    df['remarks'] = df['remarks'].where(df['remarks'].isna(), df['remarks'].astype(str))
+    return df.dropna(subset=['manual_figures', 'sales_amount', 'remarks'], how='all')
+
+@metrics.stage("entry.bulk_update")
+def apply_bulk_update(chunks):
+    """
+    Stages the prepared updates (a DataFrame or an iterable of chunks) and applies them with one
+    UPDATE ... FROM in a single transaction. A CN listed several times gets, per field, its last
+    non-empty value (same as applying rows in order). Returns (matched, unmatched) distinct CN counts.
+    """
+    def last_value(col):
+        return f"(array_agg({col} ORDER BY _seq DESC) FILTER (WHERE {col} IS NOT NULL))[1] AS {col}"
+
+    with db_utils.connection() as conn:
+        with conn.cursor() as cur:
+            stage = db_utils.create_staging_table(cur, "logistics_entries", UPDATE_DB_COLS, seq=True)
+            total = 0
+            for chunk in ingest.as_chunks(chunks):
+                db_utils.copy_dataframe(cur, stage, chunk, UPDATE_DB_COLS)
+                total += len(chunk)
+            if not total: return 0, 0
+
+            cur.execute(f"""
+                UPDATE logistics_entries t
+                SET manual_figures = COALESCE(u.manual_figures, t.manual_figures),
+                    sales_amount = COALESCE(u.sales_amount, t.sales_amount),
+                    remarks = COALESCE(u.remarks, t.remarks)
+                FROM (
+                    SELECT cn_no, {last_value('manual_figures')}, {last_value('sales_amount')}, {last_value('remarks')}
+                    FROM {stage}
+                    GROUP BY cn_no
+                ) u
+                WHERE t.cn_no = u.cn_no
+                RETURNING t.manifest_date
+            """)
+            rollups.refresh_sales_days([r[0] for r in cur.fetchall()], cur)
+
+            cur.execute(f"""
+                SELECT COUNT(DISTINCT s.cn_no),
+                       COUNT(DISTINCT s.cn_no) FILTER (
+                           WHERE NOT EXISTS (SELECT 1 FROM logistics_entries t WHERE t.cn_no = s.cn_no)
+                       )
+                FROM {stage} s
+            """)
+            total, unmatched = cur.fetchone()
+    return total - unmatched, unmatched
+
+# --- BACKGROUND JOBS ---
+
+def run_manifest_import(ctx, path, username):
+    """
+    Job: streams the saved upload at `path` into logistics_entries.
+    """
+    try:
+        with open(path, "rb") as f:
+            chunks = ingest.stream(f, lambda df: prepare_manifest(df, username), "Loading", report=ctx.progress,
+                                   text_columns=MANIFEST_TEXT_HEADERS)
+            inserted, skipped = import_manifest(chunks)
+    finally:
+        os.remove(path)
+    invalidate_entries()
+    return f"Import Complete! {inserted:,} new CNs added, {skipped:,} skipped (already exist). {chunks.summary()}"
+
+def run_bulk_update(ctx, path):
+    """
+    Job: applies the saved update file at `path`.
+    """
+    try:
+        with open(path, "rb") as f:
+            chunks = ingest.stream(f, prepare_bulk_update, "Applying updates", report=ctx.progress,
+                                   text_columns=UPDATE_TEXT_HEADERS)
+            matched, unmatched = apply_bulk_update(chunks)
+    finally:
+        os.remove(path)
+    invalidate_entries()
+    message = f"✅ Updated {matched:,} CNs."
+    if unmatched: message += f" {unmatched:,} CN Nos were not found in the register."
+    return f"{message} {chunks.summary()}"
+
+# --- REGISTER GRID (Keyset Paging) ---
+
+GRID_EDITABLE_COLS = ["manual_figures", "sales_amount", "remarks"]
+
+REGISTER_COLS = [
+    "cn_no", "manifest_date", "consignor", "consignee", "actual_wt",
+    "sales_amount", "manual_figures", "remarks"
+]
+
+PAGE_SIZES = [100, 250, 500, 1000]
+
+SEARCH_RESULT_CAP = 1000   # search counts stop here ("1,000+"); Next ▶ keeps paging past it
+SEARCH_CACHE_TTL = 60      # seconds a repeated search term is served from cache
+
+@st.cache_data(ttl=SEARCH_CACHE_TTL, show_spinner=False)
+def cn_exists(cn_no):
+    df = db_utils.fetch_data("SELECT 1 FROM logistics_entries WHERE cn_no = %s LIMIT 1", (cn_no,))
+    return not df.empty
+
+def register_filter(start_date, end_date, search_query):
+    """
+    WHERE clause + params for the register. A search that is an exact CN No takes the
+    index lookup; anything else is a trigram-indexed ILIKE on CN No / consignor, matching
+    the term literally (% and _ in it are escaped). Without a search the date range applies.
+    """
+    term = search_query.strip() if search_query else ""
+    if term:
+        if cn_exists(term):
+            return "cn_no = %s", [term]
+        escaped = term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        pattern = f"%{escaped}%"
+        # DuckDB has no default LIKE escape character, so it is spelled out
+        return "(cn_no ILIKE %s ESCAPE '\\' OR consignor ILIKE %s ESCAPE '\\')", [pattern, pattern]
+    return "manifest_date >= %s AND manifest_date <= %s", [start_date, end_date]
+
+@st.cache_data(ttl=SEARCH_CACHE_TTL, show_spinner=False)
+def count_register(where, params, cap=None):
+    """
+    Rows matching the filter; with `cap`, counting stops at cap + 1 so broad searches stay cheap.
+    """
+    if cap:
+        sql = f"SELECT COUNT(*) AS n FROM (SELECT 1 FROM logistics_entries WHERE {where} LIMIT {int(cap) + 1}) s"
+    else:
+        sql = f"SELECT COUNT(*) AS n FROM logistics_entries WHERE {where}"
+    df = db_utils.fetch_data(sql, params)
+    return int(df['n'].iloc[0])
+
+def _register_rows(where, params, seek, seek_params, limit):
+    sql = (f"SELECT {', '.join(REGISTER_COLS)} FROM logistics_entries WHERE {where} AND {seek} "
+           "ORDER BY manifest_date DESC, cn_no DESC LIMIT %s")
+    return db_utils.fetch_data(sql, list(params) + list(seek_params) + [limit])
+
+@st.cache_data(ttl=SEARCH_CACHE_TTL, show_spinner=False)
+def fetch_register_page(where, params, after=None, page_size=250):
+    """
+    One page of the register, newest first, ordered by (manifest_date DESC NULLS LAST, cn_no DESC).
+    `after` is the (manifest_date, cn_no) of the last row on the previous page.
+    Dated and undated rows are read separately, so each part seeks the (manifest_date, cn_no)
+    index: a NULL date can't be compared with, and NULLS LAST runs against the index order.
+    """
+    after_date, after_cn = after if after is not None else (None, None)
+    if after is not None and pd.isna(after_date):
+        # Already past the dated rows
+        return _register_rows(where, params, "manifest_date IS NULL AND cn_no < %s", [after_cn], page_size)
+    if after is None:
+        df = _register_rows(where, params, "manifest_date IS NOT NULL", [], page_size)
+    else:
+        df = _register_rows(where, params, "(manifest_date, cn_no) < (%s, %s)", [after_date, after_cn], page_size)
+    if len(df) < page_size:
+        undated = _register_rows(where, params, "manifest_date IS NULL", [], page_size - len(df))
+        if not undated.empty:
+            df = pd.concat([df, undated], ignore_index=True) if not df.empty else undated
+    return df
+
+def invalidate_entries():
+    """
+    Drops cached register pages and Report Center data after logistics_entries changes.
+    """
+    cn_exists.clear()
+    count_register.clear()
+    fetch_register_page.clear()
+    data_cache.invalidate("logistics_entries", "master_data")
+
 def app():
     st.set_page_config(layout="wide", page_title="Logistics Pro")
     st.title("🗄️ Logistics Master Register")
@@ -23,50 +280,11 @@ def app():
             new_file = st.file_uploader("Upload Manifest CSV", type=["csv"], key="new_upload")
             if new_file and st.button("🚀 Run Import"):
                 try:
-                    df = pd.read_csv(new_file, dtype={'Actual WT': str})
-                    # Rename & Clean
-                    df = df.rename(columns={
-                        "Manifest No": "manifest_no", "Manifest Date": "manifest_date",
-                        "CN No": "cn_no", "CN Date": "cn_date",
-                        "Consignor": "consignor", "Consignee": "consignee",
-                        "Payment Liability": "payment_liability", "No. of PKGS": "no_of_pkgs",
-                        "Type": "pkg_type", "Actual WT": "actual_wt",
-                        "Consignor Invoice No": "consignor_invoice_no",
-                        "From": "dispatch_from", "To": "dispatch_to",
-                        "Sales Type": "sales_type", "Sales Amount (₹)": "sales_amount"
-                    })
-                    df['manifest_date'] = pd.to_datetime(df['manifest_date'], dayfirst=True).dt.date
-                    df['cn_date'] = pd.to_datetime(df['cn_date'], dayfirst=True).dt.date
-                    df = df.fillna("")
-
-                    # Batch Insert
-                    progress = st.progress(0)
-                    chunk_size = 500
-                    chunks = [df[i:i + chunk_size] for i in range(0, len(df), chunk_size)]
-                    
-                    for i, chunk in enumerate(chunks):
-                        placeholders = ",".join(["(%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)"] * len(chunk))
-                        query = f"""
-                            INSERT INTO logistics_entries (
-                                manifest_no, manifest_date, cn_no, cn_date, consignor, consignee, payment_liability, 
-                                no_of_pkgs, pkg_type, actual_wt, consignor_invoice_no, dispatch_from, dispatch_to, 
-                                sales_type, sales_amount, created_by
-                            ) VALUES {placeholders}
-                            ON CONFLICT DO NOTHING; -- Prevents crashing if CN exists
-                        """
-                        flat_data = []
-                        for _, row in chunk.iterrows():
-                            flat_data.extend([
-                                row['manifest_no'], row['manifest_date'], row['cn_no'], row['cn_date'],
-                                row['consignor'], row['consignee'], row['payment_liability'],
-                                row['no_of_pkgs'], row['pkg_type'], str(row['actual_wt']),
-                                row['consignor_invoice_no'], row['dispatch_from'], row['dispatch_to'],
-                                row['sales_type'], row['sales_amount'], st.session_state.username
-                            ])
-                        db_utils.run_query(query, tuple(flat_data))
-                        progress.progress(min((i + 1) * chunk_size, len(df)) / len(df))
-                    st.success("Import Complete!")
-                    st.rerun()
+                    username = st.session_state.username
+                    job_id = jobs.new_job_id()
+                    jobs.submit("import", f"Import {new_file.name}", run_manifest_import,
+                                jobs.save_upload(new_file, job_id), username, owner=username, job_id=job_id)
+                    st.info("Import queued, progress is shown below.")
                 except Exception as e:
                     st.error(f"Import Error: {e}")
 
@@ -83,66 +301,45 @@ def app():
             
             if update_file and st.button("🔄 Start Bulk Update"):
                 try:
-                    df_u = pd.read_csv(update_file)
-                    
-                    # Progress Bar
-                    prog_bar = st.progress(0)
-                    total_rows = len(df_u)
-                    
-                    for index, row in df_u.iterrows():
-                        cn = str(row['CN No'])
-                        
-                        # Build Dynamic Update Query
-                        updates = []
-                        params = []
-                        
-                        # Only update columns that have values (not empty)
-                        if 'Manual Recvd' in row and pd.notna(row['Manual Recvd']):
-                            updates.append("manual_figures = %s")
-                            params.append(float(row['Manual Recvd']))
-                            
-                        if 'Sales Amount' in row and pd.notna(row['Sales Amount']):
-                            updates.append("sales_amount = %s")
-                            params.append(float(row['Sales Amount']))
-                            
-                        if 'Remarks' in row and pd.notna(row['Remarks']):
-                            updates.append("remarks = %s")
-                            params.append(str(row['Remarks']))
-
-                        if updates:
-                            # Add CN to params for the WHERE clause
-                            params.append(cn)
-                            
-                            sql = f"UPDATE logistics_entries SET {', '.join(updates)} WHERE cn_no = %s"
-                            db_utils.run_query(sql, tuple(params))
-                        
-                        prog_bar.progress((index + 1) / total_rows)
-                        
-                    st.success(f"✅ Successfully updated {total_rows} records!")
-                    st.rerun()
+                    username = st.session_state.username
+                    job_id = jobs.new_job_id()
+                    jobs.submit("update", f"Bulk update {update_file.name}", run_bulk_update,
+                                jobs.save_upload(update_file, job_id), owner=username, job_id=job_id)
+                    st.info("Update queued, progress is shown below.")
                     
                 except Exception as e:
                     st.error(f"Update Error: {e}")
 
+        jobs.jobs_panel(st.session_state.username, kinds=["import", "update"])
+
     # --- MAIN SCREEN: REGISTER GRID ---
 
     # 1. Search & Filter
-    col1, col2, col3 = st.columns([2, 1, 1])
+    col1, col2, col3, col4 = st.columns([2, 1, 1, 1])
     with col1:
         search_query = st.text_input("🔍 Search (CN No, Party Name)", placeholder="Enter CN No...")
     with col2:
         start_date = st.date_input("From Date", datetime.now() - timedelta(days=30))
     with col3:
         end_date = st.date_input("To Date", datetime.now())
+    with col4:
+        page_size = st.selectbox("Rows / Page", PAGE_SIZES, index=1)
 
-    # 2. Fetch Data
+    # 2. Fetch Data (one keyset page at a time)
     try:
-        if search_query:
-            query = f"SELECT * FROM logistics_entries WHERE cn_no ILIKE '%%{search_query}%%' OR consignor ILIKE '%%{search_query}%%' ORDER BY cn_date DESC"
-        else:
-            query = f"SELECT * FROM logistics_entries WHERE manifest_date >= '{start_date}' AND manifest_date <= '{end_date}' ORDER BY manifest_date DESC"
-        
-        df_main = db_utils.fetch_data(query)
+        where, params = register_filter(start_date, end_date, search_query)
+
+        # Restart from page 1 whenever the filter changes
+        filter_key = (where, tuple(str(p) for p in params), page_size)
+        if st.session_state.get("reg_filter") != filter_key:
+            st.session_state.reg_filter = filter_key
+            st.session_state.reg_cursors = [None]
+        cursors = st.session_state.reg_cursors
+        page = len(cursors) - 1
+
+        cap = SEARCH_RESULT_CAP if search_query else None
+        total = count_register(where, params, cap)
+        df_main = fetch_register_page(where, params, cursors[-1], page_size)
 
         if not df_main.empty:
             # --- CALCULATIONS ---
@@ -150,14 +347,7 @@ def app():
             df_main['manual_figures'] = pd.to_numeric(df_main['manual_figures'], errors='coerce').fillna(0)
 
             # Auto-Calculate Logic
-            df_main['Discount'] = df_main.apply(lambda x: x['sales_amount'] - x['manual_figures'] 
-                                                if (0 < x['manual_figures'] < x['sales_amount']) else 0, axis=1)
-            
-            df_main['Excess'] = df_main.apply(lambda x: x['manual_figures'] - x['sales_amount'] 
-                                              if x['manual_figures'] > x['sales_amount'] else 0, axis=1)
-            
-            df_main['Due Amount'] = df_main.apply(lambda x: x['sales_amount'] 
-                                                  if x['manual_figures'] == 0 else 0, axis=1)
+            reconciliation.add_reconciliation_columns(df_main, due_col='Due Amount')
 
             # Display Columns
             cols_to_show = [
@@ -168,7 +358,12 @@ def app():
             df_display = df_main[cols_to_show].copy()
 
             # 3. Interactive Grid
-            st.info(f"Showing {len(df_main)} records.")
+            capped = cap is not None and total > cap
+            pages = max(1, -(-total // page_size))
+            if capped:
+                st.info(f"Showing {len(df_main)} of {cap:,}+ matches (page {page + 1}). Refine the search or page on with Next ▶.")
+            else:
+                st.info(f"Showing {len(df_main)} of {total:,} records (page {page + 1} of {pages}).")
             
             edited_df = st.data_editor(
                 df_display,
@@ -187,26 +382,28 @@ def app():
                 height=600
             )
 
+            nav1, _, nav2 = st.columns([1, 4, 1])
+            if nav1.button("◀ Prev", disabled=page == 0):
+                cursors.pop()
+                st.rerun()
+            if nav2.button("Next ▶", disabled=len(df_main) < page_size or (page + 1 >= pages and not capped)):
+                last = df_main.iloc[-1]
+                cursors.append((last['manifest_date'], last['cn_no']))
+                st.rerun()
+
             # 4. Save Grid Changes Button
             st.write("###")
             if st.button("💾 Save Grid Changes", type="primary"):
-                progress = st.progress(0)
-                total = len(edited_df)
-                
-                for index, row in edited_df.iterrows():
-                    cn = row['cn_no']
-                    man_fig = row['manual_figures']
-                    sales_fig = row['sales_amount']
-                    rem = row['remarks']
-                    
-                    # Update both Manual AND Sales Amount (if edited in grid)
-                    db_utils.run_query(
-                        "UPDATE logistics_entries SET manual_figures = %s, sales_amount = %s, remarks = %s WHERE cn_no = %s", 
-                        (man_fig, sales_fig, rem, cn)
-                    )
-                    progress.progress((index + 1) / total)
+                # Only rows the user actually edited go to the database
+                dirty = db_utils.changed_rows(df_display, edited_df, GRID_EDITABLE_COLS)
+                with metrics.stage("entry.grid_save"), db_utils.connection() as conn:
+                    # One transaction: the rollups are never behind a committed save
+                    with conn.cursor() as cur:
+                        saved = db_utils.bulk_update("logistics_entries", "cn_no", dirty, GRID_EDITABLE_COLS, cur)
+                        rollups.refresh_sales_days(dirty['manifest_date'], cur)
                 
-                st.success("✅ Updates Saved!")
+                invalidate_entries()
+                st.success(f"✅ Updates Saved! ({saved} changed rows)")
                 st.rerun()
 
         else:
@@ -216,4 +413,5 @@ def app():
         st.error(f"Error loading data: {e}")
 
 if __name__ == "__main__":
+    migrations.migrate()
     app()
@@ -1,5 +1,8 @@
 import streamlit as st
 import auth
+import db_utils
+import metrics
+import migrations
 import report_center
 import logistics_pro
 import branch_expenses
@@ -7,6 +10,9 @@ import ho_expenses  # <--- FINAL IMPORT
 
 # --- 1. GLOBAL CONFIG ---
 st.set_page_config(page_title="DevXPS Logistics", layout="wide", page_icon="🚛")
+metrics.start_run("rerun")
+metrics.serve_metrics()
+migrations.migrate()
 
 # --- 2. LOGIN CHECK ---
 if not auth.check_login():
@@ -60,6 +66,13 @@ elif selection == "expense_ho":
     except AttributeError:
         st.error("⚠️ Error: `ho_expenses.py` is missing the `app()` function.")
 
+# Connection Pool Monitor (for sizing pool_max)
+if user_role == "admin":
+    st.sidebar.divider()
+    with st.sidebar.expander("🔌 DB Pool"):
+        st.json(db_utils.pool_stats())
+    metrics.sidebar_panel()
+
 # Logout
 st.sidebar.divider()
 auth.logout()
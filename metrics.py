@@ -0,0 +1,276 @@
+import contextvars
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import streamlit as st
+import pandas as pd
+
+# --- INSTRUMENTATION ---
+# Every statement sent through a db_utils connection is recorded with its SQL fingerprint
+# (literals and parameters replaced by ?), rows, latency and the pool wait of its
+# checkout. Code marks its major steps with stages:
+#
+#   with metrics.stage("import.manifest"): ...      # or @metrics.stage("report.due_summary")
+#
+# Events land in the current run (one Streamlit rerun or one background job, see
+# start_run), which the admin sidebar panel breaks down into database / Python / the rest
+# (rendering). Process-wide totals per fingerprint and stage are kept as well; optionally
+# every event is appended as a JSON line to METRICS_LOG, and METRICS_PORT serves the
+# totals on 127.0.0.1 (/metrics in Prometheus text format, /metrics.json).
+
+METRICS_LOG = os.environ.get("METRICS_LOG")
+METRICS_PORT = os.environ.get("METRICS_PORT")
+MAX_RUN_EVENTS = 2000        # per run; later events still count in the totals
+MAX_FINGERPRINTS = 500       # distinct statements tracked process-wide
+
+_run = contextvars.ContextVar("metrics_run", default=None)
+_stages = contextvars.ContextVar("metrics_stages", default=())
+_pending = threading.local()  # pool wait of the last checkout on this thread
+
+_lock = threading.Lock()
+_queries = {}                 # fingerprint id -> totals
+_stage_totals = {}            # stage name -> totals
+_pool_wait = {"count": 0, "seconds": 0.0}
+
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PARAM_RE = re.compile(r"%\(\w+\)s|%s")
+_LIST_RE = re.compile(r"\((?:\s*\?\s*,)+\s*\?\s*\)")
+
+def fingerprint(sql):
+    """
+    (id, normalized text) of a statement: same shape, same fingerprint, whatever the values.
+    """
+    if isinstance(sql, bytes): sql = sql.decode("utf-8", "replace")
+    text = sql if isinstance(sql, str) else str(sql)
+    text = _STRING_RE.sub("?", text)
+    text = _PARAM_RE.sub("?", text)
+    text = _NUMBER_RE.sub("?", text)
+    text = _LIST_RE.sub("(?)", text)
+    text = " ".join(text.split())
+    return hashlib.md5(text.encode()).hexdigest()[:10], text
+
+class Run:
+    """
+    Events of one rerun or job. Worker threads add to it through metrics.bind().
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.started = time.perf_counter()
+        self.events = []
+        self.dropped = 0
+        self._lock = threading.Lock()
+
+    def add(self, event):
+        with self._lock:
+            if len(self.events) < MAX_RUN_EVENTS:
+                self.events.append(event)
+            else:
+                self.dropped += 1
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+def start_run(name):
+    """
+    Starts collecting for a new run in this thread (and contexts bound from it). Returns the Run.
+    """
+    run = Run(name)
+    _run.set(run)
+    _stages.set(())
+    return run
+
+def current_run():
+    return _run.get()
+
+def bind(fn):
+    """
+    `fn` wrapped to run in a copy of the current context, so its queries count towards
+    this run and stage when it executes on another thread (e.g. an executor).
+    """
+    ctx = contextvars.copy_context()
+    return lambda *args, **kwargs: ctx.run(fn, *args, **kwargs)
+
+# --- RECORDING ---
+
+_log = None
+
+def _logger():
+    global _log
+    if _log is None:
+        _log = logging.getLogger("logistics.metrics")
+        if not _log.handlers:
+            handler = logging.FileHandler(METRICS_LOG, encoding="utf-8")
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            _log.addHandler(handler)
+            _log.setLevel(logging.INFO)
+            _log.propagate = False
+    return _log
+
+def _emit(event):
+    run = _run.get()
+    if run is not None:
+        event["at"] = round(run.elapsed() - event.get("seconds", 0), 4)
+        run.add(event)
+    if METRICS_LOG:
+        _logger().info(json.dumps({"ts": time.time(), "run": run.name if run else None, **event}, default=str))
+
+def record_wait(seconds):
+    """
+    Called by the pool on every checkout; the wait is attributed to the next statement on this thread.
+    """
+    _pending.wait = getattr(_pending, "wait", 0.0) + seconds
+    with _lock:
+        _pool_wait["count"] += 1
+        _pool_wait["seconds"] += seconds
+
+def record_query(sql, seconds, rows=None):
+    fp, text = fingerprint(sql)
+    wait = getattr(_pending, "wait", 0.0)
+    _pending.wait = 0.0
+    rows = rows if rows is not None and rows >= 0 else None
+    with _lock:
+        totals = _queries.get(fp)
+        if totals is None and len(_queries) < MAX_FINGERPRINTS:
+            totals = _queries[fp] = {"sql": text[:500], "count": 0, "seconds": 0.0, "max_s": 0.0, "rows": 0}
+        if totals is not None:
+            totals["count"] += 1
+            totals["seconds"] += seconds
+            totals["max_s"] = max(totals["max_s"], seconds)
+            totals["rows"] += rows or 0
+    stages = _stages.get()
+    _emit({"type": "query", "fingerprint": fp, "sql": text[:200], "seconds": round(seconds, 5),
+           "rows": rows, "wait_s": round(wait, 5), "stage": stages[-1] if stages else None})
+
+@contextmanager
+def stage(name):
+    """
+    Times the enclosed block (also usable as a function decorator). Stages nest; queries
+    inside are tagged with the innermost one.
+    """
+    token = _stages.set(_stages.get() + (name,))
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - started
+        depth = len(_stages.get()) - 1
+        _stages.reset(token)
+        with _lock:
+            totals = _stage_totals.setdefault(name, {"count": 0, "seconds": 0.0, "max_s": 0.0})
+            totals["count"] += 1
+            totals["seconds"] += seconds
+            totals["max_s"] = max(totals["max_s"], seconds)
+        _emit({"type": "stage", "name": name, "seconds": round(seconds, 5), "depth": depth})
+
+# --- SUMMARIES ---
+
+def run_breakdown(run):
+    """
+    (summary dict, stages DataFrame, queries-by-fingerprint DataFrame) for a run.
+    `db_s` can exceed wall time when queries ran in parallel.
+    """
+    events = list(run.events)
+    queries = [e for e in events if e["type"] == "query"]
+    stages = [e for e in events if e["type"] == "stage"]
+    total = run.elapsed()
+    db_s = sum(e["seconds"] for e in queries)
+    top_stage_s = sum(e["seconds"] for e in stages if e["depth"] == 0)
+    top_db_s = sum(e["seconds"] for e in queries if e["stage"] is None)
+    summary = {
+        "run": run.name, "total_s": round(total, 3), "db_s": round(db_s, 3),
+        "pool_wait_s": round(sum(e["wait_s"] for e in queries), 3), "queries": len(queries),
+        # Outside any stage and not waiting on the database: mostly Streamlit rendering
+        "other_s": round(max(total - top_stage_s - top_db_s, 0.0), 3),
+        "dropped_events": run.dropped,
+    }
+    stage_df = pd.DataFrame(stages, columns=["name", "depth", "at", "seconds"])
+    if queries:
+        q = pd.DataFrame(queries)
+        query_df = (q.groupby(["fingerprint", "sql"], dropna=False)
+                     .agg(count=("seconds", "size"), seconds=("seconds", "sum"), max_s=("seconds", "max"),
+                          rows=("rows", "sum"), wait_s=("wait_s", "sum"))
+                     .sort_values("seconds", ascending=False).reset_index())
+    else:
+        query_df = pd.DataFrame(columns=["fingerprint", "sql", "count", "seconds", "max_s", "rows", "wait_s"])
+    return summary, stage_df, query_df
+
+def totals():
+    with _lock:
+        return {"queries": {k: dict(v) for k, v in _queries.items()},
+                "stages": {k: dict(v) for k, v in _stage_totals.items()},
+                "pool_wait": dict(_pool_wait)}
+
+def prometheus_text():
+    t = totals()
+    lines = ["# TYPE logistics_query_seconds_total counter", "# TYPE logistics_query_count_total counter"]
+    for fp, q in t["queries"].items():
+        lines.append(f'logistics_query_seconds_total{{fingerprint="{fp}"}} {q["seconds"]:.6f}')
+        lines.append(f'logistics_query_count_total{{fingerprint="{fp}"}} {q["count"]}')
+    lines += ["# TYPE logistics_stage_seconds_total counter", "# TYPE logistics_stage_count_total counter"]
+    for name, s in t["stages"].items():
+        lines.append(f'logistics_stage_seconds_total{{stage="{name}"}} {s["seconds"]:.6f}')
+        lines.append(f'logistics_stage_count_total{{stage="{name}"}} {s["count"]}')
+    lines += ["# TYPE logistics_pool_wait_seconds_total counter",
+              f'logistics_pool_wait_seconds_total {t["pool_wait"]["seconds"]:.6f}',
+              f'logistics_pool_checkouts_total {t["pool_wait"]["count"]}']
+    return "\n".join(lines) + "\n"
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == "/metrics":
+            body, kind = prometheus_text().encode(), "text/plain; version=0.0.4"
+        elif self.path == "/metrics.json":
+            body, kind = json.dumps(totals()).encode(), "application/json"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", kind)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+@st.cache_resource
+def serve_metrics():
+    """
+    Starts the local metrics endpoint once per process when METRICS_PORT is set.
+    """
+    if not METRICS_PORT: return None
+    server = ThreadingHTTPServer(("127.0.0.1", int(METRICS_PORT)), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True, name="metrics").start()
+    return server
+
+# --- UI ---
+
+def sidebar_panel():
+    """
+    Admin panel: this rerun's time split into database / stages / the rest, the stages in
+    order, and its statements grouped by fingerprint.
+    """
+    run = current_run()
+    if run is None: return
+    summary, stage_df, query_df = run_breakdown(run)
+    with st.sidebar.expander("⏱️ Run Timings"):
+        st.caption(f"Rerun {summary['total_s']:.2f}s · {summary['queries']} queries, {summary['db_s']:.2f}s in the "
+                   f"database ({summary['pool_wait_s']:.2f}s pool wait) · {summary['other_s']:.2f}s outside stages "
+                   "(mostly rendering)")
+        if not stage_df.empty:
+            stage_df = stage_df.sort_values('at')
+            st.dataframe(stage_df.assign(name=stage_df['depth'].map(lambda d: "· " * d) + stage_df['name'])
+                                 .drop(columns='depth'), hide_index=True, use_container_width=True)
+        if not query_df.empty:
+            st.dataframe(query_df, hide_index=True, use_container_width=True)
+        if METRICS_PORT:
+            st.caption(f"Process totals: http://127.0.0.1:{METRICS_PORT}/metrics")
@@ -0,0 +1,224 @@
+import re
+import streamlit as st
+import psycopg2
+import db_utils
+import expense_store
+import rollups
+
+# --- SCHEMA MIGRATIONS ---
+# All DDL runs here, once: each database records the migrations it has applied in
+# `schema_version`, and migrate() (called at process start by main.py, and by scripts
+# before they touch tables) applies the missing ones in order. Page loads run no DDL and
+# no introspection.
+#
+# Migrations are append-only: to change the schema, add a step with the next version,
+# never edit one that has shipped. Steps are idempotent (IF NOT EXISTS and the like), so a
+# database created before this table existed records them all on its first start.
+#
+# A step returns True once applied. Postgres-only steps return False on DuckDB; the
+# optional ones (change tracking, indexes) also return False when the database refuses
+# them, e.g. without pg_trgm. Those are not recorded, so they are retried on the next
+# start, and callers that depend on one check applied(name).
+
+SCHEMA_VERSION_DDL = """
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version integer PRIMARY KEY,
+        name text NOT NULL,
+        applied_at timestamptz NOT NULL DEFAULT CURRENT_TIMESTAMP
+    )
+"""
+
+CONCURRENT_INDEX_RE = re.compile(r"CREATE\s+INDEX\s+CONCURRENTLY\s+IF\s+NOT\s+EXISTS\s+(\w+)", re.IGNORECASE)
+
+def _concurrently(conn, statements):
+    """
+    Runs `statements` outside a transaction (CREATE INDEX CONCURRENTLY can't run in one),
+    so writers aren't blocked while indexes build. False if one fails.
+    A concurrent build that failed or was interrupted leaves an invalid index behind, which
+    IF NOT EXISTS would then skip for good; such an index is dropped and built again.
+    """
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            for sql in statements:
+                try:
+                    index = CONCURRENT_INDEX_RE.match(sql.strip())
+                    if index:
+                        cur.execute("""
+                            SELECT COUNT(*) FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+                            WHERE c.relname = %s AND c.relnamespace = current_schema()::regnamespace
+                              AND NOT i.indisvalid
+                        """, (index.group(1),))
+                        if cur.fetchone()[0]:
+                            cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {index.group(1)}")
+                    cur.execute(sql)
+                except psycopg2.Error:
+                    return False
+    finally:
+        conn.autocommit = False
+    return True
+
+def _baseline(conn):
+    with conn.cursor() as cur:
+        cur.execute(db_utils.baseline_schema_sql())
+        # An existing master_data (production's own definition) is left alone
+        cur.execute("""
+            SELECT COUNT(*) FROM information_schema.tables
+            WHERE table_name = 'master_data' AND table_schema = current_schema()
+        """)
+        if not cur.fetchone()[0]:
+            cur.execute(db_utils.MASTER_DATA_VIEW)
+    return True
+
+def _expense_lines(conn):
+    # Databases from before the expense catalog still have one column per type
+    with conn.cursor() as cur:
+        expense_store.migrate_legacy_columns(cur)
+        for table, names in expense_store.DEFAULT_TYPES.items():
+            expense_store.seed_types(cur, table, names)
+    return True
+
+CHANGE_TRACKED_TABLES = ["logistics_entries", "branch_expenses", "ho_expenses"]
+
+def _change_tracking(conn):
+    """
+    An `updated_at` column on the tracked tables, set to now() on insert by its default
+    and on every UPDATE by a trigger, plus an index so "changed since" queries stay cheap.
+    Without it (or on DuckDB, which has no triggers) Report Center reloads in full.
+    """
+    if not db_utils.is_postgres(): return False
+    try:
+        with conn.cursor() as cur:
+            cur.execute("""
+                CREATE OR REPLACE FUNCTION set_updated_at() RETURNS trigger AS $$
+                BEGIN
+                    NEW.updated_at = now();
+                    RETURN NEW;
+                END
+                $$ LANGUAGE plpgsql
+            """)
+            for table in CHANGE_TRACKED_TABLES:
+                cur.execute(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS updated_at timestamptz NOT NULL DEFAULT now()")
+                cur.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_updated_at ON {table} (updated_at)")
+                cur.execute(f"DROP TRIGGER IF EXISTS trg_{table}_updated_at ON {table}")
+                cur.execute(f"""
+                    CREATE TRIGGER trg_{table}_updated_at BEFORE UPDATE ON {table}
+                    FOR EACH ROW EXECUTE FUNCTION set_updated_at()
+                """)
+    except psycopg2.Error:
+        return False
+    return True
+
+def _rollup_tables(conn):
+    # Filled in the same transaction, so they are never recorded empty
+    if not rollups.enabled(): return False
+    with conn.cursor() as cur:
+        cur.execute(rollups.DDL)
+        rollups.rebuild_all(cur)
+    return True
+
+def _search_indexes(conn):
+    """
+    The register's search/paging indexes: trigram GIN indexes for ILIKE '%term%' on
+    cn_no / consignor, a pattern index for CN prefix and exact lookups, and
+    (manifest_date, cn_no) for keyset paging. Without pg_trgm searches fall back to a scan.
+    """
+    if not db_utils.is_postgres(): return False
+    return _concurrently(conn, [
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_logistics_cn_prefix ON logistics_entries (cn_no text_pattern_ops)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_logistics_date_cn ON logistics_entries (manifest_date, cn_no)",
+        "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_logistics_cn_trgm ON logistics_entries USING gin (cn_no gin_trgm_ops)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_logistics_consignor_trgm ON logistics_entries USING gin (consignor gin_trgm_ops)",
+    ])
+
+# Every report and register query filters on these dates, and the tables only grow. Monthly
+# partitioning would need the date in every unique key, but imports and edits rely on cn_no
+# and manifest_no being unique on their own, so the date columns are indexed instead. On
+# logistics_entries that is a BRIN (one min/max summary per 32 pages, a few kB) that lets
+# month-sized scans skip everything outside the range, and costs imports next to nothing;
+# a B-tree only won on single-day ranges. BRIN relies on rows being stored roughly in date
+# order, which holds as manifests are imported; the planner ignores it if that stops being true.
+DATE_INDEXES = [
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_logistics_date_brin ON logistics_entries USING brin (manifest_date) "
+    "WITH (pages_per_range = 32, autosummarize = on)",
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_branch_expenses_date ON branch_expenses (manifest_date)",
+    # ho_expenses and the lines / rollup tables are keyed (or indexed) by their date already
+]
+
+def _date_indexes(conn):
+    # DuckDB keeps min/max per row group instead
+    if not db_utils.is_postgres(): return False
+    return _concurrently(conn, DATE_INDEXES)
+
+def _entry_order(conn):
+    """
+    logistics_entries.id, the order rows were entered in: the Due Summary lists CNs in it.
+    Tables that predate the baseline may not have it; their rows are numbered in storage order.
+    """
+    with conn.cursor() as cur:
+        cur.execute("CREATE SEQUENCE IF NOT EXISTS logistics_entries_id_seq")
+        cur.execute("ALTER TABLE logistics_entries ADD COLUMN IF NOT EXISTS id bigint DEFAULT nextval('logistics_entries_id_seq')")
+    return True
+
+# (version, name, step); append only
+MIGRATIONS = [
+    (1, "baseline", _baseline),
+    (2, "expense_lines", _expense_lines),
+    (3, "change_tracking", _change_tracking),
+    (4, "rollup_tables", _rollup_tables),
+    (5, "search_indexes", _search_indexes),
+    (6, "date_indexes", _date_indexes),
+    (7, "entry_order", _entry_order),
+]
+
+# --- RUNNER ---
+
+@st.cache_resource
+def migrate():
+    """
+    Applies the migrations this database hasn't recorded yet, in order, each in its own
+    transaction together with its schema_version row. Runs once per process; returns the
+    names of the migrations in place.
+    """
+    with db_utils.connection() as conn:
+        with conn.cursor() as cur:
+            if db_utils.is_postgres():
+                # One process migrates at a time; the others wait, then find the work done
+                cur.execute("SELECT pg_advisory_lock(hashtext('schema_version'))")
+            # Looked up first, so a migrated database gets no DDL at all
+            cur.execute("""
+                SELECT COUNT(*) FROM information_schema.tables
+                WHERE table_name = 'schema_version' AND table_schema = current_schema()
+            """)
+            if not cur.fetchone()[0]:
+                cur.execute(SCHEMA_VERSION_DDL)
+            cur.execute("SELECT version FROM schema_version")
+            applied = {row[0] for row in cur.fetchall()}
+        conn.commit()
+        try:
+            for version, name, step in MIGRATIONS:
+                if version in applied: continue
+                if not step(conn):
+                    conn.rollback()
+                    continue
+                with conn.cursor() as cur:
+                    cur.execute("INSERT INTO schema_version (version, name) VALUES (%s, %s)", (version, name))
+                conn.commit()
+                applied.add(version)
+        finally:
+            conn.rollback()
+            if db_utils.is_postgres():
+                with conn.cursor() as cur:
+                    cur.execute("SELECT pg_advisory_unlock(hashtext('schema_version'))")
+                conn.commit()
+    return frozenset(name for version, name, _ in MIGRATIONS if version in applied)
+
+def applied(name):
+    """
+    Whether migration `name` is in place, for features that work without an optional one.
+    """
+    return name in migrate()
+
+if __name__ == "__main__":
+    print("Schema migrations in place:", ", ".join(sorted(migrate())))
@@ -0,0 +1,28 @@
+import numpy as np
+
+# --- CN RECONCILIATION (Vectorized) ---
+# Compares the billed `sales_amount` with the `manual_figures` actually received:
+#   Discount : received less than billed (but something was received)
+#   Excess   : received more than billed
+#   Due      : nothing received yet, the whole bill is outstanding
+
+def discount(sales, manual):
+    return np.where((manual > 0) & (manual < sales), sales - manual, 0)
+
+def excess(sales, manual):
+    return np.where(manual > sales, manual - sales, 0)
+
+def due(sales, manual):
+    return np.where(manual == 0, sales, 0)
+
+def add_reconciliation_columns(df, discount_col="Discount", excess_col="Excess", due_col="Due_From_Party"):
+    """
+    Adds Discount / Excess / Due columns to `df` in place (pass None to skip one) and returns it.
+    Expects numeric `sales_amount` and `manual_figures` columns.
+    """
+    sales = df['sales_amount'].to_numpy()
+    manual = df['manual_figures'].to_numpy()
+    if discount_col: df[discount_col] = discount(sales, manual)
+    if excess_col: df[excess_col] = excess(sales, manual)
+    if due_col: df[due_col] = due(sales, manual)
+    return df
@@ -1,7 +1,22 @@
 import streamlit as st
 import pandas as pd
 import db_utils  # <--- Cloud Manager
-import io
+import reconciliation
+import schemas
+import snapshots
+import data_cache
+import report_sql
+import rollups
+import expense_store
+import jobs
+import metrics
+import migrations
+import os
+import tempfile
+import xlsxwriter
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import partial
 from datetime import datetime, date, timedelta
 
 # --- 1. SAFE IMPORT FOR PLOTLY ---
@@ -13,17 +28,19 @@ except ImportError:
 
 # --- 2. HELPER FUNCTIONS (Cloud) ---
 
+# Tables the Report Center reads; write paths elsewhere invalidate these via data_cache
+REPORT_TABLES = ("master_data", "branch_expenses", "ho_expenses", "branch_mappings")
+
+def _fetch_parent_map():
+    df = db_utils.fetch_data("SELECT child_branch, parent_branch FROM branch_mappings")
+    if not df.empty:
+        return dict(zip(df['child_branch'], df['parent_branch']))
+    return {}
+
 def get_parent_map():
-    conn = db_utils.get_db_connection()
-    if not conn: return {}
     try:
-        df = pd.read_sql("SELECT child_branch, parent_branch FROM branch_mappings", conn)
-        conn.close()
-        if not df.empty:
-            return dict(zip(df['child_branch'], df['parent_branch']))
-        return {}
+        return data_cache.get_or_compute("parent_map", _fetch_parent_map, tables=("branch_mappings",))
     except Exception:
-        if conn: conn.close()
         return {}
 
 def add_mapping(child, parent):
@@ -31,146 +48,302 @@ def add_mapping(child, parent):
     parent = parent.strip().upper()
     if not child or not parent: return False
     
-    conn = db_utils.get_db_connection()
-    if not conn: return False
     try:
-        cur = conn.cursor()
-        cur.execute("""
+        db_utils.run_query("""
             INSERT INTO branch_mappings (child_branch, parent_branch) 
             VALUES (%s, %s)
             ON CONFLICT (child_branch) 
             DO UPDATE SET parent_branch = EXCLUDED.parent_branch
         """, (child, parent))
-        conn.commit()
-        cur.close()
-        conn.close()
+        data_cache.invalidate("branch_mappings")
         return True
     except Exception as e:
         st.error(f"Error saving setting: {e}")
         return False
 
 def delete_mapping(child):
-    conn = db_utils.get_db_connection()
-    if not conn: return
     try:
-        cur = conn.cursor()
-        cur.execute("DELETE FROM branch_mappings WHERE child_branch = %s", (child,))
-        conn.commit()
-        cur.close()
-        conn.close()
+        db_utils.run_query("DELETE FROM branch_mappings WHERE child_branch = %s", (child,))
+        data_cache.invalidate("branch_mappings")
     except Exception:
         pass
 
-def load_data(start, end):
-    conn = db_utils.get_db_connection()
-    if not conn: return pd.DataFrame(), pd.DataFrame(), pd.DataFrame()
+def _prepare_log(df_log):
+    if not df_log.empty:
+        # Dates, amounts, categories and the sales_type clean-up (see schemas.SCHEMAS)
+        schemas.apply_schema(df_log, "master_data")
+        reconciliation.add_reconciliation_columns(df_log, excess_col=None, due_col=None)
+    return df_log
 
-    try:
-        # 1. Logistics Data
-        q_log = f"SELECT * FROM master_data WHERE manifest_date >= '{start}' AND manifest_date <= '{end}'"
-        df_log = pd.read_sql(q_log, conn)
+def _prepare_branch(df_branch):
+    if not df_branch.empty:
+        schemas.apply_schema(df_branch, "branch_expenses")
+        info_cols = ['manifest_no', 'manifest_date', 'origin', 'destination', 'remarks', 'updated_at']
+        exp_cols = [c for c in df_branch.columns if c not in info_cols]
         
-        # 2. Branch Expenses
-        q_branch = f"SELECT * FROM branch_expenses WHERE manifest_date >= '{start}' AND manifest_date <= '{end}'"
-        df_branch = pd.read_sql(q_branch, conn)
+        rent_col = next((c for c in exp_cols if c.lower() == 'rent'), None)
+        vehicle_col = next((c for c in exp_cols if c.lower() == 'vehicle'), None)
         
-        # 3. HO Expenses
-        q_ho = f"SELECT * FROM ho_expenses WHERE entry_date >= '{start}' AND entry_date <= '{end}'"
-        df_ho = pd.read_sql(q_ho, conn)
+        df_branch[exp_cols] = df_branch[exp_cols].apply(pd.to_numeric, errors='coerce').fillna(0)
         
-        conn.close()
+        df_branch['Total_Rent'] = df_branch[rent_col] if rent_col else 0
+        df_branch['Total_Vehicle'] = df_branch[vehicle_col] if vehicle_col else 0
         
-        # --- PRE-PROCESSING ---
-        if not df_log.empty:
-            df_log['manifest_date'] = pd.to_datetime(df_log['manifest_date'])
-            if 'cn_date' in df_log.columns: df_log['cn_date'] = pd.to_datetime(df_log['cn_date'])
-            df_log['sales_amount'] = pd.to_numeric(df_log['sales_amount'], errors='coerce').fillna(0)
-            df_log['manual_figures'] = pd.to_numeric(df_log['manual_figures'], errors='coerce').fillna(0)
-            if 'sales_type' in df_log.columns:
-                df_log['sales_type'] = df_log['sales_type'].astype(str).str.strip().str.upper()
-
-        if not df_branch.empty:
-            df_branch['manifest_date'] = pd.to_datetime(df_branch['manifest_date'])
-            info_cols = ['manifest_no', 'manifest_date', 'origin', 'destination', 'remarks']
-            exp_cols = [c for c in df_branch.columns if c not in info_cols]
-            
-            rent_col = next((c for c in exp_cols if c.lower() == 'rent'), None)
-            vehicle_col = next((c for c in exp_cols if c.lower() == 'vehicle'), None)
-            
-            df_branch[exp_cols] = df_branch[exp_cols].apply(pd.to_numeric, errors='coerce').fillna(0)
-            
-            df_branch['Total_Rent'] = df_branch[rent_col] if rent_col else 0
-            df_branch['Total_Vehicle'] = df_branch[vehicle_col] if vehicle_col else 0
-            
-            other_cols = [c for c in exp_cols if c not in [rent_col, vehicle_col]]
-            df_branch['Total_Other_Exp'] = df_branch[other_cols].sum(axis=1)
-            
-            real_exp_cols = [c for c in exp_cols if 'transfer' not in c.lower()]
-            transfer_cols = [c for c in exp_cols if 'transfer' in c.lower()]
-            
-            df_branch['Total_Real_Exp'] = df_branch[real_exp_cols].sum(axis=1)
-            df_branch['Total_Transfer_HO'] = df_branch[transfer_cols].sum(axis=1) if transfer_cols else 0
+        other_cols = [c for c in exp_cols if c not in [rent_col, vehicle_col]]
+        df_branch['Total_Other_Exp'] = df_branch[other_cols].sum(axis=1)
+        
+        real_exp_cols = [c for c in exp_cols if 'transfer' not in c.lower()]
+        transfer_cols = [c for c in exp_cols if 'transfer' in c.lower()]
+        
+        df_branch['Total_Real_Exp'] = df_branch[real_exp_cols].sum(axis=1)
+        df_branch['Total_Transfer_HO'] = df_branch[transfer_cols].sum(axis=1) if transfer_cols else 0
+    return df_branch
 
-        if not df_ho.empty:
-            df_ho['entry_date'] = pd.to_datetime(df_ho['entry_date'])
-            info_cols_ho = ['entry_date', 'remarks']
-            exp_cols_ho = [c for c in df_ho.columns if c not in info_cols_ho]
-            
-            df_ho[exp_cols_ho] = df_ho[exp_cols_ho].apply(pd.to_numeric, errors='coerce').fillna(0)
-            df_ho['Total_HO_Exp'] = df_ho[exp_cols_ho].sum(axis=1)
+def _prepare_ho(df_ho):
+    if not df_ho.empty:
+        schemas.apply_schema(df_ho, "ho_expenses")
+        info_cols_ho = ['entry_date', 'remarks', 'updated_at']
+        exp_cols_ho = [c for c in df_ho.columns if c not in info_cols_ho]
+        
+        df_ho[exp_cols_ho] = df_ho[exp_cols_ho].apply(pd.to_numeric, errors='coerce').fillna(0)
+        df_ho['Total_HO_Exp'] = df_ho[exp_cols_ho].sum(axis=1)
+    return df_ho
+
+# name -> pre-processing step
+DATASETS = {
+    "master_data": _prepare_log,
+    "branch_expenses": _prepare_branch,
+    "ho_expenses": _prepare_ho,
+}
+
+def dataset_query(name):
+    """
+    SELECT of dataset `name` for a (start, end) date range. Expense tables are read in their
+    wide shape, one column per expense type (see expense_store.relation).
+    """
+    date_col = snapshots.TABLES[name]
+    return f"SELECT * FROM {expense_store.relation(name)} WHERE {date_col} >= %s AND {date_col} <= %s"
+
+def _load_dataset(pool, name, start, end):
+    # Closed months come from local snapshots when possible; the rest is streamed in
+    # chunks and prepared chunk by chunk, so the raw rows of the whole period are
+    # never held next to the prepared frame
+    query, prepare = dataset_query(name), DATASETS[name]
+    params = [start, end]
+    stats = {}
+    t0 = time.perf_counter()
+    prepare_s = raw_mb = 0.0
+    chunks = []
+
+    def add(chunk):
+        nonlocal prepare_s, raw_mb
+        t = time.perf_counter()
+        raw_mb += schemas.memory_mb(chunk)
+        chunks.append(prepare(chunk))
+        prepare_s += time.perf_counter() - t
+
+    with pool.connection() as conn:
+        snapshot_frames, covered = snapshots.closed_month_frames(name, start, end, conn, stats)
+        for chunk in snapshot_frames:
+            add(chunk)
+        if covered:
+            # Only the months not read from snapshots, as ranges the date indexes can seek to
+            date_col = snapshots.TABLES[name]
+            ranges = snapshots.uncovered_ranges(start, end, covered)
+            query += " AND (" + (" OR ".join([f"({date_col} >= %s AND {date_col} < %s)"] * len(ranges)) or "FALSE") + ")"
+            params += [d for r in ranges for d in r]
+        for chunk in db_utils.fetch_chunks(query, params, conn=conn):
+            add(chunk)
+    df = schemas.concat(chunks)
+    total = time.perf_counter() - t0
+    return df, {"rows": len(df), "fetch_s": total - prepare_s, "prepare_s": prepare_s,
+                "raw_mb": round(raw_mb, 2), "typed_mb": round(schemas.memory_mb(df), 2), **stats}
+
+def _load_frames(start, end, timings=None):
+    """
+    Fetches the three datasets concurrently on pooled connections; each frame is
+    pre-processed as soon as its own query returns, overlapping the other fetches.
+    Pass a dict as `timings` to receive per-dataset rows / fetch / prepare seconds,
+    frame sizes and snapshot hits (see snapshots.py).
+    """
+    pool = db_utils.get_pool()
+    started = time.perf_counter()
+    frames = {}
+    with ThreadPoolExecutor(max_workers=len(DATASETS)) as executor:
+        futures = {
+            executor.submit(metrics.bind(_load_dataset), pool, name, start, end): name
+            for name in DATASETS
+        }
+        for future in as_completed(futures):
+            name = futures[future]
+            frames[name], stage_times = future.result()
+            if timings is not None: timings[name] = stage_times
+    if timings is not None: timings["total_s"] = time.perf_counter() - started
+
+    return frames["master_data"], frames["branch_expenses"], frames["ho_expenses"]
+
+def _db_now():
+    return db_utils.fetch_data("SELECT now() AS now")['now'].iloc[0]
+
+# (start, end) -> database time the cached frames were loaded at (see refresh_frames)
+_watermarks = {}
+
+def load_frames(start, end, timings=None):
+    """
+    Cached `_load_frames`: re-fetched only after the TTL or when a write invalidates one of the tables.
+    Cached frames are shared between sessions, so callers must not modify them in place.
+    """
+    def compute():
+        loaded_at = _db_now()
+        frames = _load_frames(start, end, timings)
+        _watermarks[(start, end)] = loaded_at
+        return frames
+    return data_cache.get_or_compute(("frames", start, end), compute, tables=DATASETS.keys())
+
+# --- INCREMENTAL REFRESH (Watermarks) ---
+# Rows carry `updated_at` (the change_tracking migration). A refresh fetches only the rows
+# changed since the cached frames were loaded, swaps them in by key, and re-rolls just the
+# days they touch, so its cost follows the size of the change, not of the period.
+
+# dataset -> (table whose updated_at tracks it, row key)
+CHANGE_SOURCES = {
+    "master_data": ("logistics_entries", "cn_no"),
+    "branch_expenses": ("branch_expenses", "manifest_no"),
+    "ho_expenses": ("ho_expenses", "entry_date"),
+}
+REFRESH_DAYS = {
+    "master_data": rollups.refresh_sales_days,
+    "branch_expenses": rollups.refresh_branch_days,
+    "ho_expenses": rollups.refresh_ho_days,
+}
+# Re-read a little before the watermark: rows written by transactions that were still
+# open at load time carry an updated_at older than the watermark
+WATERMARK_OVERLAP = timedelta(minutes=5)
+
+def _patch_frame(name, df, since, start, end):
+    """
+    `df` with rows changed since `since` replaced by their current version. Returns
+    (patched frame, changed row count, days touched), or None if `df` can't be patched.
+    """
+    query, prepare = dataset_query(name), DATASETS[name]
+    source, key = CHANGE_SOURCES[name]
+    date_col = snapshots.TABLES[name]
+
+    keys = db_utils.fetch_data(f"SELECT {key} FROM {source} WHERE updated_at > %s", (since,))[key].tolist()
+    if not keys:
+        return df, 0, set()
+    delta = prepare(db_utils.fetch_data(f"{query} AND {key} = ANY(%s)", (start, end, keys)))
+
+    if key not in df.columns or (not delta.empty and set(delta.columns) != set(df.columns)):
+        return None   # columns changed (e.g. a new expense type): reload in full
+    match = pd.to_datetime(keys) if pd.api.types.is_datetime64_any_dtype(df[key]) else keys
+    stale = df[key].isin(match)
+    days = set(df.loc[stale, date_col].dropna()) | set(delta[date_col].dropna() if not delta.empty else [])
+    return schemas.concat([df[~stale], delta]), len(keys), days
+
+@metrics.stage("report.refresh_frames")
+def refresh_frames(start, end):
+    """
+    Brings the cached frames for the period up to date from the rows changed since they
+    were loaded (see above). Returns the number of changed rows applied, or None when a
+    full reload was needed (nothing cached, change tracking unavailable, rows deleted).
+    """
+    key = ("frames", start, end)
+    frames = data_cache.peek(key, DATASETS.keys())
+    since = _watermarks.get((start, end))
+    if frames is None or since is None or not migrations.applied("change_tracking"):
+        data_cache.invalidate(*REPORT_TABLES)
+        return None
+
+    now = _db_now()
+    patched, changed = [], 0
+    for name, df in zip(DATASETS, frames):
+        result = _patch_frame(name, df, since - WATERMARK_OVERLAP, start, end)
+        if result is None: break
+        df, n, days = result
+        # Updates can't hide deletes: a count mismatch means rows went away
+        date_col = snapshots.TABLES[name]
+        query = f"SELECT COUNT(*) AS n FROM {CHANGE_SOURCES[name][0]} WHERE {date_col} >= %s AND {date_col} <= %s"
+        if db_utils.fetch_data(query, (start, end))['n'].iloc[0] != len(df): break
+        if days: REFRESH_DAYS[name](days)
+        patched.append(df)
+        changed += n
+    else:
+        data_cache.invalidate(*REPORT_TABLES)
+        data_cache.put(key, tuple(patched), DATASETS.keys())
+        _watermarks[(start, end)] = now
+        return changed
 
-        return df_log, df_branch, df_ho
+    data_cache.invalidate(*REPORT_TABLES)
+    return None
 
+@metrics.stage("report.load_data")
+def load_data(start, end, timings=None):
+    try:
+        return load_frames(start, end, timings)
     except Exception as e:
         st.error(f"Data Load Error: {e}")
-        if conn: conn.close()
         return pd.DataFrame(), pd.DataFrame(), pd.DataFrame()
 
 # --- 3. REPORT GENERATION ---
-
-def generate_report_1(df_log, df_branch, df_ho):
-    HO_NAME = "Patna Jamal Road (HO)"
-    PARENT_MAP = get_parent_map() 
-
-    if df_log.empty: return pd.DataFrame()
+# Each report is an aggregation step (pandas here, SQL in report_sql) feeding a shared
+# assemble_* step, so both backends produce the same tables.
+
+HO_NAME = "Patna Jamal Road (HO)"
+NAME_MAP = {
+    'PATNA (JAMAL ROAD)': HO_NAME, 'Patna (Jamal Road)': HO_NAME, 'PATNA JAMAL ROAD': HO_NAME,
+    'Madhubani': 'MADHUBANI', 'Darbhanga': 'DARBHANGA', 'Motihari': 'MOTIHARI', 'Raxaul': 'RAXAUL'
+}
+RECEIPT_AT_HO = ['PAID', 'BILLED', 'TO BE BILLED']  # sales types collected at HO, not at the destination
+BRANCH_TOTALS = ['Total_Rent', 'Total_Vehicle', 'Total_Other_Exp', 'Total_Real_Exp', 'Total_Transfer_HO']
+
+def branch_summary_aggregates(df_log, df_branch, df_ho):
+    """
+    Report 1 inputs: sales by destination x sales_type, receipts by Receipt_Loc,
+    branch expense totals by destination (None without branch rows), HO total (None without HO rows).
+    """
     df = df_log.copy()
-    
-    name_map = {
-        'PATNA (JAMAL ROAD)': HO_NAME, 'Patna (Jamal Road)': HO_NAME, 'PATNA JAMAL ROAD': HO_NAME,
-        'Madhubani': 'MADHUBANI', 'Darbhanga': 'DARBHANGA', 'Motihari': 'MOTIHARI', 'Raxaul': 'RAXAUL'
-    }
     if 'destination' in df.columns:
-        df['destination'] = df['destination'].str.strip().replace(name_map)
-    if not df_branch.empty and 'destination' in df_branch.columns:
-         df_branch['destination'] = df_branch['destination'].str.strip().replace(name_map)
+        df['destination'] = df['destination'].str.strip().replace(NAME_MAP)
 
-    def get_receipt_loc(row):
-        return HO_NAME if row['sales_type'] in ['PAID', 'BILLED', 'TO BE BILLED'] else (row['destination'] if row['destination'] else "Unknown")
-    df['Receipt_Loc'] = df.apply(get_receipt_loc, axis=1)
+    dest = df['destination']
+    df['Receipt_Loc'] = dest.where(dest != '', "Unknown").where(~df['sales_type'].isin(RECEIPT_AT_HO), HO_NAME)
     
-    df['Discount'] = df.apply(lambda x: (x['sales_amount'] - x['manual_figures']) if (x['manual_figures'] > 0 and x['manual_figures'] < x['sales_amount']) else 0, axis=1)
-    df['Due_From_Party'] = df.apply(lambda x: x['sales_amount'] if x['manual_figures'] == 0 else 0, axis=1)
+    reconciliation.add_reconciliation_columns(df, excess_col=None)
     
-    sales_agg = df.groupby(['destination', 'sales_type'])['sales_amount'].sum().unstack(fill_value=0)
+    sales = schemas.decategorize(df.groupby(['destination', 'sales_type'], observed=True)['sales_amount'].sum().unstack(fill_value=0))
+    receipts = df.groupby('Receipt_Loc', observed=True)[['manual_figures', 'Discount', 'Due_From_Party']].sum()
+
+    branch = None
+    if not df_branch.empty:
+        df_branch = df_branch.copy()
+        df_branch['destination'] = df_branch['destination'].str.strip().replace(NAME_MAP)
+        branch = df_branch.groupby('destination', observed=True)[BRANCH_TOTALS].sum()
+
+    ho_total = df_ho['Total_HO_Exp'].sum() if not df_ho.empty else None
+    return sales, receipts, branch, ho_total
+
+def assemble_branch_summary(sales, receipts, branch, ho_total):
+    PARENT_MAP = get_parent_map() 
+
+    sales_agg = sales.copy()
     for col in ['PAID', 'TO PAY', 'TO BE BILLED']:
         if col not in sales_agg.columns: sales_agg[col] = 0
     sales_agg['Total Sales'] = sales_agg.sum(axis=1)
     
-    receipt_agg = df.groupby('Receipt_Loc')[['manual_figures', 'Discount', 'Due_From_Party']].sum()
-    receipt_agg.rename(columns={'manual_figures': 'Total Receipts'}, inplace=True)
+    receipt_agg = receipts.rename(columns={'manual_figures': 'Total Receipts'})
     
     rent_agg, vehicle_agg, other_agg, expense_agg, transfer_agg = [], [], [], [], []
     
-    if not df_branch.empty:
-        g = df_branch.groupby('destination')
-        rent_agg.append(g['Total_Rent'].sum())
-        vehicle_agg.append(g['Total_Vehicle'].sum())
-        other_agg.append(g['Total_Other_Exp'].sum())
-        expense_agg.append(g['Total_Real_Exp'].sum())
-        transfer_agg.append(g['Total_Transfer_HO'].sum())
+    if branch is not None:
+        rent_agg.append(branch['Total_Rent'])
+        vehicle_agg.append(branch['Total_Vehicle'])
+        other_agg.append(branch['Total_Other_Exp'])
+        expense_agg.append(branch['Total_Real_Exp'])
+        transfer_agg.append(branch['Total_Transfer_HO'])
     
-    if not df_ho.empty:
-        expense_agg.append(pd.Series({HO_NAME: df_ho['Total_HO_Exp'].sum()}))
+    if ho_total is not None:
+        expense_agg.append(pd.Series({HO_NAME: ho_total}))
     else:
         for agg in [rent_agg, vehicle_agg, other_agg, expense_agg]: agg.append(pd.Series({HO_NAME: 0}))
     
@@ -207,20 +380,27 @@ def generate_report_1(df_log, df_branch, df_ho):
     final_df = pd.concat([final_df, final_df.sum(numeric_only=True).rename('GRAND TOTAL').to_frame().T])
     return final_df
 
-def generate_report_2(df_log):
+@metrics.stage("report.generate_report_1")
+def generate_report_1(df_log, df_branch, df_ho):
     if df_log.empty: return pd.DataFrame()
+    return assemble_branch_summary(*branch_summary_aggregates(df_log, df_branch, df_ho))
+
+def manifest_comparison_aggregates(df_log):
+    """
+    Report 2 input: per manifest / route, sales by sales_type plus Receipt, Discount, Due and Excess sums.
+    """
     df = df_log.copy()
     
-    df['Discount'] = df.apply(lambda x: (x['sales_amount'] - x['manual_figures']) if (x['manual_figures'] > 0 and x['manual_figures'] < x['sales_amount']) else 0, axis=1)
-    df['Excess'] = df.apply(lambda x: (x['manual_figures'] - x['sales_amount']) if x['manual_figures'] > x['sales_amount'] else 0, axis=1)
-    df['Due_From_Party'] = df.apply(lambda x: x['sales_amount'] if x['manual_figures'] == 0 else 0, axis=1)
+    reconciliation.add_reconciliation_columns(df)
     
-    sales = df.pivot_table(index=['manifest_no', 'manifest_date', 'origin', 'destination'], columns='sales_type', values='sales_amount', aggfunc='sum', fill_value=0).reset_index()
+    sales = df.pivot_table(index=['manifest_no', 'manifest_date', 'origin', 'destination'], columns='sales_type', values='sales_amount', aggfunc='sum', fill_value=0, observed=True).reset_index()
+    adj = df.groupby(['manifest_no', 'destination'], observed=True)[['manual_figures', 'Discount', 'Due_From_Party', 'Excess']].sum().reset_index()
+    return schemas.decategorize(pd.merge(sales, adj, on=['manifest_no', 'destination'], how='left'))
+
+def assemble_manifest_comparison(final):
+    final = final.copy()
     for c in ['TO PAY', 'PAID', 'TO BE BILLED']: 
-        if c not in sales.columns: sales[c] = 0
-        
-    adj = df.groupby(['manifest_no', 'destination'])[['manual_figures', 'Discount', 'Due_From_Party', 'Excess']].sum().reset_index()
-    final = pd.merge(sales, adj, on=['manifest_no', 'destination'], how='left')
+        if c not in final.columns: final[c] = 0
     
     final['Sum'] = final['TO PAY'] + final['PAID'] + final['TO BE BILLED']
     final.rename(columns={'manifest_no': 'Manifest No', 'manifest_date': 'Manifest Date', 'origin': 'From', 'destination': 'To', 'TO PAY': 'To Pay', 'PAID': 'Paid', 'TO BE BILLED': 'To Be Billed', 'manual_figures': 'Receipt', 'Due_From_Party': 'Due from Party'}, inplace=True)
@@ -233,22 +413,29 @@ def generate_report_2(df_log):
     total['Manifest No'] = 'GRAND TOTAL'
     return pd.concat([final, pd.DataFrame([total])], ignore_index=True)
 
-def generate_report_3(df_log):
+@metrics.stage("report.generate_report_2")
+def generate_report_2(df_log):
     if df_log.empty: return pd.DataFrame()
-    mask = df_log['manual_figures'] == 0
-    df_due = df_log[mask].copy()
-    
-    if df_due.empty: return pd.DataFrame()
-    
-    df_due['Manifest Date'] = df_due['manifest_date'].dt.strftime('%d-%m-%Y')
+    return assemble_manifest_comparison(manifest_comparison_aggregates(df_log))
+
+def due_summary_aggregates(df_log):
+    """
+    Report 3 input: for CNs with nothing received, due amount and pending CN list per party.
+    """
+    df_due = df_log[df_log['manual_figures'] == 0].copy()
+    # CNs listed in entry order (as report_sql does), not in the order the rows were read
+    if 'id' in df_due.columns: df_due.sort_values('id', kind='stable', inplace=True)
     if 'payment_liability' not in df_due.columns: df_due['payment_liability'] = "Unknown"
     
-    summary = df_due.groupby('payment_liability').agg({
+    return schemas.decategorize(df_due.groupby('payment_liability', observed=True).agg({
         'sales_amount': 'sum',
         'cn_no': lambda x: ', '.join(x.astype(str).unique())
-    }).reset_index()
+    }).reset_index())
+
+def assemble_due_summary(summary):
+    if summary.empty: return pd.DataFrame()
     
-    summary.rename(columns={'payment_liability': 'Party Name', 'sales_amount': 'Total Due Amount', 'cn_no': 'Pending CN Nos'}, inplace=True)
+    summary = summary.rename(columns={'payment_liability': 'Party Name', 'sales_amount': 'Total Due Amount', 'cn_no': 'Pending CN Nos'})
     summary.sort_values(by='Total Due Amount', ascending=False, inplace=True)
     
     total_due = summary['Total Due Amount'].sum()
@@ -256,14 +443,28 @@ def generate_report_3(df_log):
     
     return pd.concat([summary, total_row], ignore_index=True)
 
-def generate_report_5(df_log, df_branch, df_ho):
-    if df_log.empty: return pd.DataFrame(columns=["Category", "Description", "Amount"])
+@metrics.stage("report.generate_report_3")
+def generate_report_3(df_log):
+    if df_log.empty: return pd.DataFrame()
+    return assemble_due_summary(due_summary_aggregates(df_log))
+
+def pnl_aggregates(df_log, df_branch, df_ho):
+    """
+    Report 5 input: row count, total sales, total discount, branch and HO expense totals.
+    """
+    return {
+        "rows": len(df_log),
+        "income": df_log['sales_amount'].sum() if not df_log.empty else 0,
+        "discount": reconciliation.discount(df_log['sales_amount'].to_numpy(), df_log['manual_figures'].to_numpy()).sum() if not df_log.empty else 0,
+        "branch_exp": df_branch['Total_Real_Exp'].sum() if not df_branch.empty else 0,
+        "ho_exp": df_ho['Total_HO_Exp'].sum() if not df_ho.empty else 0,
+    }
+
+def assemble_pnl(totals):
+    if not totals["rows"]: return pd.DataFrame(columns=["Category", "Description", "Amount"])
     
-    income = df_log['sales_amount'].sum()
-    df_log['Discount'] = df_log.apply(lambda x: (x['sales_amount'] - x['manual_figures']) if (x['manual_figures'] > 0 and x['manual_figures'] < x['sales_amount']) else 0, axis=1)
-    total_discount = df_log['Discount'].sum()
-    branch_exp = df_branch['Total_Real_Exp'].sum() if not df_branch.empty else 0
-    ho_exp = df_ho['Total_HO_Exp'].sum() if not df_ho.empty else 0
+    income, total_discount = totals["income"], totals["discount"]
+    branch_exp, ho_exp = totals["branch_exp"], totals["ho_exp"]
     
     data = [
         {"Category": "REVENUE", "Description": "Total Sales", "Amount": income},
@@ -274,28 +475,153 @@ def generate_report_5(df_log, df_branch, df_ho):
     ]
     return pd.DataFrame(data)
 
-def generate_excel_master(r1, r2, r3, df_log, df_branch, df_ho, start, end):
-    output = io.BytesIO()
+@metrics.stage("report.generate_report_5")
+def generate_report_5(df_log, df_branch, df_ho):
+    return assemble_pnl(pnl_aggregates(df_log, df_branch, df_ho))
+
+@metrics.stage("report.build_reports")
+def build_reports(start, end):
+    """
+    (r1, r2, r3, r5) for the period, aggregated inside the database so only summary rows
+    are transferred. Branch Summary and P&L read the daily rollups (rollups.py); the
+    per-manifest / per-party reports aggregate master_data directly (report_sql).
+    Cached until the TTL or a write to any report table.
+    """
+    # DuckDB has no rollups; it aggregates the raw rows with the same SQL instead
+    totals_source = rollups if rollups.enabled() else report_sql
+
+    def compute():
+        totals = totals_source.pnl_aggregates(start, end)
+        if not totals["rows"]:
+            return pd.DataFrame(), pd.DataFrame(), pd.DataFrame(), assemble_pnl(totals)
+        return (
+            assemble_branch_summary(*totals_source.branch_summary_aggregates(start, end, HO_NAME, NAME_MAP, RECEIPT_AT_HO)),
+            assemble_manifest_comparison(report_sql.manifest_comparison_aggregates(start, end)),
+            assemble_due_summary(report_sql.due_summary_aggregates(start, end)),
+            assemble_pnl(totals),
+        )
+    return data_cache.get_or_compute(("reports", start, end), compute, tables=REPORT_TABLES)
+
+# --- EXCEL EXPORT (Streaming) ---
+# Written with XlsxWriter's constant_memory mode, which flushes each row to disk as soon
+# as the next one starts, and fed from a server-side cursor, so a year of master data
+# never sits in memory. Files are built on demand by a background job and reused while
+# the period's data version is unchanged.
+
+EXCEL_MIME = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+@st.cache_resource
+def _export_dir():
+    # Per process: data versions restart at 0 with the process, so older files can't be trusted
+    return tempfile.mkdtemp(prefix="report_exports_")
+
+def excel_export_path(start, end):
+    version = "-".join(map(str, data_cache.data_version(*REPORT_TABLES)))
+    return os.path.join(_export_dir(), f"Executive_Report_{start}_{end}_v{version}.xlsx")
+
+def stream_master_data(start, end):
+    """
+    master_data for the period as pre-processed DataFrame chunks, read from a server-side cursor.
+    """
+    for chunk in db_utils.fetch_chunks(dataset_query("master_data"), (start, end)):
+        yield _prepare_log(chunk)
+
+def _write_cell(ws, row, col, value, formats):
+    if value is None or value is pd.NaT or (isinstance(value, float) and value != value):
+        return
+    if isinstance(value, pd.Timestamp):
+        ws.write_datetime(row, col, value.to_pydatetime(), formats['date'])
+    elif hasattr(value, 'item'):   # numpy scalars
+        ws.write(row, col, value.item())
+    else:
+        ws.write(row, col, value)
+
+def _write_rows(ws, row, labels, df, formats):
+    """
+    Writes `df` with `labels` as the first column (like to_excel's index), strictly row by row,
+    as constant_memory requires. Returns the next free row.
+    """
+    for label, values in zip(labels, df.itertuples(index=False, name=None)):
+        _write_cell(ws, row, 0, label, formats)
+        for col, value in enumerate(values, start=1):
+            _write_cell(ws, row, col, value, formats)
+        row += 1
+    return row
+
+@metrics.stage("report.excel_build")
+def write_excel_master(path, r1, r2, r3, master_chunks, start, end):
+    """
+    Writes the Executive Report to `path`. `master_chunks` is an iterable of master_data
+    DataFrames (see stream_master_data); the sheet is skipped when it yields no rows.
+    """
     period = f"Period: {start.strftime('%d-%b-%Y')} to {end.strftime('%d-%b-%Y')}"
     timestamp = f"Generated: {datetime.now().strftime('%d-%b-%Y %I:%M %p')}"
-    
-    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-        wb = writer.book
-        title_fmt = wb.add_format({'bold': True, 'font_size': 16, 'font_color': 'white', 'bg_color': '#1F4E78'})
-        
-        def create_sheet(sheet_name, df, title_text):
-            if df.empty: return
-            df.to_excel(writer, sheet_name=sheet_name, startrow=3)
-            ws = writer.sheets[sheet_name]
-            ws.write('A1', title_text, title_fmt)
+
+    wb = xlsxwriter.Workbook(path, {'constant_memory': True, 'tmpdir': os.path.dirname(path)})
+    try:
+        formats = {
+            'title': wb.add_format({'bold': True, 'font_size': 16, 'font_color': 'white', 'bg_color': '#1F4E78'}),
+            'header': wb.add_format({'bold': True, 'border': 1, 'align': 'center', 'valign': 'top'}),
+            'date': wb.add_format({'num_format': 'yyyy-mm-dd hh:mm:ss'}),
+        }
+
+        def start_sheet(sheet_name, columns, title_text, index_name=None):
+            ws = wb.add_worksheet(sheet_name)
+            ws.write('A1', title_text, formats['title'])
             ws.write('A2', f"{period} | {timestamp}")
-            
-        create_sheet('Branch_Summary', r1, "EXECUTIVE BRANCH SUMMARY")
-        create_sheet('Manifest_Comp', r2, "MANIFEST COMPARISON REPORT")
-        create_sheet('Due_Summary', r3, "OUTSTANDING DUES SUMMARY")
-        if not df_log.empty: create_sheet('Master_Data', df_log, "FULL MASTER DATA")
-        
-    return output.getvalue()
+            if index_name: ws.write(3, 0, index_name, formats['header'])
+            for col, name in enumerate(columns, start=1):
+                ws.write(3, col, str(name), formats['header'])
+            return ws
+
+        for sheet_name, df, title_text in [
+            ('Branch_Summary', r1, "EXECUTIVE BRANCH SUMMARY"),
+            ('Manifest_Comp', r2, "MANIFEST COMPARISON REPORT"),
+            ('Due_Summary', r3, "OUTSTANDING DUES SUMMARY"),
+        ]:
+            if df.empty: continue
+            ws = start_sheet(sheet_name, df.columns, title_text, df.index.name)
+            _write_rows(ws, 4, df.index, df, formats)
+
+        ws, row = None, 4
+        for chunk in master_chunks:
+            if chunk.empty: continue
+            if ws is None: ws = start_sheet('Master_Data', chunk.columns, "FULL MASTER DATA")
+            row = _write_rows(ws, row, range(row - 4, row - 4 + len(chunk)), chunk, formats)
+    finally:
+        wb.close()
+
+def run_excel_export(ctx, start, end):
+    """
+    Job: builds (or reuses) the Excel report for the period.
+    """
+    name = f"Executive_Report_{start}.xlsx"
+    path = excel_export_path(start, end)
+    if not os.path.exists(path):
+        ctx.progress(0.02, "Building reports")
+        r1, r2, r3, _ = build_reports(start, end)
+        expected = (rollups if rollups.enabled() else report_sql).pnl_aggregates(start, end)["rows"]
+
+        def master_chunks():
+            written = 0
+            for chunk in stream_master_data(start, end):
+                yield chunk
+                written += len(chunk)
+                ctx.progress(0.05 + 0.95 * written / max(expected, 1), f"Writing master data: {written:,} rows")
+
+        tmp = f"{path}.{ctx.job_id}.tmp"
+        try:
+            write_excel_master(tmp, r1, r2, r3, master_chunks(), start, end)
+            os.replace(tmp, path)
+            # Earlier versions of this period's file are stale now
+            prefix = f"Executive_Report_{start}_{end}_v"
+            for old in os.listdir(_export_dir()):
+                if old.startswith(prefix) and old.endswith(".xlsx") and old != os.path.basename(path):
+                    os.remove(os.path.join(_export_dir(), old))
+        finally:
+            if os.path.exists(tmp): os.remove(tmp)
+    ctx.set_result(path, name)
+    return f"Report for {start} to {end} is ready."
 
 # --- 4. MAIN APP ---
 def app():
@@ -317,16 +643,28 @@ def app():
     start_date = st.sidebar.date_input("From Date", st.session_state.start_d)
     end_date = st.sidebar.date_input("To Date", st.session_state.end_d)
 
-    if st.sidebar.button("🔄 Refresh Report", type="primary"): st.rerun()
+    if st.sidebar.button("🔄 Refresh Report", type="primary"):
+        changed = refresh_frames(start_date, end_date)
+        st.session_state["refresh_note"] = "Reloaded all data." if changed is None else f"Applied {changed:,} changed rows."
+        st.rerun()
+    if "refresh_note" in st.session_state:
+        st.sidebar.caption(st.session_state.pop("refresh_note"))
 
-    df_log, df_branch, df_ho = load_data(start_date, end_date)
+    try:
+        r1, r2, r3, r5 = build_reports(start_date, end_date)
+    except Exception as e:
+        st.error(f"Data Load Error: {e}")
+        r1, r2, r3 = pd.DataFrame(), pd.DataFrame(), pd.DataFrame()
+        r5 = assemble_pnl({"rows": 0})
+
+    # Raw rows are only pulled for the Master Data tab and the Excel workbook
+    load_timings = {}
 
     st.title("📊 Executive Report Center (Cloud)")
     st.markdown(f"**Period:** {start_date.strftime('%d-%b-%Y')} to {end_date.strftime('%d-%b-%Y')}")
 
     # METRICS
     col1, col2, col3 = st.columns(3)
-    r5 = generate_report_5(df_log, df_branch, df_ho)
     if not r5.empty:
         rev = r5.loc[0, 'Amount']
         exp = r5[r5['Amount'] < 0].iloc[:-1]['Amount'].sum()
@@ -335,10 +673,6 @@ def app():
         col2.metric("Expenses", f"₹ {abs(exp):,.0f}")
         col3.metric("Net Profit", f"₹ {net:,.0f}")
 
-    r1 = generate_report_1(df_log, df_branch, df_ho)
-    r2 = generate_report_2(df_log)
-    r3 = generate_report_3(df_log)
-
     tabs = st.tabs(["📄 Branch Summary", "📑 Manifest Comp", "⚠️ Due Summary", "💰 P&L", "🗄️ Master Data", "⚙️ Settings"])
 
     with tabs[0]:
@@ -361,7 +695,9 @@ def app():
         st.dataframe(r5, use_container_width=True) if not r5.empty else st.info("No Data")
 
     with tabs[4]:
-        st.dataframe(df_log, use_container_width=True) if not df_log.empty else st.info("No Master Data")
+        if st.toggle("Load all rows for this period", key="show_master_data"):
+            df_log = load_data(start_date, end_date, load_timings)[0]
+            st.dataframe(df_log, use_container_width=True) if not df_log.empty else st.info("No Master Data")
 
     with tabs[5]:
         st.header("⚙️ Hub & Spoke Configuration")
@@ -385,10 +721,37 @@ def app():
                 st.success("Deleted.")
                 st.rerun()
 
+        if st.session_state.get("user_role") == "admin":
+            st.divider()
+            st.caption("Branch Summary and P&L read daily rollups that are kept current on every save. Rebuild them after editing the tables outside this app.")
+            if st.button("🔁 Rebuild Rollups"):
+                with st.spinner("Rebuilding..."):
+                    rollups.rebuild_all()
+                data_cache.invalidate(*REPORT_TABLES)
+                st.success("Rollups rebuilt.")
+
     if not r1.empty:
         st.sidebar.divider()
-        excel_data = generate_excel_master(r1, r2, r3, df_log, df_branch, df_ho, start_date, end_date)
-        st.sidebar.download_button("📥 Download Full Report", excel_data, f"Executive_Report_{start_date}.xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+        cached_export = excel_export_path(start_date, end_date)
+        if os.path.exists(cached_export):
+            # Read when clicked, not on every rerun
+            st.sidebar.download_button("📥 Download Full Report", partial(jobs.file_bytes, cached_export),
+                                       f"Executive_Report_{start_date}.xlsx", EXCEL_MIME)
+        elif st.sidebar.button("📊 Prepare Full Report (Excel)"):
+            jobs.submit("export", f"Excel {start_date} to {end_date}", run_excel_export, start_date, end_date,
+                        owner=st.session_state.get("username"))
+    with st.sidebar:
+        jobs.jobs_panel(st.session_state.get("username"), kinds=["export"], title="📥 Report Exports")
+
+    with st.expander("⏱️ Data Load Timings & Memory"):
+        if load_timings:
+            st.caption(f"Total wall time: {load_timings.pop('total_s', 0):.2f}s (datasets load in parallel). "
+                       "raw_mb / typed_mb: frame size as fetched / after schema typing.")
+            st.dataframe(pd.DataFrame(load_timings).T, use_container_width=True)
+        else:
+            st.caption("No raw rows fetched this run (served from cache or not needed).")
+        st.json(data_cache.stats())
 
 if __name__ == "__main__":
+    migrations.migrate()
     app()
\ No newline at end of file
@@ -0,0 +1,197 @@
+import pandas as pd
+import db_utils
+
+# --- SQL AGGREGATION BACKEND ---
+# The same aggregates as the pandas *_aggregates steps in report_center, computed
+# by PostgreSQL with GROUP BY / FILTER so only summary rows leave the database.
+# Results feed report_center's assemble_* functions unchanged.
+
+# Matches what pd.to_numeric accepts for plain decimal / scientific values
+NUMERIC_RE = r'^[-+]?([0-9]+\.?[0-9]*|\.[0-9]+)([eE][-+]?[0-9]+)?$'
+
+def lit(value):
+    return "'" + str(value).replace("'", "''") + "'"
+
+def ident(name):
+    return '"' + name.replace('"', '""') + '"'
+
+def num(expr):
+    """
+    SQL twin of pd.to_numeric(errors='coerce').fillna(0).
+    """
+    text = f"TRIM(({expr})::text)"
+    return f"(CASE WHEN {text} ~ '{NUMERIC_RE}' THEN {text}::numeric ELSE 0 END)"
+
+def destination_sql(expr, name_map):
+    """
+    Strip + rename of branch names, as `.str.strip().replace(NAME_MAP)` does in pandas.
+    """
+    cases = " ".join(f"WHEN {lit(k)} THEN {lit(v)}" for k, v in name_map.items())
+    return f"(CASE TRIM({expr}) {cases} ELSE TRIM({expr}) END)"
+
+PERIOD = "manifest_date >= %(start)s AND manifest_date <= %(end)s"
+
+def log_cte(name_map=None, where=PERIOD):
+    """
+    `rec`: master_data rows matching `where` (default: the report period) with the
+    load_data clean-up applied and the reconciliation columns (see reconciliation.py) added.
+    """
+    destination = destination_sql("destination", name_map) if name_map else "destination"
+    return f"""
+        log AS (
+            SELECT manifest_no, manifest_date, origin, destination AS raw_destination,
+                   {destination} AS destination,
+                   COALESCE(UPPER(TRIM(sales_type::text)), 'NONE') AS sales_type,
+                   payment_liability, cn_no,
+                   {num('sales_amount')} AS s, {num('manual_figures')} AS m
+            FROM master_data
+            WHERE {where}
+        ),
+        rec AS (
+            SELECT log.*,
+                   CASE WHEN m > 0 AND m < s THEN s - m ELSE 0 END AS discount,
+                   CASE WHEN m > s THEN m - s ELSE 0 END AS excess,
+                   CASE WHEN m = 0 THEN s ELSE 0 END AS due
+            FROM log
+        )"""
+
+def branch_totals_sql(expense_type="expense_type", amount="amount"):
+    """
+    SELECT-list for Total_Rent / Vehicle / Other / Real / Transfer over expense lines, following
+    load_data's column rules by type name: 'rent' and 'vehicle' on their own, 'transfer*' types
+    count as transfers to HO and not as real expenses.
+    """
+    name = f"LOWER({expense_type})"
+    transfer = f"POSITION('transfer' IN {name}) > 0"
+    def total(where, label):
+        return f'COALESCE(SUM({amount}) FILTER (WHERE {where}), 0) AS "{label}"'
+    return f"""
+        {total(f"{name} = 'rent'", "Total_Rent")},
+        {total(f"{name} = 'vehicle'", "Total_Vehicle")},
+        {total(f"{name} NOT IN ('rent', 'vehicle')", "Total_Other_Exp")},
+        {total(f"NOT {transfer}", "Total_Real_Exp")},
+        {total(transfer, "Total_Transfer_HO")}
+    """
+
+def branch_summary_aggregates(start, end, ho_name, name_map, receipt_at_ho):
+    """
+    SQL version of report_center.branch_summary_aggregates.
+    """
+    params = {"start": start, "end": end}
+    at_ho = ", ".join(lit(t) for t in receipt_at_ho)
+
+    sales = db_utils.fetch_data(f"""
+        WITH {log_cte(name_map)}
+        SELECT destination, sales_type, SUM(s) AS sales_amount
+        FROM rec WHERE destination IS NOT NULL
+        GROUP BY destination, sales_type
+    """, params)
+    sales = sales.pivot_table(index='destination', columns='sales_type', values='sales_amount', aggfunc='sum', fill_value=0)
+    sales.columns.name = None
+
+    receipts = db_utils.fetch_data(f"""
+        WITH {log_cte(name_map)}
+        SELECT CASE WHEN sales_type IN ({at_ho}) THEN {lit(ho_name)}
+                    WHEN destination = '' THEN 'Unknown'
+                    ELSE destination END AS "Receipt_Loc",
+               SUM(m) AS manual_figures, SUM(discount) AS "Discount", SUM(due) AS "Due_From_Party"
+        FROM rec GROUP BY 1
+    """, params)
+    receipts = receipts.dropna(subset=['Receipt_Loc']).set_index('Receipt_Loc')
+
+    branch = db_utils.fetch_data(f"""
+        SELECT {destination_sql('destination', name_map)} AS destination, {branch_totals_sql()}
+        FROM branch_expenses LEFT JOIN branch_expense_lines USING (manifest_no)
+        WHERE manifest_date >= %(start)s AND manifest_date <= %(end)s
+        GROUP BY 1
+    """, params)
+    branch = branch.dropna(subset=['destination']).set_index('destination') if not branch.empty else None
+
+    return sales, receipts, branch, ho_total(start, end)
+
+def ho_total(start, end):
+    """
+    Sum of every HO expense line for the period, or None when there are no HO rows.
+    """
+    df = db_utils.fetch_data("""
+        SELECT COUNT(DISTINCT entry_date) AS n, COALESCE(SUM(amount), 0) AS total
+        FROM ho_expenses LEFT JOIN ho_expense_lines USING (entry_date)
+        WHERE entry_date >= %(start)s AND entry_date <= %(end)s
+    """, {"start": start, "end": end})
+    return float(df['total'].iloc[0]) if df['n'].iloc[0] else None
+
+def manifest_comparison_aggregates(start, end):
+    """
+    SQL version of report_center.manifest_comparison_aggregates (sales_type columns via FILTER).
+    """
+    def by_type(t):
+        return f"COALESCE(SUM(s) FILTER (WHERE sales_type = {lit(t)}), 0) AS {ident(t)}"
+
+    df = db_utils.fetch_data(f"""
+        WITH {log_cte()},
+        sales AS (
+            SELECT manifest_no, manifest_date, origin, raw_destination AS destination,
+                   {by_type('TO PAY')}, {by_type('PAID')}, {by_type('TO BE BILLED')}
+            FROM rec
+            WHERE manifest_no IS NOT NULL AND manifest_date IS NOT NULL
+              AND origin IS NOT NULL AND raw_destination IS NOT NULL
+            GROUP BY 1, 2, 3, 4
+        ),
+        adj AS (
+            SELECT manifest_no, raw_destination AS destination,
+                   SUM(m) AS manual_figures, SUM(discount) AS "Discount",
+                   SUM(due) AS "Due_From_Party", SUM(excess) AS "Excess"
+            FROM rec
+            WHERE manifest_no IS NOT NULL AND raw_destination IS NOT NULL
+            GROUP BY 1, 2
+        )
+        SELECT sales.*, adj.manual_figures, adj."Discount", adj."Due_From_Party", adj."Excess"
+        FROM sales LEFT JOIN adj USING (manifest_no, destination)
+    """, {"start": start, "end": end})
+    df['manifest_date'] = pd.to_datetime(df['manifest_date'])
+    # Sorted like pivot_table's index (code points), not by the database's collation
+    return df.sort_values(['manifest_no', 'manifest_date', 'origin', 'destination'], ignore_index=True)
+
+def due_summary_aggregates(start, end):
+    """
+    SQL version of report_center.due_summary_aggregates. CN numbers are listed once each in
+    the order they were entered (logistics_entries.id; master_data need not carry it), as
+    unique() keeps them once the pandas side has put the rows in that order.
+    """
+    df = db_utils.fetch_data(f"""
+        WITH {log_cte()},
+        due_cns AS (
+            SELECT rec.payment_liability, rec.cn_no::text AS cn_no, SUM(s) AS s, MIN(e.id) AS first_seq
+            FROM rec LEFT JOIN logistics_entries e ON e.cn_no = rec.cn_no
+            WHERE m = 0 AND rec.payment_liability IS NOT NULL
+            GROUP BY 1, 2
+        )
+        SELECT payment_liability, SUM(s) AS sales_amount,
+               STRING_AGG(cn_no, ', ' ORDER BY first_seq) AS cn_no
+        FROM due_cns
+        GROUP BY payment_liability
+    """, {"start": start, "end": end})
+    # groupby's key order
+    return df.sort_values('payment_liability', ignore_index=True)
+
+def pnl_aggregates(start, end):
+    """
+    SQL version of report_center.pnl_aggregates.
+    """
+    params = {"start": start, "end": end}
+    log = db_utils.fetch_data(f"""
+        WITH {log_cte()}
+        SELECT COUNT(*) AS n, COALESCE(SUM(s), 0) AS income, COALESCE(SUM(discount), 0) AS discount FROM rec
+    """, params)
+    branch = db_utils.fetch_data(f"""
+        SELECT {branch_totals_sql()}
+        FROM branch_expenses JOIN branch_expense_lines USING (manifest_no)
+        WHERE manifest_date >= %(start)s AND manifest_date <= %(end)s
+    """, params)
+    return {
+        "rows": int(log['n'].iloc[0]),
+        "income": float(log['income'].iloc[0]),
+        "discount": float(log['discount'].iloc[0]),
+        "branch_exp": float(branch['Total_Real_Exp'].iloc[0]),
+        "ho_exp": ho_total(start, end) or 0,
+    }
@@ -0,0 +1,199 @@
+import pandas as pd
+import db_utils
+import report_sql
+
+# --- DAILY ROLLUPS ---
+# Pre-aggregated per-day totals for the Branch Summary and P&L reports, so any date
+# range is answered from (days x branches) rows instead of every CN. Write paths call
+# refresh_*_days() with the days they touched; each refresh recomputes just those days
+# from the source table. `python rollups.py` (or Settings > Rebuild) rebuilds everything.
+# On the DuckDB backend they are skipped: it aggregates the raw rows fast enough, so the
+# reports read report_sql directly (see enabled()).
+
+# Created, and filled from the source tables, by migrations.py
+DDL = """
+    CREATE TABLE IF NOT EXISTS rollup_sales_daily (
+        day date NOT NULL,
+        destination text,              -- trimmed; NAME_MAP is applied when reading
+        sales_type text NOT NULL,      -- upper-cased, 'NONE' when missing
+        cns bigint NOT NULL,
+        sales numeric NOT NULL,
+        receipts numeric NOT NULL,
+        discount numeric NOT NULL,
+        due numeric NOT NULL,
+        excess numeric NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_rollup_sales_day ON rollup_sales_daily (day);
+
+    CREATE TABLE IF NOT EXISTS rollup_branch_daily (
+        day date NOT NULL,
+        destination text,
+        entries bigint NOT NULL,
+        rent numeric NOT NULL,
+        vehicle numeric NOT NULL,
+        other_exp numeric NOT NULL,
+        real_exp numeric NOT NULL,
+        transfer_ho numeric NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_rollup_branch_day ON rollup_branch_daily (day);
+
+    CREATE TABLE IF NOT EXISTS rollup_ho_daily (
+        day date PRIMARY KEY,
+        entries bigint NOT NULL,
+        total numeric NOT NULL
+    );
+"""
+
+def _sales_select(where):
+    return f"""
+        WITH {report_sql.log_cte(where=where)}
+        SELECT manifest_date, TRIM(raw_destination), sales_type,
+               COUNT(*), SUM(s), SUM(m), SUM(discount), SUM(due), SUM(excess)
+        FROM rec GROUP BY 1, 2, 3
+    """
+
+def _branch_select(where):
+    return f"""
+        SELECT manifest_date, TRIM(destination), COUNT(DISTINCT manifest_no), {report_sql.branch_totals_sql()}
+        FROM branch_expenses LEFT JOIN branch_expense_lines USING (manifest_no)
+        WHERE {where} GROUP BY 1, 2
+    """
+
+def _ho_select(where):
+    return f"""
+        SELECT entry_date, COUNT(DISTINCT entry_date), COALESCE(SUM(amount), 0)
+        FROM ho_expenses LEFT JOIN ho_expense_lines USING (entry_date)
+        WHERE {where} GROUP BY 1
+    """
+
+# rollup table -> (source date column, SELECT builder)
+ROLLUPS = {
+    "rollup_sales_daily": ("manifest_date", _sales_select),
+    "rollup_branch_daily": ("manifest_date", _branch_select),
+    "rollup_ho_daily": ("entry_date", _ho_select),
+}
+
+def enabled():
+    return db_utils.is_postgres()
+
+def _as_days(values):
+    return sorted({pd.Timestamp(v).date() for v in values if pd.notna(v)})
+
+def _refresh(cur, table, days):
+    date_col, select = ROLLUPS[table]
+    # Serialize refreshes of one rollup so concurrent saves can't double-insert a day
+    cur.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (table,))
+    if days is None:
+        cur.execute(f"DELETE FROM {table}")
+        cur.execute(f"INSERT INTO {table} {select(f'{date_col} IS NOT NULL')}")
+    else:
+        cur.execute(f"DELETE FROM {table} WHERE day = ANY(%(days)s)", {"days": days})
+        cur.execute(f"INSERT INTO {table} {select(f'{date_col} = ANY(%(days)s)')}", {"days": days})
+
+def refresh_days(table, days, cur=None):
+    """
+    Recomputes `table` for the given days. Pass `cur` to do it inside the caller's transaction.
+    """
+    days = _as_days(days)
+    if not days or not enabled(): return
+    if cur is not None:
+        _refresh(cur, table, days)
+        return
+    with db_utils.connection() as conn:
+        with conn.cursor() as own_cur:
+            _refresh(own_cur, table, days)
+
+def refresh_sales_days(days, cur=None):
+    refresh_days("rollup_sales_daily", days, cur)
+
+def refresh_branch_days(days, cur=None):
+    refresh_days("rollup_branch_daily", days, cur)
+
+def refresh_ho_days(days, cur=None):
+    refresh_days("rollup_ho_daily", days, cur)
+
+def rebuild_all(cur=None):
+    """
+    Recomputes every rollup from scratch, in one transaction (the caller's, with `cur`).
+    """
+    if not enabled(): return
+    if cur is not None:
+        for table in ROLLUPS:
+            _refresh(cur, table, None)
+        return
+    with db_utils.connection() as conn:
+        with conn.cursor() as own_cur:
+            rebuild_all(own_cur)
+
+# --- READING ROLLUPS ---
+
+PERIOD = "day >= %(start)s AND day <= %(end)s"
+
+def branch_summary_aggregates(start, end, ho_name, name_map, receipt_at_ho):
+    """
+    Same result as report_sql.branch_summary_aggregates, read from the daily rollups.
+    """
+    params = {"start": start, "end": end}
+    destination = report_sql.destination_sql("destination", name_map)
+    at_ho = ", ".join(report_sql.lit(t) for t in receipt_at_ho)
+
+    sales = db_utils.fetch_data(f"""
+        SELECT {destination} AS destination, sales_type, SUM(sales) AS sales_amount
+        FROM rollup_sales_daily WHERE {PERIOD} AND destination IS NOT NULL
+        GROUP BY 1, 2
+    """, params)
+    sales = sales.pivot_table(index='destination', columns='sales_type', values='sales_amount', aggfunc='sum', fill_value=0)
+    sales.columns.name = None
+
+    receipts = db_utils.fetch_data(f"""
+        SELECT CASE WHEN sales_type IN ({at_ho}) THEN {report_sql.lit(ho_name)}
+                    WHEN destination = '' THEN 'Unknown'
+                    ELSE {destination} END AS "Receipt_Loc",
+               SUM(receipts) AS manual_figures, SUM(discount) AS "Discount", SUM(due) AS "Due_From_Party"
+        FROM rollup_sales_daily WHERE {PERIOD}
+        GROUP BY 1
+    """, params)
+    receipts = receipts.dropna(subset=['Receipt_Loc']).set_index('Receipt_Loc')
+
+    branch = db_utils.fetch_data(f"""
+        SELECT {destination} AS destination,
+               SUM(rent) AS "Total_Rent", SUM(vehicle) AS "Total_Vehicle", SUM(other_exp) AS "Total_Other_Exp",
+               SUM(real_exp) AS "Total_Real_Exp", SUM(transfer_ho) AS "Total_Transfer_HO"
+        FROM rollup_branch_daily WHERE {PERIOD}
+        GROUP BY 1
+    """, params)
+    branch = branch.dropna(subset=['destination']).set_index('destination') if not branch.empty else None
+
+    return sales, receipts, branch, ho_total(start, end)
+
+def ho_total(start, end):
+    df = db_utils.fetch_data(f"""
+        SELECT COALESCE(SUM(entries), 0) AS n, COALESCE(SUM(total), 0) AS total
+        FROM rollup_ho_daily WHERE {PERIOD}
+    """, {"start": start, "end": end})
+    return float(df['total'].iloc[0]) if df['n'].iloc[0] else None
+
+def pnl_aggregates(start, end):
+    """
+    Same result as report_sql.pnl_aggregates, read from the daily rollups.
+    """
+    params = {"start": start, "end": end}
+    df = db_utils.fetch_data(f"""
+        SELECT (SELECT COALESCE(SUM(cns), 0) FROM rollup_sales_daily WHERE {PERIOD}) AS n,
+               (SELECT COALESCE(SUM(sales), 0) FROM rollup_sales_daily WHERE {PERIOD}) AS income,
+               (SELECT COALESCE(SUM(discount), 0) FROM rollup_sales_daily WHERE {PERIOD}) AS discount,
+               (SELECT COALESCE(SUM(real_exp), 0) FROM rollup_branch_daily WHERE {PERIOD}) AS branch_exp
+    """, params)
+    return {
+        "rows": int(df['n'].iloc[0]),
+        "income": float(df['income'].iloc[0]),
+        "discount": float(df['discount'].iloc[0]),
+        "branch_exp": float(df['branch_exp'].iloc[0]),
+        "ho_exp": ho_total(start, end) or 0,
+    }
+
+if __name__ == "__main__":
+    import migrations
+    migrations.migrate()   # creates (and fills) the tables on a new database
+    rebuild_all()
+    print("Rollups rebuilt.")
@@ -0,0 +1,97 @@
+import numpy as np
+import pandas as pd
+
+# --- TYPED FRAME LOADING ---
+# Declared dtypes for the frames loaded into memory. Repeated strings (branch names,
+# sales types, parties) become `category` (one copy per distinct value plus small
+# integer codes), counts are downcast, and text normalization runs once per distinct
+# value instead of once per row. Columns not listed keep whatever read_sql gave them.
+#
+# Kinds:
+#   category        low-cardinality text, values kept as stored
+#   category_upper  stripped + upper-cased category; missing values become 'NONE'
+#   amount          money: numeric, unparseable/missing as 0, float64 (float32 would lose paise on large totals)
+#   count           whole numbers: downcast to the smallest integer type when nothing is missing
+#   date            datetime64
+
+SCHEMAS = {
+    "master_data": {
+        "manifest_date": "date", "cn_date": "date",
+        "sales_amount": "amount", "manual_figures": "amount",
+        "sales_type": "category_upper",
+        "origin": "category", "destination": "category",
+        "dispatch_from": "category", "dispatch_to": "category",
+        "payment_liability": "category", "pkg_type": "category",
+        "no_of_pkgs": "count",
+    },
+    "branch_expenses": {
+        "manifest_date": "date",
+        "origin": "category", "destination": "category",
+    },
+    "ho_expenses": {
+        "entry_date": "date",
+    },
+}
+
+def _normalized_category(s, fill):
+    # Normalize the distinct values only, then re-map the codes (values that collapse together share a code).
+    # Categories stay sorted, so groupby / pivot order matches the plain-text columns they replaced
+    cat = s.fillna(fill).astype('category').cat
+    normalized = cat.categories.astype(str).str.strip().str.upper()
+    new_codes, uniques = pd.factorize(normalized, sort=True)
+    codes = cat.codes.to_numpy()
+    codes = np.where(codes >= 0, new_codes[codes], -1)
+    return pd.Series(pd.Categorical.from_codes(codes, uniques), index=s.index, name=s.name)
+
+def _convert(s, kind):
+    if kind == "date":
+        return pd.to_datetime(s)
+    if kind == "amount":
+        return pd.to_numeric(s, errors='coerce').fillna(0).astype('float64')
+    if kind == "count":
+        s = pd.to_numeric(s, errors='coerce')
+        return pd.to_numeric(s, downcast='integer') if s.notna().all() else s
+    if kind == "category":
+        return s.astype('category')
+    if kind == "category_upper":
+        return _normalized_category(s, 'None')
+    raise ValueError(f"Unknown column kind: {kind}")
+
+def apply_schema(df, table):
+    """
+    Converts the columns of `df` declared for `table`, in place, and returns it.
+    """
+    for col, kind in SCHEMAS.get(table, {}).items():
+        if col in df.columns:
+            df[col] = _convert(df[col], kind)
+    return df
+
+def concat(frames):
+    """
+    pd.concat for chunks of one table that keeps categorical columns categorical
+    (plain concat falls back to object when the chunks' categories differ).
+    """
+    frames = [f for f in frames if not f.empty] or list(frames)[:1]
+    if len(frames) == 1: return frames[0]
+    for col in frames[0].columns:
+        if isinstance(frames[0][col].dtype, pd.CategoricalDtype):
+            # Sorted, as each chunk's own categories are, so groupby / pivot order doesn't depend on chunk boundaries
+            categories = pd.Index(pd.unique(np.concatenate([f[col].cat.categories.to_numpy(dtype=object) for f in frames]))).sort_values()
+            for f in frames:
+                f[col] = f[col].cat.set_categories(categories)
+    # infer_objects: a chunk whose text column is all NULL comes back as object dtype
+    return pd.concat(frames, ignore_index=True).infer_objects()
+
+def decategorize(df):
+    """
+    Categorical columns (and column labels) of a small result frame back to plain values, so
+    report output looks the same whichever path built it.
+    """
+    for col in df.columns[[isinstance(t, pd.CategoricalDtype) for t in df.dtypes]]:
+        df[col] = df[col].astype(df[col].cat.categories.dtype)
+    if isinstance(df.columns, pd.CategoricalIndex):
+        df.columns = df.columns.astype(df.columns.categories.dtype)
+    return df
+
+def memory_mb(df):
+    return df.memory_usage(deep=True).sum() / 1024 / 1024
@@ -0,0 +1,137 @@
+import os
+import tempfile
+from datetime import date, timedelta
+
+import pandas as pd
+import db_utils
+import expense_store
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    HAS_PYARROW = True
+except ImportError:
+    HAS_PYARROW = False
+
+# --- CLOSED-MONTH SNAPSHOTS ---
+# Rows of months before the current one rarely change, so Report Center keeps them as
+# Parquet files on local disk, one per table and month:
+#
+#   <SNAPSHOT_DIR>/<table>/month=2025-03/part.parquet
+#
+# Before a snapshot is used, its row count and checksum are compared with the same
+# figures computed in the database (one small GROUP BY per table). Stale or missing
+# months are re-fetched and rewritten. Only the open month, plus any months that can't
+# be snapshotted, is queried row by row. Without pyarrow, or on the DuckDB backend (already
+# a local columnar file), everything comes from the database.
+
+SNAPSHOT_DIR = os.environ.get("SNAPSHOT_DIR", os.path.join(tempfile.gettempdir(), "logistics_snapshots"))
+
+# table -> date column that assigns rows to months
+TABLES = {"master_data": "manifest_date", "branch_expenses": "manifest_date", "ho_expenses": "entry_date"}
+
+def enabled():
+    return HAS_PYARROW and db_utils.is_postgres()
+
+def _month_start(d):
+    return date(d.year, d.month, 1)
+
+def _next_month(m):
+    return date(m.year + (m.month == 12), m.month % 12 + 1, 1)
+
+def closed_months(start, end, today=None):
+    """
+    First days of the months touching [start, end] that ended before the current month.
+    """
+    current = _month_start(today or date.today())
+    months, m = [], _month_start(start)
+    while m <= end and m < current:
+        months.append(m)
+        m = _next_month(m)
+    return months
+
+def uncovered_ranges(start, end, covered):
+    """
+    [start, end] minus the `covered` months, as half-open (from, to) date ranges, so the
+    database part of a load is a plain range filter that indexes can bound.
+    """
+    covered = set(covered)
+    ranges, lo, m = [], start, _month_start(start)
+    while m <= end:
+        if m in covered:
+            if lo < m: ranges.append((lo, m))
+            lo = _next_month(m)
+        m = _next_month(m)
+    if lo <= end: ranges.append((lo, end + timedelta(days=1)))
+    return ranges
+
+def _path(table, month):
+    return os.path.join(SNAPSHOT_DIR, table, f"month={month:%Y-%m}", "part.parquet")
+
+def _db_versions(table, months, conn):
+    """
+    {month: (rows, checksum)} from the database, for the given months.
+    """
+    date_col = TABLES[table]
+    with conn.cursor() as cur:
+        cur.execute(f"""
+            SELECT date_trunc('month', {date_col})::date, COUNT(*), COALESCE(SUM(hashtext({table}::text)::bigint), 0)
+            FROM {expense_store.relation(table)}
+            WHERE {date_col} >= %s AND {date_col} < %s
+            GROUP BY 1
+        """, (months[0], _next_month(months[-1])))
+        return {row[0]: (row[1], row[2]) for row in cur.fetchall()}
+
+def _file_version(path):
+    if not os.path.exists(path): return None
+    meta = pq.read_schema(path).metadata or {}
+    if b"rows" not in meta: return None
+    return int(meta[b"rows"]), int(meta[b"checksum"])
+
+def _write(table, month, df, version):
+    path = _path(table, month)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    arrow = pa.Table.from_pandas(df, preserve_index=False)
+    arrow = arrow.replace_schema_metadata({
+        **(arrow.schema.metadata or {}), b"rows": str(version[0]).encode(), b"checksum": str(version[1]).encode(),
+    })
+    tmp = f"{path}.{os.getpid()}.tmp"
+    pq.write_table(arrow, tmp)
+    os.replace(tmp, path)
+
+def _read(table, month):
+    # memory_map: pages come from the OS file cache instead of a private read buffer
+    return pq.read_table(_path(table, month), memory_map=True).to_pandas()
+
+def closed_month_frames(table, start, end, conn, stats=None):
+    """
+    Raw (un-prepared) frames for the closed months of [start, end], from snapshots,
+    refreshing any that no longer match the database. Returns (frames, months covered);
+    the caller queries the database for everything else. `stats` gets hit/refreshed counts.
+    """
+    months = closed_months(start, end)
+    if not enabled() or not months:
+        return [], []
+    date_col = TABLES[table]
+    versions = _db_versions(table, months, conn)
+    frames = []
+    hits = refreshed = 0
+    for month in months:
+        version = versions.get(month, (0, 0))
+        if version[0] == 0:
+            continue   # nothing in the database for this month
+        if _file_version(_path(table, month)) == version:
+            df = _read(table, month)
+            hits += 1
+        else:
+            df = pd.concat(db_utils.fetch_chunks(
+                f"SELECT * FROM {expense_store.relation(table)} WHERE {date_col} >= %s AND {date_col} < %s", (month, _next_month(month)), conn=conn
+            ), ignore_index=True).infer_objects()
+            _write(table, month, df, version)
+            refreshed += 1
+        # Months cut by the report period are trimmed after reading
+        dates = pd.to_datetime(df[date_col]).dt.date
+        frames.append(df[(dates >= start) & (dates <= end)].reset_index(drop=True))
+    if stats is not None:
+        stats.update(snapshot_hits=hits, snapshot_refreshed=refreshed)
+    return frames, months
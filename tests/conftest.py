@@ -0,0 +1,68 @@
+import os
+import sys
+from contextlib import contextmanager
+from urllib.parse import quote
+
+import pytest
+
+# The app's modules live flat in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import psycopg2
+import streamlit as st
+
+import data_cache
+import db_utils
+import migrations
+import snapshots
+
+# PostgreSQL runs need TEST_DATABASE_URL; the tables go in a scratch schema dropped afterwards
+TEST_SCHEMA = "app_test"
+# Everything data_cache may hold entries for
+CACHED_TABLES = ("logistics_entries", "master_data", "branch_expenses", "ho_expenses", "branch_mappings", "expense_types")
+
+def _reset_caches():
+    for cached in (db_utils.get_pool, migrations.migrate):
+        cached.clear()
+    st.cache_data.clear()
+    data_cache.invalidate(*CACHED_TABLES)
+
+@contextmanager
+def database(backend, tmp_dir):
+    """
+    Points db_utils at a new, migrated database on `backend` ("duckdb" or "postgres") for
+    the duration of the block. Caches are cleared on the way in and out.
+    """
+    mp = pytest.MonkeyPatch()
+    admin = None
+    if backend == "duckdb":
+        pytest.importorskip("duckdb")
+        mp.setattr(db_utils, "DB_BACKEND", "duckdb")
+        mp.setattr(db_utils, "DUCKDB_PATH", os.path.join(tmp_dir, "app.duckdb"))
+    else:
+        url = os.environ.get("TEST_DATABASE_URL")
+        if not url: pytest.skip("TEST_DATABASE_URL not set")
+        admin = psycopg2.connect(url)
+        admin.autocommit = True
+        with admin.cursor() as cur:
+            cur.execute(f"DROP SCHEMA IF EXISTS {TEST_SCHEMA} CASCADE; CREATE SCHEMA {TEST_SCHEMA}")
+        mp.setattr(db_utils, "DB_BACKEND", "postgres")
+        mp.setattr(snapshots, "SNAPSHOT_DIR", os.path.join(tmp_dir, "snapshots"))
+        mp.setenv("DATABASE_URL", url + ("&" if "?" in url else "?") + "options=" + quote(f"-c search_path={TEST_SCHEMA}"))
+    try:
+        _reset_caches()
+        migrations.migrate()
+        yield
+    finally:
+        db_utils.get_pool().closeall()
+        _reset_caches()
+        mp.undo()
+        if admin is not None:
+            with admin.cursor() as cur:
+                cur.execute(f"DROP SCHEMA {TEST_SCHEMA} CASCADE")
+            admin.close()
+
+@pytest.fixture
+def duckdb_database(tmp_path):
+    with database("duckdb", str(tmp_path)):
+        yield
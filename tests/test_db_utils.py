@@ -0,0 +1,57 @@
+import numpy as np
+import pandas as pd
+
+import db_utils
+
+COLS = ["manual_figures", "sales_amount", "remarks"]
+
+def grid():
+    return pd.DataFrame({
+        "cn_no": ["C1", "C2", "C3", "C4"],
+        "manual_figures": [0.0, 100.0, np.nan, 50.0],
+        "sales_amount": [500.0, 100.0, 80.0, np.nan],
+        "remarks": ["", "ok", None, "x"],
+    })
+
+def test_changed_rows_unchanged_grid():
+    assert db_utils.changed_rows(grid(), grid(), COLS).empty
+
+def test_changed_rows_edited_cells():
+    edited = grid()
+    edited.loc[0, "manual_figures"] = 500.0
+    edited.loc[3, "remarks"] = "paid in cash"
+    assert db_utils.changed_rows(grid(), edited, COLS)["cn_no"].tolist() == ["C1", "C4"]
+
+def test_changed_rows_missing_values():
+    edited = grid()
+    edited.loc[2, "manual_figures"] = 80.0    # NaN -> value
+    edited.loc[1, "sales_amount"] = np.nan    # value -> NaN
+    edited.loc[2, "remarks"] = np.nan         # None -> NaN: both missing, unchanged
+    assert db_utils.changed_rows(grid(), edited, COLS)["cn_no"].tolist() == ["C2", "C3"]
+
+def test_changed_rows_ignores_other_columns():
+    edited = grid()
+    edited["cn_no"] = ["X1", "X2", "X3", "X4"]
+    assert db_utils.changed_rows(grid(), edited, COLS).empty
+
+def test_bulk_update_round_trip(duckdb_database):
+    for row in grid().itertuples(index=False):
+        db_utils.run_query("INSERT INTO logistics_entries (cn_no, manual_figures, sales_amount, remarks) VALUES (%s, %s, %s, %s)",
+                           [None if pd.isna(v) else v for v in row])
+    edited = grid()
+    edited.loc[0, "manual_figures"] = 450.0
+    edited.loc[1, "sales_amount"] = np.nan
+    edited.loc[3, "remarks"] = "paid in cash"
+    dirty = db_utils.changed_rows(grid(), edited, COLS)
+
+    assert db_utils.bulk_update("logistics_entries", "cn_no", dirty, COLS) == 3
+
+    saved = db_utils.fetch_data("SELECT cn_no, manual_figures, sales_amount, remarks FROM logistics_entries ORDER BY cn_no")
+    saved[["manual_figures", "sales_amount"]] = saved[["manual_figures", "sales_amount"]].astype(float)
+    expected = edited.astype({"manual_figures": float, "sales_amount": float})
+    pd.testing.assert_frame_equal(saved, expected, check_dtype=False)
+
+def test_bulk_update_unknown_keys(duckdb_database):
+    missing = pd.DataFrame({"cn_no": ["NOPE"], "manual_figures": [1.0], "sales_amount": [1.0], "remarks": ["x"]})
+    assert db_utils.bulk_update("logistics_entries", "cn_no", missing, COLS) == 0
+    assert db_utils.bulk_update("logistics_entries", "cn_no", missing.iloc[:0], COLS) == 0
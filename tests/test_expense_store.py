@@ -0,0 +1,107 @@
+from datetime import date
+
+import pytest
+
+import conftest
+import data_cache
+import db_utils
+import expense_store
+import rollups
+
+@pytest.fixture(params=["duckdb", "postgres"])
+def database(request, tmp_path):
+    with conftest.database(request.param, str(tmp_path)):
+        yield
+
+def add_entry(manifest, day, lines, destination="Madhubani"):
+    db_utils.run_query("INSERT INTO branch_expenses (manifest_no, manifest_date, origin, destination) VALUES (%s, %s, 'PATNA', %s)",
+                       (manifest, day, destination))
+    for expense_type, amount in lines.items():
+        db_utils.run_query("INSERT INTO branch_expense_lines VALUES (%s, %s, %s)", (manifest, expense_type, amount))
+
+def lines():
+    df = db_utils.fetch_data("SELECT manifest_no, expense_type, amount FROM branch_expense_lines ORDER BY manifest_no, expense_type")
+    return {(m, t): float(a) for m, t, a in df.itertuples(index=False)}
+
+def wide():
+    df = db_utils.fetch_data(f"SELECT * FROM {expense_store.relation('branch_expenses')} ORDER BY manifest_no")
+    return df.set_index("manifest_no")
+
+def header_columns():
+    return db_utils.fetch_data("SELECT * FROM branch_expenses LIMIT 0").columns.tolist()
+
+def test_legacy_wide_columns_become_lines(database):
+    # The old layout: one column per expense type, numbers sometimes stored as text
+    db_utils.run_query("ALTER TABLE branch_expenses ADD COLUMN toll numeric")
+    db_utils.run_query("ALTER TABLE branch_expenses ADD COLUMN loading text")
+    db_utils.run_query("ALTER TABLE branch_expenses ADD COLUMN driver text")    # not numbers: not an expense
+    db_utils.run_query("INSERT INTO branch_expenses (manifest_no, manifest_date, toll, loading, driver) VALUES "
+                       "('BX1', '2025-03-02', 40, ' 15 ', 'Ravi'), ('BX2', '2025-03-03', 0, '', 'Mohan'), "
+                       "('BX3', '2025-03-04', NULL, '7.5', NULL)")
+    db_utils.run_query("INSERT INTO branch_expense_lines VALUES ('BX1', 'rent', 1000)")
+
+    with db_utils.connection() as conn:
+        with conn.cursor() as cur:
+            expense_store.migrate_legacy_columns(cur)
+            assert expense_store.legacy_mismatches(cur, "branch_expenses", "toll") == 0
+            assert expense_store.legacy_mismatches(cur, "branch_expenses", "loading") == 0
+    data_cache.invalidate("expense_types")
+
+    assert expense_store.expense_types("branch_expenses") == expense_store.DEFAULT_TYPES["branch_expenses"] + ["toll", "loading"]
+    # Zeros and blanks store no line; existing lines are kept
+    assert lines() == {("BX1", "loading"): 15, ("BX1", "rent"): 1000, ("BX1", "toll"): 40, ("BX3", "loading"): 7.5}
+    cols = header_columns()
+    assert {"legacy_toll", "legacy_loading", "driver"} <= set(cols)
+    assert "toll" not in cols and "loading" not in cols
+    assert wide().loc["BX1", ["rent", "toll", "loading"]].astype(float).tolist() == [1000, 40, 15]
+
+    # Run again (e.g. by a second app instance): nothing left to migrate
+    with db_utils.connection() as conn:
+        with conn.cursor() as cur:
+            expense_store.migrate_legacy_columns(cur)
+    assert len(lines()) == 4
+
+    assert sorted(expense_store.drop_legacy_columns()) == [("branch_expenses", "legacy_loading"), ("branch_expenses", "legacy_toll")]
+    assert not any(c.startswith(expense_store.LEGACY_PREFIX) for c in header_columns())
+
+def test_drop_legacy_columns_refuses_edited_lines(database):
+    db_utils.run_query("ALTER TABLE branch_expenses ADD COLUMN toll numeric")
+    db_utils.run_query("INSERT INTO branch_expenses (manifest_no, manifest_date, toll) VALUES ('BX1', '2025-03-02', 40)")
+    with db_utils.connection() as conn:
+        with conn.cursor() as cur:
+            expense_store.migrate_legacy_columns(cur)
+    db_utils.run_query("UPDATE branch_expense_lines SET amount = 45 WHERE manifest_no = 'BX1'")
+
+    with pytest.raises(ValueError, match="legacy_toll: 1 entries differ"):
+        expense_store.drop_legacy_columns()
+    assert "legacy_toll" in header_columns()
+    assert expense_store.drop_legacy_columns(force=True) == [("branch_expenses", "legacy_toll")]
+
+def test_save_edits_and_deletes_lines(database):
+    add_entry("BX1", date(2025, 3, 2), {"rent": 1000, "vehicle": 250})
+    add_entry("BX2", date(2025, 3, 2), {"vehicle": 120})
+    add_entry("BX3", date(2025, 3, 5), {"rent": 700})
+    rollups.refresh_branch_days([date(2025, 3, 2), date(2025, 3, 5)])
+    types = expense_store.expense_types("branch_expenses")
+
+    edited = wide()
+    edited.loc["BX1", ["rent", "vehicle", "remarks"]] = [1200, 0, "rent revised"]    # 0 deletes the line
+    edited.loc["BX2", "transfer_to_ho"] = 300                                        # a new line
+    dirty = edited.loc[["BX1", "BX2"]].reset_index()
+
+    assert expense_store.save("branch_expenses", dirty, types, ["remarks"]) == 2
+
+    assert lines() == {("BX1", "rent"): 1200, ("BX2", "transfer_to_ho"): 300, ("BX2", "vehicle"): 120, ("BX3", "rent"): 700}
+    saved = wide()
+    assert saved.loc["BX1", "remarks"] == "rent revised"
+    assert saved.loc["BX1", types].astype(float).tolist() == [1200, 0, 0]
+    assert saved.loc["BX3", types].astype(float).tolist() == [700, 0, 0]
+
+    if rollups.enabled():
+        # Re-rolled in the same transaction as the save
+        day = db_utils.fetch_data("SELECT SUM(entries), SUM(rent), SUM(vehicle), SUM(transfer_ho) FROM rollup_branch_daily "
+                                  "WHERE day = '2025-03-02'")
+        assert day.iloc[0].astype(float).tolist() == [2, 1200, 120, 300]
+
+def test_save_nothing(database):
+    assert expense_store.save("branch_expenses", wide(), expense_store.expense_types("branch_expenses"), ["remarks"]) == 0
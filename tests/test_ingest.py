@@ -0,0 +1,83 @@
+import threading
+
+import pandas as pd
+import pytest
+
+import ingest
+
+def counting(n=None, fail_at=None):
+    """A chunk source that records how far it got and whether it was closed."""
+    state = {"produced": 0, "closed": False}
+    def chunks():
+        try:
+            i = 0
+            while n is None or i < n:
+                if i == fail_at: raise ValueError(f"bad row in chunk {i}")
+                state["produced"] += 1
+                yield pd.DataFrame({"x": [i]})
+                i += 1
+        finally:
+            state["closed"] = True
+    return chunks(), state
+
+def workers():
+    return {t for t in threading.enumerate() if t is not threading.current_thread()}
+
+def test_prefetch_yields_every_chunk_in_order():
+    chunks, _ = counting(5)
+    assert [c["x"].item() for c in ingest.prefetch(chunks, depth=2)] == [0, 1, 2, 3, 4]
+
+def test_parse_error_reaches_the_consumer():
+    before = workers()
+    chunks, state = counting(fail_at=2)
+    seen = []
+    with pytest.raises(ValueError, match="bad row in chunk 2"):
+        for chunk in ingest.prefetch(chunks):
+            seen.append(chunk["x"].item())
+    assert seen == [0, 1]
+    assert workers() == before
+
+def test_abandoned_consumer_stops_the_worker():
+    before = workers()
+    chunks, state = counting()    # endless: only the stop signal ends it
+    it = ingest.prefetch(chunks, depth=1)
+    next(it)
+    # close() joins the worker, which must close its source rather than block on the full queue
+    closing = threading.Thread(target=it.close, daemon=True)
+    closing.start()
+    closing.join(timeout=5)
+    assert not closing.is_alive(), "worker still running after the consumer went away"
+    assert workers() == before
+    assert state["closed"]
+    produced = state["produced"]
+    assert produced <= 3    # the one consumed, one queued and one waiting to be
+    assert state["produced"] == produced
+
+def test_writer_failure_stops_the_worker():
+    before = workers()
+    chunks, state = counting()
+    progress = ingest.Progress(ingest.prefetch(chunks), report=lambda *a: None)
+    with pytest.raises(RuntimeError):
+        for _ in progress:
+            raise RuntimeError("COPY failed")
+    assert workers() == before
+    assert state["closed"]
+
+def test_text_columns_keep_their_type_across_chunks(tmp_path):
+    # Digits only in the first chunk, letters in the second: inferred per chunk these would be int, then str
+    path = tmp_path / "upload.csv"
+    path.write_text("CN No,Remarks,Sales Amount\n101,7,10\n102,8,20\nA103,late,30\n0104,,40\n")
+    with open(path, "rb") as f:
+        chunks = list(ingest.stream(f, chunksize=2, report=lambda *a: None, text_columns=["CN No", "Remarks", "Not In File"]))
+    df = pd.concat(chunks, ignore_index=True)
+    assert df["CN No"].tolist() == ["101", "102", "A103", "0104"]    # leading zero kept
+    assert df["Remarks"].tolist()[:3] == ["7", "8", "late"]
+    assert pd.isna(df.loc[3, "Remarks"])
+    assert df["Sales Amount"].tolist() == [10, 20, 30, 40]
+
+def test_explicit_dtype_wins_over_text_columns(tmp_path):
+    path = tmp_path / "upload.csv"
+    path.write_text("CN No,Qty\n1,2\n")
+    with open(path, "rb") as f:
+        df = next(iter(ingest.read_chunks(f, text_columns=["CN No", "Qty"], dtype={"Qty": float})))
+    assert df.loc[0, "CN No"] == "1" and df.loc[0, "Qty"] == 2.0
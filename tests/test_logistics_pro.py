@@ -0,0 +1,117 @@
+from datetime import date
+
+import pandas as pd
+import pytest
+
+import conftest
+import db_utils
+import ingest
+import logistics_pro
+
+def add_entries(rows):
+    for cn, day, sales, manual, remarks in rows:
+        db_utils.run_query("INSERT INTO logistics_entries (cn_no, manifest_date, sales_amount, manual_figures, remarks) "
+                           "VALUES (%s, %s, %s, %s, %s)", (cn, day, sales, manual, remarks))
+
+def stored(columns="cn_no, sales_amount, manual_figures, remarks"):
+    df = db_utils.fetch_data(f"SELECT {columns} FROM logistics_entries ORDER BY cn_no")
+    return df.set_index("cn_no")
+
+# --- BULK UPDATE ---
+
+UPDATE_CSV = """CN No,Manual Recvd,Sales Amount,Remarks
+C1,100,,first
+C2,,250,
+C1,,,
+C1,150,,
+C9,10,,not in the register
+C2,,,late
+C3,,,
+C1,,,last
+"""
+
+def test_bulk_update_takes_last_non_empty_value_per_cn(duckdb_database, tmp_path):
+    add_entries([
+        ("C1", date(2025, 3, 1), 500, 0, "old"),
+        ("C2", date(2025, 3, 2), 200, 20, None),
+        ("C3", date(2025, 3, 3), 300, 30, "keep"),
+    ])
+    path = tmp_path / "update.csv"
+    path.write_text(UPDATE_CSV)
+    with open(path, "rb") as f:
+        # Three rows per chunk, so a CN's updates span chunks
+        chunks = ingest.stream(f, logistics_pro.prepare_bulk_update, report=lambda *a: None, chunksize=3,
+                               text_columns=logistics_pro.UPDATE_TEXT_HEADERS)
+        matched, unmatched = logistics_pro.apply_bulk_update(chunks)
+
+    # C3's row is blank throughout, so prepare drops it: only C1, C2 (found) and C9 (not) count
+    assert (matched, unmatched) == (2, 1)
+    df = stored()
+    assert df.loc["C1"].tolist() == [500, 150, "last"]    # blank cells leave stored values alone
+    assert df.loc["C2"].tolist() == [250, 20, "late"]
+    assert df.loc["C3"].tolist() == [300, 30, "keep"]
+    assert "C9" not in df.index
+
+def test_bulk_update_single_frame(duckdb_database):
+    add_entries([("C1", date(2025, 3, 1), 500, 0, None)])
+    update = logistics_pro.prepare_bulk_update(pd.DataFrame({"CN No": [" C1 ", "C2"], "Manual Recvd": ["75", None]}))
+    assert logistics_pro.apply_bulk_update(update) == (1, 0)
+    assert stored().loc["C1", "manual_figures"] == 75
+    assert logistics_pro.apply_bulk_update(update.iloc[:0]) == (0, 0)
+
+# --- REGISTER PAGING ---
+
+@pytest.fixture(params=["duckdb", "postgres"])
+def register(request, tmp_path):
+    with conftest.database(request.param, str(tmp_path)):
+        # A third of the rows have no manifest date; dates repeat so cn_no breaks ties
+        rows = [(f"C{i}", date(2025, 1, 1 + i % 4) if i % 3 else None) for i in range(20)]
+        for cn, day in rows:
+            db_utils.run_query("INSERT INTO logistics_entries (cn_no, manifest_date) VALUES (%s, %s)", (cn, day))
+        yield rows
+
+def page_through(where, params, page_size):
+    seen, after = [], None
+    for _ in range(100):
+        df = logistics_pro.fetch_register_page(where, params, after, page_size)
+        seen += df['cn_no'].tolist()
+        if len(df) < page_size: return seen
+        last = df.iloc[-1]
+        after = (last['manifest_date'], last['cn_no'])
+    raise AssertionError("paging did not finish")
+
+@pytest.mark.parametrize("page_size", [1, 3, 7, 20, 25])
+def test_register_pages_cover_every_row_once(register, page_size):
+    dated = sorted((r for r in register if r[1] is not None), key=lambda r: (r[1], r[0]), reverse=True)
+    undated = sorted((r for r in register if r[1] is None), reverse=True)
+    # Newest first, undated rows last
+    assert page_through("1=1", [], page_size) == [cn for cn, _ in dated + undated]
+
+def test_register_pages_with_only_undated_matches(register):
+    undated = sorted(cn for cn, day in register if day is None)[::-1]
+    assert page_through("manifest_date IS NULL", [], 2) == undated
+
+# --- REGISTER SEARCH ---
+
+@pytest.fixture(params=["duckdb", "postgres"])
+def searchable(request, tmp_path):
+    with conftest.database(request.param, str(tmp_path)):
+        for cn, consignor in [("A_1", "RAM TRADERS"), ("AB1", "50% OFF STORES"), ("AXX1", "500 OFFICE"), ("C\\9", "SHYAM")]:
+            db_utils.run_query("INSERT INTO logistics_entries (cn_no, consignor, manifest_date) VALUES (%s, %s, '2025-03-01')",
+                               (cn, consignor))
+        yield
+
+def search(term):
+    where, params = logistics_pro.register_filter(date(2025, 1, 1), date(2025, 12, 31), term)
+    return sorted(page_through(where, params, 10))
+
+@pytest.mark.parametrize("term, expected", [
+    ("a_1", ["A_1"]),           # _ is literal, not any character: AB1 doesn't match
+    ("_", ["A_1"]),
+    ("0% off", ["AB1"]),        # % is literal: 500 OFFICE doesn't match
+    ("\\", ["C\\9"]),
+    ("c\\9", ["C\\9"]),
+    ("1", ["AB1", "AXX1", "A_1"]),
+])
+def test_register_search_matches_the_term_literally(searchable, term, expected):
+    assert search(term) == expected
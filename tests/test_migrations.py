@@ -0,0 +1,71 @@
+import re
+
+import psycopg2
+import pytest
+
+import conftest
+import db_utils
+import metrics
+import migrations
+
+DDL = re.compile(r"^\s*(CREATE|ALTER|DROP)\b", re.IGNORECASE)
+
+@pytest.fixture(params=["duckdb", "postgres"])
+def database(request, tmp_path):
+    with conftest.database(request.param, str(tmp_path)):
+        yield request.param
+
+def recorded():
+    df = db_utils.fetch_data("SELECT version, name FROM schema_version ORDER BY version")
+    return list(df.itertuples(index=False, name=None))
+
+def test_first_run_records_what_it_applied(database):
+    names = dict((v, n) for v, n, _ in migrations.MIGRATIONS)
+    applied = migrations.migrate()
+    assert recorded() == [(v, names[v]) for v in sorted(names) if names[v] in applied]
+    if database == "duckdb":
+        # The PostgreSQL-only steps stay unrecorded
+        assert [v for v, _ in recorded()] == [1, 2, 7]
+    else:
+        assert {"baseline", "expense_lines", "change_tracking", "rollup_tables", "entry_order"} <= applied
+
+def test_second_run_runs_no_ddl(database, monkeypatch):
+    first, versions = migrations.migrate(), recorded()
+    migrations.migrate.clear()    # as a new process would
+
+    # Optional steps the database refused (e.g. search_indexes without pg_trgm) are retried on
+    # every start by design, so only the applied ones are checked
+    statements, steps = [], []
+    monkeypatch.setattr(metrics, "record_query", lambda sql, *a, **k: statements.append(sql))
+    monkeypatch.setattr(migrations, "MIGRATIONS", [
+        (version, name, lambda conn, name=name: steps.append(name) or True)
+        for version, name, _ in migrations.MIGRATIONS if name in first])
+
+    assert migrations.migrate() == first
+    assert recorded() == versions
+    assert steps == []
+    assert statements and not [s for s in statements if DDL.match(s)]
+
+def test_invalid_concurrent_index_is_rebuilt(database):
+    if database != "postgres": pytest.skip("concurrent indexes are PostgreSQL only")
+    for manifest in ("BX1", "BX2"):
+        db_utils.run_query("INSERT INTO branch_expenses (manifest_no, manifest_date) VALUES (%s, '2025-03-02')", (manifest,))
+    with db_utils.connection() as conn:
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute("DROP INDEX idx_branch_expenses_date")
+            # Fails on the duplicate date, leaving an invalid index of the same name, as an interrupted build would
+            with pytest.raises(psycopg2.Error):
+                cur.execute("CREATE UNIQUE INDEX CONCURRENTLY idx_branch_expenses_date ON branch_expenses (manifest_date)")
+        conn.autocommit = False
+
+        assert index_state("idx_branch_expenses_date") == (False, True)
+        assert migrations._date_indexes(conn)
+        assert index_state("idx_branch_expenses_date") == (True, False)
+
+def index_state(name):
+    df = db_utils.fetch_data("""
+        SELECT i.indisvalid, i.indisunique FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE c.relname = %s AND c.relnamespace = current_schema()::regnamespace
+    """, (name,))
+    return tuple(bool(v) for v in df.iloc[0])
@@ -0,0 +1,58 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import reconciliation
+
+# The row-wise rules reconciliation.py replaced, as the register and Report Center had them
+
+def old_discount(x):
+    return (x['sales_amount'] - x['manual_figures']) if (x['manual_figures'] > 0 and x['manual_figures'] < x['sales_amount']) else 0
+
+def old_excess(x):
+    return (x['manual_figures'] - x['sales_amount']) if x['manual_figures'] > x['sales_amount'] else 0
+
+def old_due(x):
+    return x['sales_amount'] if x['manual_figures'] == 0 else 0
+
+def frame(pairs):
+    df = pd.DataFrame(pairs, columns=['sales_amount', 'manual_figures'], dtype=float)
+    # Callers coerce both columns and fill missing values with 0 first
+    df['sales_amount'] = pd.to_numeric(df['sales_amount'], errors='coerce').fillna(0)
+    df['manual_figures'] = pd.to_numeric(df['manual_figures'], errors='coerce').fillna(0)
+    return df
+
+CASES = {
+    "nothing received": [(100, 0), (0, 0), (250.5, 0)],
+    "paid in full": [(100, 100), (0.1, 0.1), (0, 0)],
+    "received less": [(100, 40), (100, 99.99), (0.3, 0.1)],
+    "received more": [(100, 150), (0, 20), (10, 10.01)],
+    "negative amounts": [(-100, 0), (-100, -50), (100, -50), (-50, -100), (-20, 30), (0, -5)],
+    "missing values": [(np.nan, 50), (100, np.nan), (np.nan, np.nan), (None, 0)],
+}
+
+@pytest.mark.parametrize("pairs", CASES.values(), ids=CASES.keys())
+def test_matches_row_wise_rules(pairs):
+    df = frame(pairs)
+    expected = pd.DataFrame({
+        "Discount": df.apply(old_discount, axis=1),
+        "Excess": df.apply(old_excess, axis=1),
+        "Due_From_Party": df.apply(old_due, axis=1),
+    }).astype(float)
+    reconciliation.add_reconciliation_columns(df)
+    pd.testing.assert_frame_equal(df[expected.columns].astype(float), expected)
+
+def test_matches_row_wise_rules_on_random_rows():
+    rng = np.random.default_rng(5)
+    sales = rng.choice([0, 100, 250.5, -40], 5000) * rng.integers(0, 3, 5000)
+    manual = np.where(rng.random(5000) < 0.3, 0, np.where(rng.random(5000) < 0.3, sales, rng.uniform(-50, 600, 5000)))
+    df = frame(list(zip(sales, manual)))
+    sales, manual = df['sales_amount'].to_numpy(), df['manual_figures'].to_numpy()
+    np.testing.assert_array_equal(reconciliation.discount(sales, manual), df.apply(old_discount, axis=1).to_numpy())
+    np.testing.assert_array_equal(reconciliation.excess(sales, manual), df.apply(old_excess, axis=1).to_numpy())
+    np.testing.assert_array_equal(reconciliation.due(sales, manual), df.apply(old_due, axis=1).to_numpy())
+
+def test_skipped_columns_are_not_added():
+    df = frame([(100, 40)])
+    reconciliation.add_reconciliation_columns(df, excess_col=None, due_col=None)
+    assert list(df.columns) == ['sales_amount', 'manual_figures', 'Discount']
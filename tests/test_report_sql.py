@@ -0,0 +1,109 @@
+from datetime import date
+
+import pandas as pd
+import pytest
+
+import conftest
+import db_utils
+import report_center
+import report_sql
+import rollups
+
+START, END = date(2025, 3, 1), date(2025, 3, 31)
+
+# (cn_no, manifest_no, manifest_date, dispatch_from, dispatch_to, sales_type, payment_liability, sales_amount, manual_figures)
+# Inserted in this order, which is neither the text order of the CN numbers nor of the manifests;
+# manifest numbers mix case and punctuation so byte order and a linguistic collation disagree.
+LOGISTICS = [
+    ("C9", "m-10", date(2025, 3, 2), "PATNA", "Madhubani", "TO PAY", "RAM TRADERS", 500, 0),
+    ("C10", "M-2", date(2025, 3, 2), "PATNA", "DARBHANGA ", "paid", "SHYAM & SONS", 300, 300),
+    ("C2", "M_1", date(2025, 3, 3), "PATNA", "PATNA (JAMAL ROAD)", "TO BE BILLED", "RAM TRADERS", 200, 0),
+    ("C1", "Z1", date(2025, 3, 3), "PATNA", "Raxaul", "TO PAY", "ram traders", 150, 100),
+    ("B7", "a1", date(2025, 3, 4), "PATNA", "Motihari", None, "SHYAM & SONS", 80, 0),
+    ("C3", "m-10", date(2025, 3, 2), "PATNA", "Madhubani", "TO PAY", "RAM TRADERS", 120, 0),
+    ("A5", "M-2", date(2025, 3, 5), "PATNA", "DARBHANGA ", "TO PAY", "ZED LTD", 90, 130),
+    ("C11", "a1", date(2025, 3, 4), "PATNA", "Motihari", "to pay", None, 60, 0),
+    ("D1", "Z1", date(2025, 3, 3), "PATNA", "Raxaul", "BILLED", "ZED LTD", 75, 0),
+    ("E1", "M-9", date(2025, 4, 1), "PATNA", "Raxaul", "TO PAY", "RAM TRADERS", 999, 0),   # outside the period
+]
+BRANCH = [
+    ("BX1", date(2025, 3, 2), "PATNA", "Madhubani", {"rent": 1000, "vehicle": 250, "transfer_to_ho": 400}),
+    ("BX2", date(2025, 3, 10), "PATNA", "DARBHANGA ", {"vehicle": 120}),
+    ("BX3", date(2025, 4, 2), "PATNA", "Raxaul", {"rent": 700}),
+]
+HO = [
+    (date(2025, 3, 1), {"salary": 5000, "electricity": 300}),
+    (date(2025, 3, 15), {"salary": 2500}),
+]
+
+@pytest.fixture(scope="module", params=["duckdb", "postgres"])
+def database(request, tmp_path_factory):
+    with conftest.database(request.param, str(tmp_path_factory.mktemp("db"))):
+        for cn, manifest, day, origin, dest, sales_type, party, amount, manual in LOGISTICS:
+            db_utils.run_query("""
+                INSERT INTO logistics_entries (cn_no, manifest_no, manifest_date, dispatch_from, dispatch_to,
+                                               sales_type, payment_liability, sales_amount, manual_figures)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+            """, (cn, manifest, day, origin, dest, sales_type, party, amount, manual))
+        for manifest, day, origin, dest, lines in BRANCH:
+            db_utils.run_query("INSERT INTO branch_expenses (manifest_no, manifest_date, origin, destination) VALUES (%s, %s, %s, %s)",
+                               (manifest, day, origin, dest))
+            for expense_type, amount in lines.items():
+                db_utils.run_query("INSERT INTO branch_expense_lines VALUES (%s, %s, %s)", (manifest, expense_type, amount))
+        for day, lines in HO:
+            db_utils.run_query("INSERT INTO ho_expenses (entry_date) VALUES (%s)", (day,))
+            for expense_type, amount in lines.items():
+                db_utils.run_query("INSERT INTO ho_expense_lines VALUES (%s, %s, %s)", (day, expense_type, amount))
+        # Rows written behind the app's back: bring the daily rollups (PostgreSQL only) up to date
+        rollups.refresh_sales_days([row[2] for row in LOGISTICS])
+        rollups.refresh_branch_days([row[1] for row in BRANCH])
+        rollups.refresh_ho_days([row[0] for row in HO])
+
+        yield report_center._load_frames(START, END)
+
+def assert_same(sql, pandas):
+    # Row order included: the reports are shown and exported as they come
+    pd.testing.assert_frame_equal(sql.reset_index(drop=True), pandas.reset_index(drop=True), check_dtype=False)
+
+def test_branch_summary(database):
+    df_log, df_branch, df_ho = database
+    sql = report_center.assemble_branch_summary(*report_sql.branch_summary_aggregates(
+        START, END, report_center.HO_NAME, report_center.NAME_MAP, report_center.RECEIPT_AT_HO))
+    assert_same(sql, report_center.generate_report_1(df_log, df_branch, df_ho))
+
+def test_manifest_comparison(database):
+    df_log, _, _ = database
+    sql = report_center.assemble_manifest_comparison(report_sql.manifest_comparison_aggregates(START, END))
+    pandas = report_center.generate_report_2(df_log)
+    assert sql['Manifest No'].tolist() == pandas['Manifest No'].tolist()
+    assert_same(sql, pandas)
+
+def test_due_summary(database):
+    df_log, _, _ = database
+    sql = report_center.assemble_due_summary(report_sql.due_summary_aggregates(START, END))
+    pandas = report_center.generate_report_3(df_log)
+    # CN lists in entry order, not sorted, whatever order the rows were read in
+    assert pandas.loc[pandas['Party Name'] == 'RAM TRADERS', 'Pending CN Nos'].item() == "C9, C2, C3"
+    assert_same(sql, pandas)
+
+def test_pnl(database):
+    df_log, df_branch, df_ho = database
+    sql = report_center.assemble_pnl(report_sql.pnl_aggregates(START, END))
+    assert_same(sql, report_center.generate_report_5(df_log, df_branch, df_ho))
+
+def test_rollups(database):
+    if not rollups.enabled(): pytest.skip("rollups are PostgreSQL only")
+    df_log, df_branch, df_ho = database
+    aggregates = rollups.branch_summary_aggregates(START, END, report_center.HO_NAME, report_center.NAME_MAP, report_center.RECEIPT_AT_HO)
+    assert_same(report_center.assemble_branch_summary(*aggregates), report_center.generate_report_1(df_log, df_branch, df_ho))
+    assert rollups.pnl_aggregates(START, END) == pytest.approx(report_sql.pnl_aggregates(START, END))
+    assert_same(report_center.assemble_pnl(rollups.pnl_aggregates(START, END)), report_center.generate_report_5(df_log, df_branch, df_ho))
+
+def test_build_reports(database):
+    # The production path: rollups on PostgreSQL, report_sql on DuckDB
+    df_log, df_branch, df_ho = database
+    r1, r2, r3, r5 = report_center.build_reports(START, END)
+    assert_same(r1, report_center.generate_report_1(df_log, df_branch, df_ho))
+    assert_same(r2, report_center.generate_report_2(df_log))
+    assert_same(r3, report_center.generate_report_3(df_log))
+    assert_same(r5, report_center.generate_report_5(df_log, df_branch, df_ho))
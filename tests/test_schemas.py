@@ -0,0 +1,22 @@
+import pandas as pd
+
+import schemas
+
+def chunk(sales_types, destinations):
+    df = pd.DataFrame({"sales_type": sales_types, "destination": destinations, "sales_amount": [1] * len(sales_types)})
+    return schemas.apply_schema(df, "master_data")
+
+def test_normalized_categories_are_sorted():
+    df = chunk(["to pay", "PAID", None, " paid "], ["B", "A", "B", "C"])
+    assert list(df["sales_type"].cat.categories) == ["NONE", "PAID", "TO PAY"]
+    assert df["sales_type"].tolist() == ["TO PAY", "PAID", "NONE", "PAID"]
+
+def test_concat_keeps_categories_sorted_across_chunks():
+    # Each chunk only sees some of the values; the first chunk's are the later ones
+    chunks = [chunk(["TO PAY", "to pay"], ["RAXAUL", "MOTIHARI"]), chunk(["PAID", "BILLED"], ["DARBHANGA", "RAXAUL"])]
+    df = schemas.concat(chunks)
+    assert list(df["sales_type"].cat.categories) == ["BILLED", "PAID", "TO PAY"]
+    assert list(df["destination"].cat.categories) == ["DARBHANGA", "MOTIHARI", "RAXAUL"]
+    assert df["sales_type"].tolist() == ["TO PAY", "TO PAY", "PAID", "BILLED"]
+    by_type = df.groupby("sales_type", observed=True)["sales_amount"].sum()
+    assert list(by_type.index) == ["BILLED", "PAID", "TO PAY"]